@@ -0,0 +1,22 @@
+#!/usr/bin/env bash
+# Собирает zip облачной функции: main.py, requirements.txt и общее ядро extraction_core рядом с main.py.
+# Запуск из любой папки: cloud-functions/partner_processor/build.sh [путь к zip]
+# По умолчанию архив пишется в cloud-functions/partner_processor/dist/partner_processor.zip
+set -euo pipefail
+
+FUNCTION_DIR="$(cd "$(dirname "$0")" && pwd)"
+REPO_ROOT="$(cd "$FUNCTION_DIR/../.." && pwd)"
+OUT="${1:-$FUNCTION_DIR/dist/partner_processor.zip}"
+mkdir -p "$(dirname "$OUT")"
+OUT="$(cd "$(dirname "$OUT")" && pwd)/$(basename "$OUT")"
+
+BUILD_DIR="$(mktemp -d)"
+trap 'rm -rf "$BUILD_DIR"' EXIT
+
+cp "$FUNCTION_DIR/main.py" "$FUNCTION_DIR/requirements.txt" "$BUILD_DIR/"
+cp -R "$REPO_ROOT/extraction_core" "$BUILD_DIR/extraction_core"
+find "$BUILD_DIR" -name "__pycache__" -type d -prune -exec rm -rf {} +
+
+rm -f "$OUT"
+(cd "$BUILD_DIR" && zip -qr "$OUT" .)
+echo "$OUT"
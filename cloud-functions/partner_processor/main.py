@@ -4,11 +4,64 @@ import json
 import os
 import re
 import traceback
-from typing import Any, Dict, List, Optional, Tuple
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import openpyxl
 import pandas as pd
-import requests
 
+# Общее ядро извлечения: build.sh кладет папку extraction_core рядом с main.py в архив функции
+from extraction_core import (
+    classify_by_keywords,
+    extract_number_regex,
+    find_header_offset,
+    get_chunk_planner,
+    get_llm_metrics,
+    get_llm_cache,
+    normalize_header,
+    parse_json_array,
+    prepare_keywords,
+    prompt_version,
+    yandex_completion,
+)
+
+
+# Кэш ответов LLM в /tmp живет между вызовами на "теплом" инстансе функции
+LLM_CACHE_PATH = "/tmp/llm_cache.sqlite"
+# Бюджет на один вызов YandexGPT вместе с повторами (сек), с запасом до таймаута функции
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))
+# Стартовые оценки длины ответа на одну строку (токены) для планировщика чанков
+EXTRACT_OUTPUT_TOKENS = 60
+NUMBERS_OUTPUT_TOKENS = 14
+CLASSIFY_OUTPUT_TOKENS = 12
+
+NUMBERS_SYSTEM_PROMPT = (
+    "Извлеки номер документа из текста. Верни JSON массив "
+    "объектов {id:number, number:string}. Только JSON."
+)
+
+EXTRACT_SYSTEM_PROMPT = (
+    "Ты извлекаешь строки сверки поставщика из таблицы. "
+    "Верни только JSON массив объектов "
+    "{id:number, date:string, text:string, number:string, sum:string}. "
+    "Исключай строки без даты/суммы/текста. "
+    "sum верни числом в строке, точка как разделитель."
+)
+
+CLASSIFY_SYSTEM_PROMPT = (
+    "Классифицируй строки сверки. Оставь только расходы клиента "
+    "и корректировки. Исключи оплаты/платежи/поручения. "
+    "Верни JSON массив {id:number, include:boolean}."
+)
+
+# Сколько первых строк листа держим в памяти для поиска шапки/колонок,
+# остальные строки идут потоком
+HEAD_ROWS = 200
+
+# Ключевые слова для локального префильтра semantic_filter
+# (те же, что в UniversalProcessor.enrich_with_doc_numbers)
+SEMANTIC_EXCLUDE_KEYWORDS = ["платежное", "поступление", "оплата", "списание", "перечислено", "приход"]
+SEMANTIC_INCLUDE_KEYWORDS = ["реализация", "упд", "продажа", "корректировка", "акт"]
 
 DATE_RE = re.compile(r"^\d{1,2}[./]\d{1,2}[./]\d{2,4}$")
 NUMERIC_RE = re.compile(r"^-?\d+([ \u00A0]\d{3})*(?:[.,]\d+)?$")
@@ -26,7 +79,7 @@ def handler(event, context):
         return _response(400, {"error": f"Invalid request body: {exc}"})
 
     file_name = payload.get("fileName")
-    file_b64 = payload.get("fileBase64")
+    file_b64 = payload.pop("fileBase64", None)
     options = payload.get("options") or {}
     if not file_b64:
         return _response(400, {"error": "fileBase64 is required"})
@@ -35,6 +88,10 @@ def handler(event, context):
         file_bytes = base64.b64decode(file_b64)
     except Exception as exc:
         return _response(400, {"error": f"Invalid base64: {exc}"})
+    # base64-строка больше не нужна, не держим ее рядом с байтами файла
+    file_b64 = None
+    # Метрики LLM процесс-глобальные: на "теплом" инстансе считаем их с нуля для каждого вызова
+    get_llm_metrics().reset()
 
     try:
         rows = process_excel(file_bytes, file_name or "file", options)
@@ -45,21 +102,19 @@ def handler(event, context):
         print(f"Traceback: {safe_traceback}")
         return _response(500, {"error": f"Processing failed: {safe_error}"})
 
-    return _response(200, {"rows": rows, "meta": {"rowCount": len(rows)}})
+    llm_metrics = get_llm_metrics().summary()
+    if llm_metrics:
+        print(f"LLM metrics: {json.dumps(llm_metrics, ensure_ascii=True)}")
+    return _response(200, {"rows": rows, "meta": {"rowCount": len(rows), "llm": llm_metrics}})
 
 
 def process_excel(file_bytes: bytes, file_name: str, options: Dict[str, Any]):
-    xl = pd.ExcelFile(io.BytesIO(file_bytes))
     all_rows: List[List[str]] = []
-    for sheet in xl.sheet_names:
-        df = xl.parse(sheet_name=sheet, header=None, dtype=str)
-        data = df.fillna("").values.tolist()
-        if not data:
-            continue
+    for sheet, sheet_rows in iter_excel_sheets(file_bytes):
         if options.get("llmExtract"):
-            rows = extract_rows_llm(data, file_name, sheet, options)
+            rows = extract_rows_llm(sheet_rows, file_name, sheet, options)
         else:
-            rows = extract_rows(data, file_name, options)
+            rows = extract_rows(sheet_rows, file_name, options)
         all_rows.extend(rows)
 
     if options.get("semantic", True):
@@ -68,15 +123,54 @@ def process_excel(file_bytes: bytes, file_name: str, options: Dict[str, Any]):
     return all_rows
 
 
+def iter_excel_sheets(file_bytes: bytes) -> Iterator[Tuple[str, Iterator[List[str]]]]:
+    """
+    Отдает (имя листа, ленивый итератор строк). Строки — списки строк,
+    как раньше давал xl.parse(dtype=str).fillna("").
+    xlsx читается openpyxl в read-only режиме, память не растет с размером листа.
+    Старый .xls (не zip) читается через pandas целиком.
+    """
+    if not file_bytes.startswith(b"PK"):
+        xl = pd.ExcelFile(io.BytesIO(file_bytes))
+        for sheet in xl.sheet_names:
+            df = xl.parse(sheet_name=sheet, header=None, dtype=str)
+            yield sheet, (list(row) for row in df.fillna("").itertuples(index=False))
+        return
+
+    workbook = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        for ws in workbook.worksheets:
+            yield ws.title, (
+                [cell_to_str(value) for value in row]
+                for row in ws.iter_rows(values_only=True)
+            )
+    finally:
+        workbook.close()
+
+
+def cell_to_str(value: Any) -> str:
+    # Повторяем приведение pandas (read_excel, dtype=str)
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
 def extract_rows(
-    data: List[List[str]], file_name: str, options: Dict[str, Any]
+    data: Iterable[List[str]], file_name: str, options: Dict[str, Any]
 ) -> List[List[str]]:
-    blocks = detect_blocks(data)
+    data = iter(data)
+    head = list(islice(data, HEAD_ROWS))
+    if not head:
+        return []
+    rows_stream = chain(head, data)
+    blocks = detect_blocks(head)
     if blocks:
-        rows = extract_from_blocks(data, blocks)
+        rows = extract_from_blocks(rows_stream, blocks)
     else:
-        columns = detect_columns(data)
-        rows = extract_from_columns(data, columns)
+        columns = detect_columns(head)
+        rows = extract_from_columns(rows_stream, columns)
 
     number_mode = options.get("numberMode", "regex_first")
     rows = apply_number_extraction(rows, number_mode, options)
@@ -84,83 +178,74 @@ def extract_rows(
 
 
 def extract_rows_llm(
-    data: List[List[str]],
+    data: Iterable[List[str]],
     file_name: str,
     sheet_name: str,
     options: Dict[str, Any],
 ) -> List[List[str]]:
     api_key, folder_id, model = get_yandex_config()
     max_chars = int(options.get("llmMaxChars", 120000))
+    # Потолок строк листа в одном запросе; строки сверх него уходят следующими запросами
     max_rows = int(options.get("llmMaxRows", 500))
     header_rows = int(options.get("llmHeaderRows", 8))
     max_cell_len = int(options.get("llmCellMax", 120))
 
-    rows_payload = build_rows_payload(data, max_cell_len)
-
-    if not rows_payload:
-        return []
+    # Один проход по строкам: храним только короткий текст непустой строки
+    rows_payload = collect_llm_rows(data, max_cell_len)
 
-    user_text = json.dumps(
-        {"fileName": file_name, "sheetName": sheet_name, "rows": rows_payload},
+    # Лист, который не влезает в один запрос, уходит несколькими — строки не отбрасываются;
+    # шапка листа (первые header_rows строк) повторяется в каждом, чтобы модель видела колонки
+    header_payload = [row for row in rows_payload if row["id"] < header_rows]
+    body_payload = [row for row in rows_payload if row["id"] >= header_rows]
+    header_text = json.dumps(
+        {"fileName": file_name, "sheetName": sheet_name, "rows": header_payload},
         ensure_ascii=True,
     )
+    fixed_text = EXTRACT_SYSTEM_PROMPT + header_text
+    if not body_payload:
+        return []
+    texts = [json.dumps(row, ensure_ascii=True) for row in body_payload]
+    planner = get_chunk_planner(model, "extract_rows", EXTRACT_OUTPUT_TOKENS)
+    plan = planner.plan(
+        texts,
+        fixed_text,
+        max_items=max_rows,
+        max_chars=max(1, max_chars - len(header_text)),
+    )
     print(
-        "LLM extract input chars: %s rows: %s sheet: %s"
-        % (len(user_text), len(rows_payload), sheet_name)
+        "LLM extract rows: %s requests: %s sheet: %s"
+        % (len(body_payload), len(plan), sheet_name)
     )
-    if len(user_text) > max_chars:
-        rows_payload = compress_rows_for_llm(
-            data,
-            header_rows=header_rows,
-            max_rows=max_rows,
-            max_cell_len=max_cell_len,
-        )
-        user_text = json.dumps(
-            {"fileName": file_name, "sheetName": sheet_name, "rows": rows_payload},
-            ensure_ascii=True,
-        )
-        print(
-            "LLM extract compressed chars: %s rows: %s sheet: %s"
-            % (len(user_text), len(rows_payload), sheet_name)
-        )
-    if len(user_text) > max_chars:
-        raise RuntimeError(
-            "LLM extract payload too large for single request: "
-            f"{len(user_text)} chars > {max_chars} chars"
-        )
 
-    payload = {
-        "modelUri": f"gpt://{folder_id}/{model}",
-        "completionOptions": {"stream": False, "temperature": 0, "maxTokens": 1200},
-        "messages": [
+    def request(chunk: List[int]) -> Tuple[List[Any], Dict[str, Any]]:
+        chunk_text = json.dumps(
             {
-                "role": "system",
-                "text": (
-                    "Ты извлекаешь строки сверки поставщика из таблицы. "
-                    "Верни только JSON массив объектов "
-                    "{id:number, date:string, text:string, number:string, sum:string}. "
-                    "Исключай строки без даты/суммы/текста. "
-                    "sum верни числом в строке, точка как разделитель."
-                ),
+                "fileName": file_name,
+                "sheetName": sheet_name,
+                "rows": header_payload + [body_payload[i] for i in chunk],
             },
-            {"role": "user", "text": user_text},
-        ],
-    }
-    json_payload_bytes = json.dumps(payload, ensure_ascii=True).encode("utf-8")
-    response = requests.post(
-        "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-        headers={
-            "Authorization": f"Api-Key {api_key}",
-            "Content-Type": "application/json; charset=utf-8",
-        },
-        data=json_payload_bytes,
-        timeout=120,
-    )
-    response.raise_for_status()
-    message = response.json()["result"]["alternatives"][0]["message"]["text"]
-    items = parse_json_array(message)
+            ensure_ascii=True,
+        )
+        details = yandex_completion(
+            api_key,
+            folder_id,
+            model,
+            EXTRACT_SYSTEM_PROMPT,
+            chunk_text,
+            max_tokens=planner.max_tokens,
+            deadline=LLM_DEADLINE,
+            details=True,
+        )
+        return parse_json_array(details["text"]), details
+
+    concurrency = max(1, int(options.get("llmConcurrency", 4)))
+    items = [
+        item
+        for _, chunk_items in planner.run(texts, plan, request, fixed_text, max_workers=concurrency)
+        for item in chunk_items
+    ]
     results: List[List[str]] = []
-    for item in items or []:
+    for item in items:
         if not isinstance(item, dict):
             continue
         date_val = str(item.get("date") or "").strip()
@@ -205,11 +290,12 @@ def detect_blocks(data: List[List[str]]):
     return blocks
 
 
-def extract_from_blocks(data: List[List[str]], blocks: List[Dict[str, int]]):
+def extract_from_blocks(data: Iterable[List[str]], blocks: List[Dict[str, int]]):
     start_row = blocks[0]["headerRowIndex"]
     rows = []
-    for i in range(start_row, len(data)):
-        row = data[i]
+    for i, row in enumerate(data):
+        if i < start_row:
+            continue
         if not "".join(str(x) for x in row).strip():
             continue
         for block in blocks:
@@ -225,7 +311,8 @@ def extract_from_blocks(data: List[List[str]], blocks: List[Dict[str, int]]):
 
 
 def detect_columns(data: List[List[str]]):
-    column_count = len(data[0]) if data else 0
+    # В потоковом чтении строки могут быть разной длины
+    column_count = max((len(row) for row in data), default=0)
     scores = []
     for col in range(column_count):
         date_score = sum_score = text_score = 0
@@ -247,7 +334,7 @@ def detect_columns(data: List[List[str]]):
     return {"date": date_col, "sum": sum_col, "text": text_col}
 
 
-def extract_from_columns(data: List[List[str]], columns: Dict[str, int]):
+def extract_from_columns(data: Iterable[List[str]], columns: Dict[str, int]):
     rows = []
     for row in data:
         date_val = get_cell(row, columns["date"])
@@ -289,112 +376,143 @@ def extract_numbers_llm(texts: List[str], options: Dict[str, Any]):
     if not texts:
         return []
     api_key, folder_id, model = get_yandex_config()
-    payload = {
-        "modelUri": f"gpt://{folder_id}/{model}",
-        "completionOptions": {"stream": False, "temperature": 0, "maxTokens": 800},
-        "messages": [
-            {
-                "role": "system",
-                "text": (
-                    "Извлеки номер документа из текста. Верни JSON массив "
-                    "объектов {id:number, number:string}. Только JSON."
-                ),
-            },
-            {
-                "role": "user",
-                "text": json.dumps(
-                    [{"id": i, "text": t} for i, t in enumerate(texts)],
-                    ensure_ascii=True,
-                ),
-            },
-        ],
-    }
-    json_payload_bytes = json.dumps(payload, ensure_ascii=True).encode("utf-8")
-    response = requests.post(
-        "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-        headers={
-            "Authorization": f"Api-Key {api_key}",
-            "Content-Type": "application/json; charset=utf-8",
-        },
-        data=json_payload_bytes,
-        timeout=120,
-    )
-    response.raise_for_status()
-    message = response.json()["result"]["alternatives"][0]["message"]["text"]
-    items = parse_json_array(message)
-    results = [""] * len(texts)
-    for item in items:
-        if isinstance(item, dict) and "id" in item:
-            results[int(item["id"])] = str(item.get("number") or "")
+
+    # Сначала смотрим в кэш, в LLM уходят только уникальные промахи
+    cache = get_numbers_cache(options)
+    version = prompt_version(NUMBERS_SYSTEM_PROMPT)
+    cached: Dict[str, Any] = {}
+    if cache is not None:
+        try:
+            cached = cache.get_many(texts, "numbers", model, version)
+        except Exception as exc:
+            print(f"LLM cache read failed: {exc}")
+    missing = list(dict.fromkeys(t for t in texts if t not in cached))
+    if cache is not None:
+        print(
+            "LLM numbers cache: hits %s misses %s stats %s"
+            % (len(texts) - len(missing), len(missing), cache.stats())
+        )
+
+    fetched: Dict[str, str] = {}
+    if missing:
+        concurrency = max(1, int(options.get("llmConcurrency", 4)))
+        fetched = request_numbers_llm(missing, api_key, folder_id, model, concurrency)
+        if cache is not None:
+            try:
+                cache.set_many(fetched, "numbers", model, version)
+            except Exception as exc:
+                print(f"LLM cache write failed: {exc}")
+
+    results = []
+    for text in texts:
+        if text in cached:
+            results.append(cached[text] or "")
+        else:
+            results.append(fetched.get(text, ""))
     return results
 
 
-def semantic_filter(rows: List[List[str]], options: Dict[str, Any]):
-    api_key, folder_id, model = get_yandex_config()
-    batch_size = int(options.get("semanticBatch", 200))
-    filtered = []
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i : i + batch_size]
-        payload = {
-            "modelUri": f"gpt://{folder_id}/{model}",
-            "completionOptions": {"stream": False, "temperature": 0, "maxTokens": 800},
-            "messages": [
-                {
-                    "role": "system",
-                    "text": (
-                        "Классифицируй строки сверки. Оставь только расходы клиента "
-                        "и корректировки. Исключи оплаты/платежи/поручения. "
-                        "Верни JSON массив {id:number, include:boolean}."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "text": json.dumps(
-                        [{"id": idx, "text": row[1]} for idx, row in enumerate(batch)],
-                        ensure_ascii=True,
-                    ),
-                },
-            ],
-        }
-        json_payload_bytes = json.dumps(payload, ensure_ascii=True).encode("utf-8")
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {api_key}",
-                "Content-Type": "application/json; charset=utf-8",
-            },
-            data=json_payload_bytes,
-            timeout=120,
+def request_numbers_llm(
+    texts: List[str], api_key: str, folder_id: str, model: str, concurrency: int = 1
+) -> Dict[str, str]:
+    planner = get_chunk_planner(model, "numbers", NUMBERS_OUTPUT_TOKENS)
+    encoded = [json.dumps(t, ensure_ascii=True) for t in texts]
+    plan = planner.plan(encoded, NUMBERS_SYSTEM_PROMPT)
+
+    def request(chunk: List[int]) -> Tuple[List[Any], Dict[str, Any]]:
+        details = yandex_completion(
+            api_key,
+            folder_id,
+            model,
+            NUMBERS_SYSTEM_PROMPT,
+            json.dumps([{"id": pos, "text": texts[i]} for pos, i in enumerate(chunk)], ensure_ascii=True),
+            max_tokens=planner.max_tokens,
+            deadline=LLM_DEADLINE,
+            details=True,
         )
-        response.raise_for_status()
-        message = response.json()["result"]["alternatives"][0]["message"]["text"]
-        items = parse_json_array(message)
-        allowed = {int(item["id"]) for item in items if item.get("include")}
-        for idx, row in enumerate(batch):
-            if idx in allowed:
-                filtered.append(row)
-    return filtered
-
-
-def parse_json_array(text: str):
-    trimmed = text.strip()
-    fenced = re.search(r"```(?:json)?\s*([\s\S]*?)```", trimmed, re.IGNORECASE)
-    if fenced:
-        trimmed = fenced.group(1).strip()
-    start = trimmed.find("[")
-    end = trimmed.rfind("]")
-    if start != -1 and end != -1:
-        try:
-            return json.loads(trimmed[start : end + 1])
-        except Exception:
-            pass
-    items = []
-    for match in re.finditer(r"\{[^}]*\}", trimmed):
-        try:
-            items.append(json.loads(match.group(0)))
-        except Exception:
-            continue
-    return items
+        return parse_json_array(details["text"]), details
+
+    # В кэш попадают только те id, которые модель действительно вернула
+    results: Dict[str, str] = {}
+    for chunk, items in planner.run(encoded, plan, request, NUMBERS_SYSTEM_PROMPT, max_workers=concurrency):
+        for item in items:
+            if isinstance(item, dict) and "id" in item:
+                pos = int(item["id"])
+                if 0 <= pos < len(chunk):
+                    results[texts[chunk[pos]]] = str(item.get("number") or "")
+    return results
+
+
+def get_numbers_cache(options: Dict[str, Any]):
+    if not options.get("llmCache", True):
+        return None
+    try:
+        return get_llm_cache(options.get("llmCachePath") or LLM_CACHE_PATH)
+    except Exception as exc:
+        print(f"LLM cache unavailable: {exc}")
+        return None
+
+
+def semantic_filter(rows: List[List[str]], options: Dict[str, Any]):
+    decisions = prefilter_rows(rows, options)
+    ambiguous = [idx for idx, decision in enumerate(decisions) if decision is None]
+    print(
+        "Semantic prefilter: include %s exclude %s ambiguous %s"
+        % (decisions.count(True), decisions.count(False), len(ambiguous))
+    )
+
+    if ambiguous:
+        api_key, folder_id, model = get_yandex_config()
+        batch_size = int(options.get("semanticBatch", 200))
+        concurrency = max(1, int(options.get("semanticConcurrency", 4)))
+        planner = get_chunk_planner(model, "classify", CLASSIFY_OUTPUT_TOKENS)
+        encoded = [json.dumps(rows[i][1], ensure_ascii=True) for i in ambiguous]
+        plan = planner.plan(encoded, CLASSIFY_SYSTEM_PROMPT, max_items=batch_size)
+
+        def run_batch(chunk: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+            allowed, details = classify_rows_llm(
+                [rows[ambiguous[j]][1] for j in chunk], api_key, folder_id, model, planner.max_tokens
+            )
+            return [ambiguous[chunk[pos]] for pos in allowed], details
+
+        for _, included in planner.run(encoded, plan, run_batch, CLASSIFY_SYSTEM_PROMPT, max_workers=concurrency):
+            for idx in included:
+                decisions[idx] = True
+
+    return [row for row, decision in zip(rows, decisions) if decision]
+
+
+def prefilter_rows(rows: List[List[str]], options: Dict[str, Any]) -> List[Optional[bool]]:
+    """
+    Локальная классификация по ключевым словам: True — оставить, False — исключить,
+    None — неоднозначно, решает LLM. Правила настраиваются через options.
+    """
+    if not options.get("semanticPrefilter", True):
+        return [None] * len(rows)
+    exclude = prepare_keywords(options.get("semanticExcludeKeywords", SEMANTIC_EXCLUDE_KEYWORDS))
+    include = prepare_keywords(options.get("semanticIncludeKeywords", SEMANTIC_INCLUDE_KEYWORDS))
+    return [classify_by_keywords(row[1], exclude, include) for row in rows]
+
+
+def classify_rows_llm(
+    texts: List[str], api_key: str, folder_id: str, model: str, max_tokens: int = 800
+) -> Tuple[List[int], Dict[str, Any]]:
+    """Позиции текстов, которые LLM предлагает оставить, и details ответа (обрезка, токены)."""
+    details = yandex_completion(
+        api_key,
+        folder_id,
+        model,
+        CLASSIFY_SYSTEM_PROMPT,
+        json.dumps([{"id": idx, "text": text} for idx, text in enumerate(texts)], ensure_ascii=True),
+        max_tokens=max_tokens,
+        deadline=LLM_DEADLINE,
+        details=True,
+    )
+    items = parse_json_array(details["text"])
+    allowed = {
+        int(item["id"]) for item in items if isinstance(item, dict) and item.get("include")
+    }
+    return sorted(idx for idx in allowed if 0 <= idx < len(texts)), details
 
 
 def normalize_sum(value: str) -> str:
@@ -417,70 +535,14 @@ def build_row_text(row: List[str], max_cell_len: int = 120) -> str:
     return " | ".join(parts)
 
 
-def build_rows_payload(data: List[List[str]], max_cell_len: int) -> List[Dict[str, Any]]:
-    rows_payload = []
+def collect_llm_rows(data: Iterable[List[str]], max_cell_len: int) -> List[Dict[str, Any]]:
+    """{id строки, текст строки} для всех непустых строк листа."""
+    rows = []
     for idx, row in enumerate(data):
         row_text = build_row_text(row, max_cell_len)
         if row_text:
-            rows_payload.append({"id": idx, "text": row_text})
-    return rows_payload
-
-
-def compress_rows_for_llm(
-    data: List[List[str]],
-    header_rows: int,
-    max_rows: int,
-    max_cell_len: int,
-) -> List[Dict[str, Any]]:
-    candidates = []
-    for idx, row in enumerate(data):
-        if idx < header_rows:
-            row_text = build_row_text(row, max_cell_len)
-            if row_text:
-                candidates.append((idx, row_text, 1000))
-            continue
-        score = row_signal_score(row)
-        if score <= 0:
-            continue
-        row_text = build_row_text(row, max_cell_len)
-        if row_text:
-            candidates.append((idx, row_text, score))
-
-    if max_rows and len(candidates) > max_rows:
-        top = sorted(candidates, key=lambda x: x[2], reverse=True)[:max_rows]
-        selected = sorted(top, key=lambda x: x[0])
-    else:
-        selected = sorted(candidates, key=lambda x: x[0])
-
-    return [{"id": idx, "text": text} for idx, text, _ in selected]
-
-
-def row_signal_score(row: List[str]) -> int:
-    score = 0
-    nonempty = 0
-    joined_parts = []
-    for cell in row:
-        if cell is None:
-            continue
-        text = str(cell).strip()
-        if not text:
-            continue
-        nonempty += 1
-        joined_parts.append(text)
-        if is_date(text):
-            score += 3
-        if is_numeric(text):
-            score += 2
-        if "№" in text:
-            score += 1
-    if not nonempty:
-        return 0
-    joined = " ".join(joined_parts).lower()
-    for keyword in ("дата", "документ", "дебет", "кредит", "сумма", "итого", "сальдо"):
-        if keyword in joined:
-            score += 2
-    score += min(nonempty, 5)
-    return score
+            rows.append({"id": idx, "text": row_text})
+    return rows
 
 
 def is_date(value: str) -> bool:
@@ -494,38 +556,12 @@ def is_numeric(value: str) -> bool:
     return bool(NUMERIC_RE.match(text))
 
 
-def extract_number_regex(text: str) -> str:
-    if not text:
-        return ""
-    m = re.search(r"№\s*([A-Za-zА-Яа-я0-9/-]+)", text)
-    if m:
-        return m.group(1)
-    m = re.search(r"\b\d{2,}\b", text)
-    if m:
-        return m.group(0)
-    m = re.search(r"[A-Za-zА-Яа-я0-9/-]{3,}", text)
-    return m.group(0) if m else ""
-
-
 def get_cell(row: List[str], col: int) -> str:
     if not col or col < 1 or col > len(row):
         return ""
     return str(row[col - 1]).strip() if row[col - 1] is not None else ""
 
 
-def normalize_header(value: Any) -> str:
-    if value is None:
-        return ""
-    return re.sub(r"\s+", " ", str(value)).strip().lower().replace("«", "").replace("»", "").replace('"', "").replace("'", "")
-
-
-def find_header_offset(header_row: List[str], start_index: int, header_name: str) -> int:
-    for idx in range(start_index, len(header_row)):
-        if normalize_header(header_row[idx]) == header_name:
-            return idx + 1
-    return 0
-
-
 def pick_best(scores: List[Tuple[int, int, int]], key_index: int, exclude=None):
     exclude = exclude or []
     best_col = 0
@@ -0,0 +1,33 @@
+"""
+Общее ядро извлечения данных для локального процессора (local_processor)
+и облачной функции (cloud-functions/partner_processor):
+нормализация и поиск заголовков, извлечение номеров документов,
+разбор JSON из ответов LLM, нарезка запросов по бюджету токенов,
+клиент LLM (YandexGPT, Ollama) с пулом соединений, повторами, дедлайнами
+и метриками, пакетные запросы, кэш ответов и общее SQLite-хранилище кэшей с LRU-вытеснением.
+
+Пакет без тяжелых зависимостей (только requests), чтобы его можно было
+положить рядом с main.py облачной функции. Бенчмарки: python -m extraction_core.bench
+"""
+from .chunking import ChunkPlanner, estimate_tokens, get_chunk_planner, model_limits
+from .headers import analyze_header_rows, best_system, build_label_index
+from .json_repair import StreamingPairParser, extract_rows_from_parsed, parse_json_array, parse_llm_json
+from .llm import (
+    LLMClient,
+    LLMDeadlineExceeded,
+    LLMMetrics,
+    chunked,
+    get_llm_client,
+    get_llm_metrics,
+    run_batches,
+    yandex_completion,
+)
+from .llm_cache import LLMCache, get_llm_cache, normalize_cache_text, prompt_version
+from .numbers import (
+    RULE_CONFIDENCE_THRESHOLD,
+    extract_doc_number_rules,
+    extract_number_regex,
+    normalize_doc_number,
+)
+from .sqlite_store import SQLiteLRUStore, get_shared
+from .text import classify_by_keywords, find_header_offset, normalize_header, prepare_keywords
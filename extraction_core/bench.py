@@ -0,0 +1,152 @@
+"""
+Общие бенчмарки ядра извлечения. Одинаково гоняются локально и перед деплоем облачной функции.
+
+Запуск (из корня репозитория):
+    python -m extraction_core.bench [--scale 1.0] [--strict]
+
+--strict завершает процесс с кодом 1, если какой-то замер вышел за бюджет (мкс на операцию).
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from .chunking import ChunkPlanner
+from .headers import analyze_header_rows, build_label_index
+from .json_repair import StreamingPairParser, parse_json_array, parse_llm_json
+from .llm import chunked, run_batches
+from .numbers import extract_doc_number_rules, extract_number_regex
+from .text import classify_by_keywords, normalize_header, prepare_keywords
+
+# Бюджеты с большим запасом: ловим регрессии на порядок, а не шум
+BUDGETS_US = {
+    "normalize_header": 5.0,
+    "analyze_header_rows": 2000.0,
+    "extract_doc_number_rules": 60.0,
+    "extract_number_regex": 20.0,
+    "classify_by_keywords": 10.0,
+    "parse_llm_json": 400.0,
+    "parse_json_array_truncated": 800.0,
+    "run_batches": 20000.0,
+    "plan_chunks": 20000.0,
+    "stream_pairs": 2000.0,
+}
+
+BENCH_CONFIG = {
+    "IIKO": {"fields": [
+        {"key": "date", "labels": ["Дата"]},
+        {"key": "number", "labels": ["Входящий номер", "Номер"]},
+        {"key": "partner", "labels": ["Поставщик/Покупатель"]},
+        {"key": "sum", "labels": ["Сумма, р.", "Сумма"]},
+    ]},
+    "SBIS": {"fields": [
+        {"key": "date", "labels": ["Дата"]},
+        {"key": "number", "labels": ["Номер"]},
+        {"key": "partner", "labels": ["Контрагент"]},
+        {"key": "sum", "labels": ["Сумма"]},
+    ]},
+}
+
+DOC_TEXTS = [
+    "Продажа №20 от 12.01.2026 (сф 20/DP от 12.01.2026)",
+    "Реализация (акт, накладная) 5123 от 03.02.26",
+    "УПД № А-778/К от 01.01.2026",
+    "Оплата от покупателя, платежное поручение 889 от 10.01.26",
+    "Корректировка реализации 00012 (с/ф 12/DP)",
+    "Акт сверки взаимных расчетов",
+]
+
+
+def make_rows(rows):
+    random.seed(1)
+    data = [["Отчет", "", "", ""], ["", "", "", ""], ["Дата", "«Входящий номер»", "Поставщик/Покупатель", "Сумма,  р."]]
+    for i in range(rows):
+        data.append([f"{random.randint(1, 28):02d}.01.2026", str(i), f"ООО Поставщик {i % 40}", str(random.randint(1, 9999))])
+    return data
+
+
+def make_llm_answer(size):
+    items = [{"id": i, "number": f"{i}/DP"} for i in range(size)]
+    return "```json\n" + json.dumps(items, ensure_ascii=False) + "\n```"
+
+
+def measure(func, items, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / max(len(items), 1) * 1e6
+
+
+def run_suite(scale=1.0):
+    n = max(1, int(1000 * scale))
+    results = {}
+
+    headers = [cell for row in make_rows(50)[:3] for cell in row] * n
+    results["normalize_header"] = measure(normalize_header, headers)
+
+    label_index = build_label_index(BENCH_CONFIG)
+    sheets = [make_rows(200)] * max(1, n // 20)
+    results["analyze_header_rows"] = measure(lambda rows: analyze_header_rows(rows, BENCH_CONFIG, label_index), sheets)
+
+    texts = DOC_TEXTS * n
+    results["extract_doc_number_rules"] = measure(extract_doc_number_rules, texts)
+    results["extract_number_regex"] = measure(extract_number_regex, texts)
+
+    exclude = prepare_keywords(["платежное", "поступление", "оплата", "списание", "перечислено", "приход"])
+    include = prepare_keywords(["реализация", "упд", "продажа", "корректировка", "акт"])
+    results["classify_by_keywords"] = measure(lambda t: classify_by_keywords(t, exclude, include), texts)
+
+    answers = [make_llm_answer(50)] * max(1, n // 10)
+    results["parse_llm_json"] = measure(parse_llm_json, answers)
+    truncated = [a[:len(a) * 2 // 3] for a in answers]
+    results["parse_json_array_truncated"] = measure(parse_json_array, truncated)
+
+    # Накладные расходы пакетирования: 100 пустых "запросов" в 4 потока
+    batches = [chunked(list(range(5000)), 50)] * max(1, n // 100)
+    results["run_batches"] = measure(lambda b: run_batches(len, b, max_workers=4), batches)
+
+    # Потоковый разбор ответа {id: номер} на 50 строк кусками по 16 символов
+    stream_answer = json.dumps({str(i): f"{i}/DP" for i in range(50)})
+    deltas = [[stream_answer[i:i + 16] for i in range(0, len(stream_answer), 16)]] * max(1, n // 10)
+
+    def stream_pairs(parts):
+        parser = StreamingPairParser()
+        for part in parts:
+            parser.feed(part)
+        return parser.finish()
+
+    results["stream_pairs"] = measure(stream_pairs, deltas)
+
+    # Планирование 1000 строк под бюджет токенов модели
+    planner = ChunkPlanner("yandexgpt-lite", 12)
+    plan_texts = [DOC_TEXTS * 170] * max(1, n // 100)
+    results["plan_chunks"] = measure(lambda texts: planner.plan(texts, "системный промт"), plan_texts)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--strict", action="store_true")
+    args = parser.parse_args()
+
+    results = run_suite(args.scale)
+    failed = []
+    for name, us in results.items():
+        budget = BUDGETS_US[name]
+        mark = "ok" if us <= budget else "SLOW"
+        if us > budget:
+            failed.append(name)
+        print(f"  {name:<28} {us:10.2f} us/op   (budget {budget:.0f})  {mark}")
+    if args.strict and failed:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
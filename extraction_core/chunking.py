@@ -0,0 +1,179 @@
+import threading
+
+from .llm import run_batches
+
+# Лимиты моделей в токенах: окно контекста и потолок ответа (maxTokens / num_predict).
+# Ключ — имя модели без версии ("yandexgpt-lite/latest" -> "yandexgpt-lite").
+MODEL_LIMITS = {
+    "yandexgpt-lite": {"context": 32000, "max_output": 2000},
+    "yandexgpt": {"context": 32000, "max_output": 2000},
+}
+DEFAULT_MODEL_LIMITS = {"context": 4096, "max_output": 1000}
+# Доля окна, которую оставляем про запас на ошибку оценки токенов
+CONTEXT_MARGIN = 0.1
+# Обертка элемента в JSON запроса: id, кавычки, запятые
+ITEM_OVERHEAD_TOKENS = 6
+ITEM_CAP = 400
+
+
+def model_limits(model):
+    name = str(model or "").split("/")[0].lower()
+    return MODEL_LIMITS.get(name, DEFAULT_MODEL_LIMITS)
+
+
+def estimate_tokens(text):
+    """
+    Грубая оценка числа токенов без токенизатора: ~4 символа ASCII на токен,
+    ~2.5 символа кириллицы. Текст, который уйдет с ensure_ascii, оценивайте
+    в том виде, в каком он уйдет (\\uXXXX — шесть символов ASCII).
+    """
+    if not text:
+        return 0
+    text = str(text)
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return int((len(text) - non_ascii) / 4 + non_ascii / 2.5) + 1
+
+
+class ChunkPlanner:
+    """
+    Нарезка строк на запросы к LLM по бюджету токенов модели, а не по фиксированному числу строк.
+
+    Чанк набирается, пока оценка входа укладывается в окно контекста (минус ответ и запас),
+    а ожидаемый ответ (output_per_item на строку) — в потолок ответа модели.
+    observe() подстраивает план под факт: оценка входа калибруется по usage провайдера,
+    обрезанный ответ уменьшает чанк и увеличивает оценку ответа на строку,
+    полные ответы уточняют оценку ответа на строку и понемногу возвращают размер чанка вверх.
+    """
+    def __init__(self, model, output_per_item, max_items=ITEM_CAP):
+        limits = model_limits(model)
+        self.model = model
+        self.context = limits["context"]
+        self.max_output = limits["max_output"]
+        self.output_per_item = float(output_per_item)
+        self.item_cap = max_items
+        self.max_items = max_items
+        self.input_scale = 1.0
+        self._lock = threading.Lock()
+
+    @property
+    def max_tokens(self):
+        """Значение maxTokens для запросов по этому плану."""
+        return self.max_output
+
+    def item_tokens(self, text):
+        return estimate_tokens(text) + ITEM_OVERHEAD_TOKENS
+
+    def estimate(self, texts, fixed_text=""):
+        """Оценка входных токенов запроса: постоянная часть (промт, заголовки) плюс строки."""
+        raw = estimate_tokens(fixed_text) + sum(self.item_tokens(t) for t in texts)
+        return int(raw * self.input_scale)
+
+    def plan(self, texts, fixed_text="", max_items=None, max_chars=None):
+        """
+        Индексы texts, разбитые на чанки в исходном порядке.
+        fixed_text — то, что повторяется в каждом запросе (системный промт, шапка листа).
+        max_chars — дополнительный потолок длины строк чанка в символах.
+        Строка, которая одна не влезает в бюджет, уходит отдельным чанком.
+        """
+        with self._lock:
+            scale = self.input_scale
+            limit_items = self.max_items
+            output_per_item = self.output_per_item
+        if max_items:
+            limit_items = min(limit_items, max_items)
+        output_items = max(1, int(self.max_output / output_per_item))
+        limit_items = max(1, min(limit_items, output_items))
+        input_budget = self.context * (1 - CONTEXT_MARGIN) - self.max_output
+        input_budget -= estimate_tokens(fixed_text) * scale
+
+        chunks = []
+        current = []
+        tokens = 0.0
+        chars = 0
+        for idx, text in enumerate(texts):
+            item = self.item_tokens(text) * scale
+            size = len(str(text or ""))
+            if current and (
+                len(current) >= limit_items
+                or tokens + item > input_budget
+                or (max_chars and chars + size > max_chars)
+            ):
+                chunks.append(current)
+                current, tokens, chars = [], 0.0, 0
+            current.append(idx)
+            tokens += item
+            chars += size
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def observe(self, items, estimated_tokens=None, details=None):
+        """
+        Учитывает ответ на чанк из items строк.
+        details — словарь complete_details(): truncated, input_tokens, output_tokens.
+        """
+        details = details or {}
+        with self._lock:
+            actual = details.get("input_tokens") or 0
+            if estimated_tokens and actual:
+                # Скользящее среднее отношения факт/оценка, без резких скачков
+                ratio = min(4.0, max(0.25, actual / estimated_tokens * self.input_scale))
+                self.input_scale = 0.7 * self.input_scale + 0.3 * ratio
+            if details.get("truncated"):
+                # Половина обрезанного чанка; параллельные обрезки не должны схлопывать размер дальше
+                self.max_items = max(1, min(self.max_items, items // 2))
+                self.output_per_item = min(self.max_output, self.output_per_item * 1.5)
+                return
+            output = details.get("output_tokens") or 0
+            if output and items:
+                # Запас 20% к наблюдаемой длине ответа на строку
+                observed = max(1.0, output / items * 1.2)
+                self.output_per_item = 0.7 * self.output_per_item + 0.3 * observed
+            if items >= self.max_items:
+                self.max_items = min(self.item_cap, max(self.max_items + 1, int(self.max_items * 1.25)))
+
+    def run(self, texts, chunks, request, fixed_text="", max_workers=1, pending=None):
+        """
+        request(chunk) -> (value, details) по каждому чанку плана, до max_workers параллельно.
+        Обрезанный по лимиту ответ не теряется: чанк делится пополам и отправляется заново.
+        pending(chunk, value) -> строки чанка без ответа: если задан, из обрезанного ответа
+        берется уже разобранное, а заново отправляются только оставшиеся строки.
+        Возвращает [(chunk, value)] в исходном порядке, повторы — после обрезанного чанка.
+        """
+        def handle(chunk):
+            value, details = request(chunk)
+            self.observe(len(chunk), self.estimate([texts[i] for i in chunk], fixed_text), details)
+            if not (details and details.get("truncated") and len(chunk) > 1):
+                return [(chunk, value)]
+            done = []
+            rest = chunk
+            if pending is not None:
+                done = [(chunk, value)]
+                rest = pending(chunk, value)
+            if len(rest) <= 1:
+                parts = [rest] if rest else []
+            else:
+                mid = len(rest) // 2
+                parts = [rest[:mid], rest[mid:]]
+            print(f"[LLM] Ответ обрезан на чанке из {len(chunk)} строк, повторяем {len(rest)}: {' + '.join(str(len(p)) for p in parts) or '0'}")
+            return done + [pair for part in parts for pair in handle(part)]
+
+        return [pair for pairs in run_batches(handle, chunks, max_workers=max_workers) for pair in pairs]
+
+
+_planners = {}
+_planners_lock = threading.Lock()
+
+
+def get_chunk_planner(model, task, output_per_item, max_items=ITEM_CAP):
+    """
+    Один планировщик на (модель, задачу) на весь процесс: то, что он узнал
+    об обрезках и реальном числе токенов, переходит на следующие файлы.
+    """
+    key = (str(model), task)
+    with _planners_lock:
+        planner = _planners.get(key)
+        if planner is None:
+            planner = ChunkPlanner(model, output_per_item, max_items=max_items)
+            _planners[key] = planner
+        return planner
@@ -0,0 +1,66 @@
+from .text import normalize_header
+
+
+def build_label_index(system_config):
+    """
+    Инвертированный индекс меток: нормализованная метка -> [(система, поле, приоритет)].
+    system_config: {система: {"fields": [{"key": ..., "labels": [...]}, ...]}}.
+    Приоритет — позиция метки в списке labels поля (0 = самая предпочтительная).
+    """
+    index = {}
+    for system_name, config in system_config.items():
+        for field in config["fields"]:
+            for priority, label in enumerate(field["labels"]):
+                index.setdefault(normalize_header(label), []).append((system_name, field["key"], priority))
+    return index
+
+
+def analyze_header_rows(rows, system_config, label_index=None, max_rows=100):
+    """
+    Один проход по окну заголовков для всех систем сразу.
+    Каждая ячейка нормализуется один раз и ищется в индексе меток.
+    Возвращает {system: {"header_idx": int, "score": int, "col_map": {key: col|None}}}
+    только для систем, у которых нашлась хотя бы одна метка.
+    """
+    if label_index is None:
+        label_index = build_label_index(system_config)
+    best = {}
+    for i, row in enumerate(rows[:max_rows]):
+        row_fields = {}
+        for col, cell in enumerate(row):
+            norm = normalize_header(cell)
+            if not norm:
+                continue
+            hits = label_index.get(norm)
+            if not hits:
+                continue
+            for system_name, key, priority in hits:
+                fields = row_fields.setdefault(system_name, {})
+                current = fields.get(key)
+                # Берем самую приоритетную метку, при равенстве — первую колонку
+                if current is None or priority < current[0]:
+                    fields[key] = (priority, col)
+        for system_name, fields in row_fields.items():
+            prev = best.get(system_name)
+            if prev is None or len(fields) > prev[1]:
+                best[system_name] = (i, len(fields), fields)
+
+    analysis = {}
+    for system_name, (header_idx, score, fields) in best.items():
+        col_map = {field["key"]: None for field in system_config[system_name]["fields"]}
+        for key, (_, col) in fields.items():
+            col_map[key] = col
+        analysis[system_name] = {"header_idx": header_idx, "score": score, "col_map": col_map}
+    return analysis
+
+
+def best_system(analysis, system_order):
+    """Система с наибольшим числом найденных полей; при равенстве — первая по system_order."""
+    best_name = None
+    best_score = 0
+    for system_name in system_order:
+        info = analysis.get(system_name)
+        if info and info["score"] > best_score:
+            best_score = info["score"]
+            best_name = system_name
+    return best_name
@@ -0,0 +1,167 @@
+import json
+import re
+
+THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+FENCE_RE = re.compile(r"```[a-zA-Z]*\s*([\s\S]*?)```")
+FENCE_OPEN_RE = re.compile(r"^```[a-zA-Z]*\s*")
+OBJECT_RE = re.compile(r"\{[^{}]*\}")
+
+
+def _strip_wrapping(content):
+    # Рассуждения reasoning-моделей и markdown-ограждения вокруг JSON
+    cleaned = THINK_RE.sub("", content).strip() if "<think>" in content else content.strip()
+    if "```" in cleaned:
+        fenced = FENCE_RE.search(cleaned)
+        if fenced:
+            cleaned = fenced.group(1).strip()
+        else:
+            # Ответ обрезан до закрывающего ограждения
+            cleaned = FENCE_OPEN_RE.sub("", cleaned).strip()
+    return cleaned
+
+
+def parse_llm_json(content):
+    """
+    JSON из ответа LLM: сначала как есть, затем фрагмент от первой [ или {
+    до последней ] или }. None, если разобрать не удалось.
+    """
+    if not content:
+        return None
+    cleaned = _strip_wrapping(content)
+    if cleaned[:1] in ("[", "{"):
+        try:
+            return json.loads(cleaned)
+        except ValueError:
+            pass
+    start_candidates = [idx for idx in (cleaned.find("["), cleaned.find("{")) if idx != -1]
+    if not start_candidates:
+        return None
+    start = min(start_candidates)
+    end = max(cleaned.rfind("]"), cleaned.rfind("}"))
+    if end <= start:
+        return None
+    try:
+        return json.loads(cleaned[start:end + 1])
+    except ValueError:
+        return None
+
+
+def extract_rows_from_parsed(parsed):
+    """Список элементов из разобранного ответа: сам список, первый список в объекте или {"0": ..., "1": ...}."""
+    if isinstance(parsed, list):
+        return parsed
+    if isinstance(parsed, dict):
+        if "numbers" in parsed and isinstance(parsed["numbers"], list):
+            return parsed["numbers"]
+        for value in parsed.values():
+            if isinstance(value, list):
+                return value
+        keys = list(parsed.keys())
+        if all(k.isdigit() for k in keys):
+            return [parsed[k] for k in sorted(keys, key=int)]
+        if any(k in parsed for k in ("date", "text", "amount", "doc_number", "number")):
+            return [parsed]
+    return None
+
+
+def parse_json_array(text):
+    """
+    Массив объектов из ответа LLM. Если целиком JSON не разбирается
+    (например, ответ обрезан по maxTokens), собирает уцелевшие объекты по одному.
+    """
+    rows = extract_rows_from_parsed(parse_llm_json(text))
+    if rows is not None:
+        return rows
+    items = []
+    for match in OBJECT_RE.finditer(_strip_wrapping(text or "")):
+        try:
+            items.append(json.loads(match.group(0)))
+        except ValueError:
+            continue
+    return items
+
+
+# Пара "id": значение верхнего уровня; значение завершено, если за ним идет , или }
+PAIR_RE = re.compile(r'"(\d+)"\s*:\s*(null|"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?)\s*(?=[,}])')
+# В конце обрезанного ответа строка в кавычках или null тоже завершены
+TAIL_PAIR_RE = re.compile(r'"(\d+)"\s*:\s*(null|"(?:[^"\\]|\\.)*")\s*$')
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _pair_value(raw):
+    if raw == "null":
+        return None
+    if raw.startswith('"'):
+        return json.loads(raw)
+    return raw
+
+
+class StreamingPairParser:
+    """
+    Разбор ответа {id: номер} по мере поступления текста (потоковый режим LLM).
+    feed() возвращает новые завершенные пары [(id, значение)], блоки <think> пропускаются,
+    markdown-ограждения не мешают. Если поток оборвался, finish() отдает все,
+    что успело прийти целиком, — обрезанный ответ не теряет уже готовые строки.
+    """
+    def __init__(self):
+        self.pairs = {}
+        self._raw = ""
+        self._raw_pos = 0
+        self._in_think = False
+        self._visible = ""
+        self._pos = 0
+
+    def _advance_visible(self, final=False):
+        # Видимый текст только дописывается: блок <think> вырезается, когда закрыт
+        while True:
+            if self._in_think:
+                end = self._raw.find(THINK_CLOSE, self._raw_pos)
+                if end < 0:
+                    return
+                self._raw_pos = end + len(THINK_CLOSE)
+                self._in_think = False
+                continue
+            start = self._raw.find(THINK_OPEN, self._raw_pos)
+            if start < 0:
+                safe = len(self._raw)
+                if not final:
+                    # Хвост может оказаться началом "<think>" — его ждем со следующей порцией
+                    lt = self._raw.find("<", max(self._raw_pos, safe - len(THINK_OPEN) + 1))
+                    if lt >= 0 and THINK_OPEN.startswith(self._raw[lt:]):
+                        safe = lt
+                if safe > self._raw_pos:
+                    self._visible += self._raw[self._raw_pos:safe]
+                    self._raw_pos = safe
+                return
+            self._visible += self._raw[self._raw_pos:start]
+            self._raw_pos = start + len(THINK_OPEN)
+            self._in_think = True
+
+    def _take(self, match):
+        key, value = match.group(1), _pair_value(match.group(2))
+        self._pos = match.end()
+        if key in self.pairs:
+            return None
+        self.pairs[key] = value
+        return key, value
+
+    def feed(self, delta):
+        self._raw += delta
+        self._advance_visible()
+        new_pairs = []
+        for match in PAIR_RE.finditer(self._visible, self._pos):
+            pair = self._take(match)
+            if pair:
+                new_pairs.append(pair)
+        return new_pairs
+
+    def finish(self):
+        """Дочитывает остаток после конца потока, возвращает все пары {id: значение}."""
+        self._advance_visible(final=True)
+        for match in PAIR_RE.finditer(self._visible, self._pos):
+            self._take(match)
+        tail = TAIL_PAIR_RE.search(self._visible, self._pos)
+        if tail:
+            self._take(tail)
+        return self.pairs
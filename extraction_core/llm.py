@@ -0,0 +1,386 @@
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+YANDEX_COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+OLLAMA_DEFAULT_PORT = 11434
+DEFAULT_TIMEOUT = 120
+CONNECT_TIMEOUT = 10
+# Повторы при перегрузке провайдера и сетевых сбоях: экспонента с full jitter
+LLM_RETRIES = 4
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 20.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Ответ оборван по maxTokens (YandexGPT) / num_predict или контексту (Ollama)
+TRUNCATED_STATUSES = {"ALTERNATIVE_STATUS_TRUNCATED_FINAL"}
+POOL_SIZE = 16
+METRICS_HISTORY = 1000
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def ollama_base_url(host=None):
+    """
+    Адрес сервера Ollama из host или OLLAMA_HOST по правилам библиотеки ollama:
+    "host", "host:port", ":port", "http(s)://host[:port][/path]"; без схемы — http,
+    без порта — 11434 (80/443 при явной схеме), без хоста — 127.0.0.1.
+    """
+    host = host or os.getenv("OLLAMA_HOST") or ""
+    port = OLLAMA_DEFAULT_PORT
+    scheme, _, hostport = host.partition("://")
+    if not hostport:
+        scheme, hostport = "http", host
+    elif scheme == "http":
+        port = 80
+    elif scheme == "https":
+        port = 443
+    split = urllib.parse.urlsplit(f"{scheme}://{hostport}")
+    hostname = split.hostname or "127.0.0.1"
+    port = split.port or port
+    try:
+        if isinstance(ipaddress.ip_address(hostname), ipaddress.IPv6Address):
+            hostname = f"[{hostname}]"
+    except ValueError:
+        pass
+    path = split.path.strip("/")
+    return f"{scheme}://{hostname}:{port}/{path}" if path else f"{scheme}://{hostname}:{port}"
+
+
+def run_batches(func, batches, max_workers=1):
+    """
+    func(batch) для каждой пачки, не более max_workers запросов одновременно.
+    Результаты возвращаются в порядке batches.
+    """
+    workers = max(1, min(int(max_workers), len(batches)))
+    if workers == 1:
+        return [func(batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, batches))
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Вызов LLM не уложился в отведенное время вместе с повторами."""
+
+
+class LLMMetrics:
+    """
+    Потокобезопасные метрики вызовов LLM: итоги по (провайдер, модель)
+    и последние METRICS_HISTORY вызовов с задержкой, токенами и числом попыток.
+    """
+    def __init__(self, history=METRICS_HISTORY):
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=history)
+        self._totals = {}
+
+    def record(self, provider, model, seconds, attempts, input_tokens=0, output_tokens=0, error=None, truncated=False):
+        call = {
+            "provider": provider,
+            "model": model,
+            "seconds": round(seconds, 3),
+            "attempts": attempts,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "truncated": truncated,
+            "error": error,
+        }
+        with self._lock:
+            self._calls.append(call)
+            totals = self._totals.setdefault(f"{provider}:{model}", {
+                "calls": 0, "errors": 0, "retries": 0, "truncated": 0, "seconds": 0.0,
+                "max_seconds": 0.0, "input_tokens": 0, "output_tokens": 0,
+            })
+            totals["calls"] += 1
+            totals["errors"] += 1 if error else 0
+            totals["retries"] += attempts - 1
+            totals["truncated"] += 1 if truncated else 0
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+
+    def summary(self):
+        """{"провайдер:модель": итоги} со средней задержкой, для логов и ответа функции."""
+        with self._lock:
+            result = {}
+            for key, totals in self._totals.items():
+                item = dict(totals)
+                item["avg_seconds"] = round(item["seconds"] / item["calls"], 3) if item["calls"] else 0.0
+                item["seconds"] = round(item["seconds"], 3)
+                item["max_seconds"] = round(item["max_seconds"], 3)
+                result[key] = item
+            return result
+
+    def calls(self):
+        with self._lock:
+            return list(self._calls)
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._totals.clear()
+
+
+_metrics = LLMMetrics()
+
+
+def get_llm_metrics():
+    return _metrics
+
+
+def _int_or_zero(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """
+    Клиент LLM (YandexGPT или Ollama по HTTP) поверх одной requests.Session
+    с пулом keep-alive соединений. Сессию безопасно делить между потоками run_batches.
+
+    complete() укладывает вызов вместе с повторами в deadline секунд:
+    таймаут каждой попытки урезается до оставшегося времени, при 429/5xx
+    и сетевых сбоях — повтор с экспоненциальной задержкой и случайной добавкой.
+    acomplete() / acomplete_details() — то же для asyncio: вызов уходит в поток,
+    пул соединений общий.
+    """
+    def __init__(self, provider, model, api_key=None, folder_id=None, base_url=None,
+                 timeout=DEFAULT_TIMEOUT, retries=LLM_RETRIES, pool_size=POOL_SIZE, metrics=None):
+        if provider not in ("yandex", "ollama"):
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        self.provider = provider
+        self.model = model
+        self.api_key = api_key
+        self.folder_id = folder_id
+        self.base_url = base_url or (YANDEX_COMPLETION_URL if provider == "yandex" else f"{ollama_base_url()}/api/chat")
+        self.timeout = timeout
+        self.retries = retries
+        self.metrics = metrics or _metrics
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _build_request(self, system_text, user_text, max_tokens, temperature, json_format, stream=False):
+        if self.provider == "yandex":
+            payload = {
+                "modelUri": f"gpt://{self.folder_id}/{self.model}",
+                "completionOptions": {"stream": stream, "temperature": temperature, "maxTokens": str(max_tokens)},
+                "messages": [
+                    {"role": "system", "text": system_text},
+                    {"role": "user", "text": user_text},
+                ],
+            }
+            headers = {
+                "Authorization": f"Api-Key {self.api_key}",
+                "Content-Type": "application/json; charset=utf-8",
+                "x-folder-id": self.folder_id,
+            }
+        else:
+            payload = {
+                "model": self.model,
+                "stream": stream,
+                "messages": [
+                    {"role": "system", "content": system_text},
+                    {"role": "user", "content": user_text},
+                ],
+                "options": {"temperature": temperature},
+            }
+            # Длину ответа Ollama ограничиваем, только если ее передали явно
+            if max_tokens is not None:
+                payload["options"]["num_predict"] = max_tokens
+            if json_format:
+                payload["format"] = "json"
+            headers = {"Content-Type": "application/json; charset=utf-8"}
+        # Тело уходит в ASCII (ensure_ascii), чтобы не зависеть от кодировки окружения
+        return headers, json.dumps(payload, ensure_ascii=True).encode("utf-8")
+
+    def _parse_response(self, data):
+        """{"text", "truncated", "input_tokens", "output_tokens"} из ответа провайдера."""
+        if self.provider == "yandex":
+            result = data["result"]
+            alternative = result["alternatives"][0]
+            usage = result.get("usage") or {}
+            return {
+                "text": alternative["message"]["text"],
+                "truncated": alternative.get("status") in TRUNCATED_STATUSES,
+                "input_tokens": _int_or_zero(usage.get("inputTextTokens")),
+                "output_tokens": _int_or_zero(usage.get("completionTokens")),
+            }
+        return {
+            "text": data["message"]["content"],
+            "truncated": data.get("done_reason") == "length",
+            "input_tokens": _int_or_zero(data.get("prompt_eval_count")),
+            "output_tokens": _int_or_zero(data.get("eval_count")),
+        }
+
+    def complete(self, system_text, user_text, max_tokens=800, temperature=0, deadline=None, json_format=False):
+        """
+        Один запрос к модели, возвращает текст ответа.
+        deadline — общий бюджет в секундах на все попытки (по умолчанию timeout клиента).
+        """
+        return self.complete_details(system_text, user_text, max_tokens, temperature, deadline, json_format)["text"]
+
+    def complete_details(self, system_text, user_text, max_tokens=800, temperature=0, deadline=None,
+                         json_format=False, on_delta=None):
+        """
+        Как complete(), но возвращает {"text", "truncated", "input_tokens", "output_tokens"}:
+        по ним планировщик чанков подстраивает размер следующих запросов.
+
+        on_delta(text) включает потоковый режим: новые куски ответа отдаются по мере генерации.
+        Оборванный поток (сеть, дедлайн) не повторяется, а возвращается как обрезанный
+        ответ ("truncated": True, "interrupted": True) — пришедшая часть не теряется.
+        """
+        stream = on_delta is not None
+        headers, body = self._build_request(system_text, user_text, max_tokens, temperature, json_format, stream)
+        started = time.monotonic()
+        expires_at = started + (deadline or self.timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = expires_at - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise LLMDeadlineExceeded(f"LLM call exceeded deadline after {attempt - 1} attempts")
+                response = self.session.post(
+                    self.base_url,
+                    headers=headers,
+                    data=body,
+                    timeout=(min(CONNECT_TIMEOUT, remaining), remaining),
+                    stream=stream,
+                )
+                if response.status_code in RETRY_STATUSES and attempt <= self.retries:
+                    response.close()
+                    self._sleep_before_retry(attempt, expires_at, f"HTTP {response.status_code}", _retry_after(response))
+                    continue
+                response.raise_for_status()
+                if stream:
+                    details = self._read_stream(response, on_delta, expires_at)
+                else:
+                    details = self._parse_response(response.json())
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt <= self.retries and expires_at - time.monotonic() > 0:
+                    self._sleep_before_retry(attempt, expires_at, type(e).__name__)
+                    continue
+                self._record(started, attempt, error=type(e).__name__)
+                if isinstance(e, requests.Timeout):
+                    raise LLMDeadlineExceeded(f"LLM call timed out after {attempt} attempts") from e
+                raise
+            except Exception as e:
+                self._record(started, attempt, error=type(e).__name__)
+                raise
+            self._record(
+                started, attempt, details["input_tokens"], details["output_tokens"],
+                error=details.pop("error", None), truncated=details["truncated"],
+            )
+            return details
+
+    async def acomplete(self, system_text, user_text, max_tokens=800, temperature=0, deadline=None, json_format=False):
+        return await asyncio.to_thread(
+            self.complete, system_text, user_text, max_tokens, temperature, deadline, json_format
+        )
+
+    async def acomplete_details(self, system_text, user_text, max_tokens=800, temperature=0, deadline=None,
+                                json_format=False, on_delta=None):
+        """Как complete_details(); on_delta вызывается из рабочего потока, а не из цикла событий."""
+        return await asyncio.to_thread(
+            self.complete_details, system_text, user_text, max_tokens, temperature, deadline, json_format, on_delta
+        )
+
+    def _read_stream(self, response, on_delta, expires_at):
+        """
+        Читает потоковый ответ построчно (NDJSON). YandexGPT присылает в каждой строке
+        весь текст на данный момент, Ollama — только новый кусок.
+        """
+        details = {"text": "", "truncated": False, "input_tokens": 0, "output_tokens": 0}
+        text = ""
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                part = self._parse_response(json.loads(line))
+                if self.provider == "yandex":
+                    delta = part["text"][len(text):]
+                    text = part["text"]
+                else:
+                    delta = part["text"]
+                    text += delta
+                details["truncated"] = part["truncated"]
+                details["input_tokens"] = part["input_tokens"] or details["input_tokens"]
+                details["output_tokens"] = part["output_tokens"] or details["output_tokens"]
+                if delta:
+                    on_delta(delta)
+                if time.monotonic() > expires_at:
+                    raise LLMDeadlineExceeded("LLM stream exceeded deadline")
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, LLMDeadlineExceeded) as e:
+            print(f"[LLM] {self.provider}: поток оборван ({type(e).__name__}), получено {len(text)} симв.")
+            details.update(truncated=True, interrupted=True, error=type(e).__name__)
+        finally:
+            response.close()
+        details["text"] = text
+        return details
+
+    def _sleep_before_retry(self, attempt, expires_at, reason, retry_after=None):
+        delay = retry_after if retry_after is not None else random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        delay = min(delay, max(0.0, expires_at - time.monotonic()))
+        print(f"[LLM] {self.provider}: {reason}, повтор {attempt}/{self.retries} через {delay:.1f} с")
+        time.sleep(delay)
+
+    def _record(self, started, attempts, input_tokens=0, output_tokens=0, error=None, truncated=False):
+        self.metrics.record(self.provider, self.model, time.monotonic() - started, attempts, input_tokens, output_tokens, error, truncated)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(provider, model, api_key=None, folder_id=None, **kwargs):
+    """
+    Один клиент (и пул соединений) на провайдера, модель и ключ на весь процесс:
+    UniversalProcessor создается на каждый файл, облачная функция живет между вызовами.
+    """
+    key = (provider, model, api_key, folder_id)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = LLMClient(provider, model, api_key=api_key, folder_id=folder_id, **kwargs)
+            _clients[key] = client
+        return client
+
+
+def yandex_completion(api_key, folder_id, model, system_text, user_text,
+                      max_tokens=800, temperature=0, deadline=None, details=False, on_delta=None):
+    """
+    Один запрос к YandexGPT через общий клиент, возвращает текст ответа
+    (или словарь complete_details(), если details=True). on_delta — потоковый режим.
+    model — имя модели внутри каталога ("yandexgpt-lite", "yandexgpt-lite/latest").
+    """
+    client = get_llm_client("yandex", model, api_key=api_key, folder_id=folder_id)
+    result = client.complete_details(
+        system_text, user_text, max_tokens=max_tokens, temperature=temperature,
+        deadline=deadline, on_delta=on_delta,
+    )
+    return result if details else result["text"]
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import re
+
+from .sqlite_store import SQLiteLRUStore, get_shared
+
+# Кэш ответов LLM по номерам документов.
+# Ключ: нормализованный текст строки + режим извлечения + модель + версия промта.
+# Хранится в SQLite: локально переживает перезапуски и смену file_key в Streamlit,
+# в облачной функции (путь в /tmp) живет между вызовами на "теплом" инстансе.
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 200000
+
+
+def normalize_cache_text(text):
+    if text is None:
+        return ""
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+
+def prompt_version(prompt):
+    # Версия промта = короткий хэш текста, любая правка промта инвалидирует кэш
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class LLMCache:
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+        if max_entries is None:
+            max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.max_entries = max_entries
+        self.store = SQLiteLRUStore(self.path, "llm_cache", max_entries)
+
+    @staticmethod
+    def make_key(text, mode, model, version):
+        raw = "\x1f".join([normalize_cache_text(text), str(mode), str(model), str(version)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts, mode, model, version):
+        """
+        Возвращает {text: value} только для найденных в кэше текстов.
+        value может быть None — это закэшированный ответ "номера нет".
+        """
+        keys = [self.make_key(text, mode, model, version) for text in texts]
+        found = self.store.get_many(keys)
+        return {text: found[key] for text, key in zip(texts, keys) if key in found}
+
+    def set_many(self, mapping, mode, model, version):
+        self.store.set_many({
+            self.make_key(text, mode, model, version): value
+            for text, value in mapping.items()
+        })
+
+    def stats(self):
+        return self.store.stats()
+
+    def clear(self):
+        self.store.clear()
+
+
+def get_llm_cache(path=None):
+    """Один экземпляр кэша на путь на весь процесс."""
+    return get_shared(LLMCache, path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
@@ -0,0 +1,133 @@
+import re
+
+DOC_PREFIX_RE = re.compile(r"^(номер|№|док|id)\s*", re.IGNORECASE)
+
+
+def normalize_doc_number(val):
+    if val is None:
+        return None
+    if isinstance(val, dict):
+        return str(list(val.values())[0]) if val.values() else None
+    s_val = str(val).strip()
+    if s_val.lower() in ("null", "none", "", "skip"):
+        return None
+    # Убираем лишние слова, если ИИ их добавил
+    s_val = DOC_PREFIX_RE.sub("", s_val).strip()
+    return s_val
+
+
+# Правила извлечения номера документа без LLM.
+# Строки с уверенностью ниже порога уходят в YandexGPT/Ollama.
+RULE_CONFIDENCE_THRESHOLD = 0.8
+
+DOC_TOKEN = r"[A-Za-zА-Яа-яЁё0-9][A-Za-zА-Яа-яЁё0-9/_\-]*"
+DOC_TOKEN_RE = re.compile(DOC_TOKEN)
+# Даты: 12.01.2026, 12/01/26 и 2026-01-12, 2026.01.12
+DATE_IN_TEXT_RE = re.compile(
+    r"\b(?:\d{1,2}[./]\d{1,2}[./]\d{2,4}|\d{4}[-./]\d{1,2}[-./]\d{1,2})\b(?:\s*г\.?)?"
+)
+# Количества и суммы с единицей измерения ("2 шт", "1,5 кг", "1 500,00 руб.") — не номера
+QUANTITY_RE = re.compile(
+    r"(?<!№)(?<!№\s)(?<![\w/-])\d+(?:[\s\xa0]\d{3})*(?:[.,]\d+)?\s*"
+    r"(?:шт|штук\w*|кг|гр?|мл|л|тн?|уп|упак\w*|ед|руб\w*|р|коп|₽|%)(?!\w)\.?",
+    re.IGNORECASE,
+)
+PAREN_RE = re.compile(r"\(([^()]*)\)")
+# Номер после знака: "№ 20", "N 20", "N20"
+NUMBER_SIGN_RE = re.compile(r"(?:№|\bN(?![A-Za-z]))\.?\s*(" + DOC_TOKEN + ")")
+INVOICE_RE = re.compile(
+    r"(?:с/?ф|сч\.?\s*-?\s*ф\w*|сч[её]т\w*[\s-]*фактур\w*|invoice)\.?\s*(?:№\s*)?(" + DOC_TOKEN + ")",
+    re.IGNORECASE,
+)
+DOC_KEYWORD_RE = re.compile(
+    r"реализаци|упд|\bакт\b|накладн|продаж|корректировк|товарн|отгрузк",
+    re.IGNORECASE,
+)
+
+
+def _number_tokens(text):
+    tokens = []
+    for token in DOC_TOKEN_RE.findall(text):
+        token = token.strip("/-_")
+        if token and any(ch.isdigit() for ch in token):
+            tokens.append(token)
+    return tokens
+
+
+def _first_number(regex, text):
+    for match in regex.finditer(text):
+        token = match.group(1).strip("/-_")
+        if any(ch.isdigit() for ch in token):
+            return token
+    return None
+
+
+def extract_doc_number_rules(text, extraction_mode="Авто (Приоритет С/Ф)"):
+    """
+    Детерминированное извлечение номера документа.
+    Возвращает (номер, уверенность 0..1).
+    "Авто" — сначала номер С/Ф (сф 20/DP, номер с дробью в скобках),
+    иначе — первый номер документа вне скобок. Даты и количества с единицами
+    измерения номерами не считаются; число без знака № / N — ниже порога.
+    """
+    if not text:
+        return None, 0.0
+    clean = QUANTITY_RE.sub(" ", DATE_IN_TEXT_RE.sub(" ", str(text)))
+    invoice_first = "Авто" in extraction_mode
+
+    paren_tokens = []
+    for inner in PAREN_RE.findall(clean):
+        paren_tokens.extend(_number_tokens(inner))
+
+    if invoice_first:
+        invoice = _first_number(INVOICE_RE, clean)
+        if invoice:
+            return invoice, 0.95
+        slashed = [t for t in paren_tokens if "/" in t]
+        if len(slashed) == 1:
+            return slashed[0], 0.9
+
+    # Номер Акта/Накладной ищем вне скобок
+    outside = PAREN_RE.sub(" ", clean)
+    tokens = _number_tokens(outside)
+    number = _first_number(NUMBER_SIGN_RE, outside)
+    if number:
+        confidence = 0.9
+        # В режиме "Авто" несколько номеров подряд — неоднозначно
+        if invoice_first and len(NUMBER_SIGN_RE.findall(outside)) > 1:
+            confidence = 0.6
+    elif tokens:
+        # Число без знака № / N может оказаться чем угодно — даже единственное
+        # рядом со словом "реализация" остается ниже порога и решается LLM
+        number = tokens[0]
+        if DOC_KEYWORD_RE.search(outside):
+            confidence = 0.7 if len(tokens) == 1 else 0.5
+        else:
+            confidence = 0.5 if len(tokens) == 1 else 0.3
+    else:
+        return None, 0.0
+
+    # В скобках есть номер, который мы не распознали как С/Ф — пусть решает LLM
+    if invoice_first and paren_tokens:
+        confidence = min(confidence, 0.6)
+    return number, confidence
+
+
+# Упрощенное извлечение для облачной функции (режим regex_first/regex_only):
+# номер после "№", иначе первое число из 2+ цифр, иначе первый токен из 3+ символов
+SIMPLE_NUMBER_SIGN_RE = re.compile(r"№\s*([A-Za-zА-Яа-я0-9/-]+)")
+SIMPLE_DIGITS_RE = re.compile(r"\b\d{2,}\b")
+SIMPLE_TOKEN_RE = re.compile(r"[A-Za-zА-Яа-я0-9/-]{3,}")
+
+
+def extract_number_regex(text):
+    if not text:
+        return ""
+    m = SIMPLE_NUMBER_SIGN_RE.search(text)
+    if m:
+        return m.group(1)
+    m = SIMPLE_DIGITS_RE.search(text)
+    if m:
+        return m.group(0)
+    m = SIMPLE_TOKEN_RE.search(text)
+    return m.group(0) if m else ""
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Общее хранилище кэшей: таблица key -> value в SQLite (WAL) с вытеснением
+# давно неиспользованных записей сверх лимита. Ключи — готовые строки (обычно хэши),
+# значения кодируются в TEXT функциями encode/decode конкретного кэша.
+
+
+class SQLiteLRUStore:
+    def __init__(self, path, table, max_entries, encode=None, decode=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)"
+            )
+            self._conn.commit()
+
+    def get_many(self, keys):
+        """
+        {key: value} только для найденных ключей, время использования найденных обновляется.
+        Попадания и промахи считаются по каждому элементу keys (повторы тоже).
+        """
+        unique = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self._lock:
+            # SQLite ограничивает число параметров, поэтому идем пачками
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                cursor = self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders})", part
+                )
+                rows = cursor.fetchall()
+                for key, value in rows:
+                    found[key] = self.decode(value)
+                if rows:
+                    self._conn.executemany(
+                        f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows],
+                    )
+            self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def set_many(self, items):
+        """Записывает {key: value}; значения кодируются до захвата блокировки."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, self.encode(value), now) for key, value in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Вытесняем самые давно использованные записи сверх лимита
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size, "maxEntries": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared(factory, path):
+    """Один экземпляр factory(path) на (factory, путь) на весь процесс."""
+    key = (factory, path)
+    with _shared_lock:
+        instance = _shared.get(key)
+        if instance is None:
+            instance = factory(path)
+            _shared[key] = instance
+        return instance
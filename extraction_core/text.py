@@ -0,0 +1,50 @@
+import re
+
+HEADER_QUOTES_RE = re.compile(r"[«»\"']")
+HEADER_SPACES_RE = re.compile(r"\s+")
+# Пустой список ключевых слов: выражение, которое ничего не находит
+NO_KEYWORDS_RE = re.compile(r"(?!)")
+
+
+def normalize_header(value):
+    """Заголовок для сравнения: без кавычек, в нижнем регистре, с одиночными пробелами."""
+    if value is None:
+        return ""
+    text = HEADER_QUOTES_RE.sub("", str(value).lower())
+    return HEADER_SPACES_RE.sub(" ", text).strip()
+
+
+def find_header_offset(header_row, start_index, header_name):
+    """Номер колонки (с 1) первого заголовка header_name начиная с start_index, иначе 0."""
+    for idx in range(start_index, len(header_row)):
+        if normalize_header(header_row[idx]) == header_name:
+            return idx + 1
+    return 0
+
+
+def prepare_keywords(keywords):
+    """
+    Ключевые слова для classify_by_keywords() одним регулярным выражением.
+    Слово ищется целиком, а не подстрокой: "акт" не находится в "фактура", "приход" — в "приходная".
+    """
+    words = sorted({" ".join(k.lower().split()) for k in keywords if k and k.strip()})
+    if not words:
+        return NO_KEYWORDS_RE
+    alternatives = "|".join(r"\s+".join(re.escape(part) for part in word.split()) for word in words)
+    return re.compile(r"(?<!\w)(?:" + alternatives + r")(?!\w)")
+
+
+def classify_by_keywords(text, exclude, include):
+    """
+    Решение по ключевым словам (exclude и include — из prepare_keywords):
+    False — только слова исключения (платежи), True — только слова включения,
+    None — неоднозначно или ничего не нашлось.
+    """
+    text_lc = str(text).lower()
+    has_exclude = exclude.search(text_lc) is not None
+    has_include = include.search(text_lc) is not None
+    if has_exclude and not has_include:
+        return False
+    if has_include and not has_exclude:
+        return True
+    return None
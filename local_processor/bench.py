@@ -0,0 +1,158 @@
+"""
+Бенчмарки горячих мест обработки.
+
+Запуск:
+    python bench.py extract [--rows 200000] [--file path.xlsx --system IIKO]
+    python bench.py docindex [--act 10000 --docs 50000]
+"""
+import argparse
+import random
+import time
+
+import polars as pl
+
+from doc_index import DocIndex, SortedKeys
+from processor import UniversalProcessor, load_sheet_frame
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_iiko_frame(rows):
+    random.seed(42)
+    header = ["Дата", "Тип", "Входящий номер", "Поставщик/Покупатель", "Склад", "Сумма, р.", "Комментарий", "Автор"]
+    data = [
+        ["Отчет по накладным", None, None, None, None, None, None, None],
+        [None] * len(header),
+        header,
+    ]
+    for i in range(rows):
+        if i % 50 == 0:
+            data.append([None] * len(header))
+            continue
+        data.append([
+            f"{random.randint(1, 28):02d}.01.2026",
+            "Приходная накладная",
+            f"{random.randint(1, 99999)}/DP" if i % 3 else str(i),
+            f"ООО Поставщик {i % 40}",
+            f"Сырье / КРД Красная ул., {i % 30}",
+            f"{random.randint(100, 100000)},{random.randint(0, 99):02d}",
+            "" if i % 7 else "корректировка",
+            "admin",
+        ])
+    columns = [f"column_{i + 1}" for i in range(len(header))]
+    return pl.DataFrame(data, schema={c: pl.Utf8 for c in columns}, orient="row")
+
+
+def bench_extract(rows=200000, file_path=None, system_name="IIKO"):
+    processor = UniversalProcessor(model_name="yandexgpt")
+    processor.log = lambda message: None
+    frame = load_sheet_frame(file_path) if file_path else make_iiko_frame(rows)
+
+    # Построчный путь платит и за материализацию всего листа в list-of-lists
+    def list_path():
+        return processor.extract_system_rows(frame.rows(), system_name)
+
+    t_list, (list_rows, list_headers) = timed(list_path)
+    t_col, (col_rows, col_headers) = timed(processor.extract_system_rows_columnar, frame, system_name)
+
+    assert list_headers == col_headers, "headers differ"
+    assert list_rows == col_rows, "rows differ"
+    print(f"extract_system_rows [{system_name}] rows in: {frame.height}, rows out: {len(col_rows)}")
+    print(f"  list-of-lists: {t_list * 1000:.1f} ms")
+    print(f"  columnar:      {t_col * 1000:.1f} ms  (x{t_list / t_col:.1f})")
+
+
+def legacy_find_doc_in_index(target_doc, idx_map):
+    # Прежняя реализация find_doc_in_index из app.py (линейный перебор) — эталон
+    if not target_doc:
+        return []
+    if target_doc in idx_map:
+        return idx_map[target_doc]
+    for key in idx_map:
+        if key.startswith(target_doc) and len(key) > len(target_doc):
+            suffix = key[len(target_doc):]
+            if suffix[0].isalpha():
+                return idx_map[key]
+    return []
+
+
+def make_doc_index_case(act_rows, system_docs):
+    random.seed(7)
+    idx_map = {}
+    while len(idx_map) < system_docs:
+        num = str(random.randint(1, system_docs * 4))
+        key = num + random.choice(["", "", "", "dp", "k", "0"])
+        idx_map.setdefault(key, []).append({"amount": 1.0, "raw": {}})
+    keys = list(idx_map)
+    targets = []
+    for i in range(act_rows):
+        kind = i % 3
+        if kind == 0:
+            targets.append(random.choice(keys))
+        elif kind == 1:
+            targets.append(random.choice(keys).rstrip("dpk") or "1")
+        else:
+            targets.append(str(random.randint(system_docs * 4, system_docs * 8)))
+    return idx_map, targets
+
+
+def bench_doc_index(act_rows=10000, system_docs=50000, legacy_sample=300):
+    idx_map, targets = make_doc_index_case(act_rows, system_docs)
+
+    start = time.perf_counter()
+    index = DocIndex(idx_map)
+    t_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = [index.find(t) for t in targets]
+    t_index = time.perf_counter() - start
+
+    # Линейный поиск на полном объеме занимает минуты — меряем выборку и экстраполируем
+    sample = targets[:legacy_sample]
+    start = time.perf_counter()
+    legacy = [legacy_find_doc_in_index(t, idx_map) for t in sample]
+    t_legacy = (time.perf_counter() - start) * len(targets) / len(sample)
+    assert legacy == found[:legacy_sample], "DocIndex differs from linear scan"
+
+    unmatched = SortedKeys(idx_map)
+    start = time.perf_counter()
+    for t in targets:
+        if not unmatched.discard(t):
+            unmatched.discard_prefix(t)
+    t_unmatched = time.perf_counter() - start
+
+    print(f"find_doc_in_index: act rows {act_rows} x system docs {system_docs}")
+    print(f"  linear scan (est.): {t_legacy * 1000:.0f} ms per system")
+    print(f"  DocIndex:           {(t_build + t_index) * 1000:.0f} ms per system (build {t_build * 1000:.0f} ms)")
+    print(f"  unmatched cleanup:  {t_unmatched * 1000:.0f} ms, left {len(unmatched)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    extract = sub.add_parser("extract", help="extract_system_rows: построчно против Polars")
+    extract.add_argument("--rows", type=int, default=200000)
+    extract.add_argument("--file")
+    extract.add_argument("--system", default="IIKO")
+    docindex = sub.add_parser("docindex", help="find_doc_in_index: перебор против DocIndex")
+    docindex.add_argument("--act", type=int, default=10000)
+    docindex.add_argument("--docs", type=int, default=50000)
+    args = parser.parse_args()
+
+    if args.bench == "extract":
+        bench_extract(args.rows, args.file, args.system)
+    elif args.bench == "docindex":
+        bench_doc_index(args.act, args.docs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Пакетный запуск без Streamlit: обработка папки с выгрузками и актами,
+сверка актов с данными систем и запись результатов в таблицы поставщиков.
+
+Запуск:
+    python cli.py run ./january --out ./out [--month "Январь 26"] [--workers 4]
+                  [--mode auto|act] [--suppliers-map map.json]
+                  [--upload-systems] [--save-recon]
+
+Результаты пишутся в --out:
+    files/<файл>.json      — строки, заголовки и статус обработки каждого файла
+    recon/<поставщик>.json — сверка по каждому акту, recon/summary.json — сводка
+    run.json               — итог запуска и тайминги по этапам и файлам
+    profile.json           — профиль: время и пики памяти по стадиям (разбор, LLM, сверка, Google API), счетчики
+    profile.prom           — тот же профиль в текстовом формате Prometheus (для textfile-коллектора)
+Итог запуска также печатается в stdout одной JSON-строкой.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rapidfuzz import process, fuzz, utils
+
+import processor as processor_module
+from config import SYSTEMS_FOLDER_ID, EXTRACTION_MODES, load_settings, split_keywords
+from partner_resolver import clean_supplier_name
+from processor import UniversalProcessor
+from profiling import get_profiler
+from reconciliation import RECON_COLUMNS, reconcile_batch, write_batch_results
+
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+SUPPLIER_MATCH_THRESHOLD = 85
+# Организационно-правовые формы в имени файла акта обычно не пишут
+LEGAL_FORMS = {"ооо", "ип", "ао", "зао", "оао", "пао"}
+
+# Процессор один на рабочий процесс, как в app.py — один на файл
+_worker_processor = None
+_worker_options = None
+
+def _init_worker(model_name, workers, options):
+    global _worker_processor, _worker_options
+    # Лимиты провайдера LLM действуют на процесс — делим их между воркерами,
+    # чтобы весь пул держался в общих рамках
+    for limits in processor_module.PROVIDER_LIMITS.values():
+        limits["rps"] = limits["rps"] / workers
+        limits["max_in_flight"] = max(1, limits["max_in_flight"] // workers)
+    _worker_processor = UniversalProcessor(model_name=model_name, columnar=True)
+    _worker_options = options
+
+def _init_pool_worker(model_name, workers, options):
+    # При fork рабочий процесс наследует профиль родителя — начинаем с чистого, чтобы не посчитать его дважды
+    get_profiler().reset()
+    _init_worker(model_name, workers, options)
+
+def _process_job(file_path):
+    start = time.perf_counter()
+    try:
+        data, status, system_name, headers = _worker_processor.process_file(
+            file_path,
+            income_keywords=_worker_options["income_keywords"],
+            expense_keywords=_worker_options["expense_keywords"],
+            extraction_mode=_worker_options["extraction_mode"],
+        )
+        error = None
+    except Exception as e:
+        data, status, system_name, headers = [], "error", None, []
+        error = str(e)
+    return {
+        "file": os.path.basename(file_path),
+        "path": file_path,
+        "status": status,
+        "system": system_name,
+        "headers": headers,
+        "rows": data,
+        "error": error,
+        "seconds": round(time.perf_counter() - start, 3),
+        # Профиль этапов из рабочего процесса, родитель вливает его в общий
+        "profile": get_profiler().drain(),
+    }
+
+def list_excel_files(input_dir):
+    files = []
+    for name in sorted(os.listdir(input_dir)):
+        # Пропускаем временные файлы Excel (~$file.xlsx)
+        if name.startswith("~$") or not name.lower().endswith(EXCEL_EXTENSIONS):
+            continue
+        files.append(os.path.join(input_dir, name))
+    return files
+
+def process_files(files, model_name, options, workers):
+    """process_file по всем файлам в пуле процессов. Результаты в порядке files."""
+    if not files:
+        return []
+    workers = max(1, min(workers, len(files)))
+    results = {}
+    if workers == 1:
+        _init_worker(model_name, 1, options)
+        for path in files:
+            results[path] = _process_job(path)
+            get_profiler().merge(results[path].pop("profile"))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker, initargs=(model_name, workers, options)) as executor:
+            futures = {executor.submit(_process_job, path): path for path in files}
+            for future in as_completed(futures):
+                result = future.result()
+                get_profiler().merge(result.pop("profile"))
+                print(f"[CLI] {result['file']}: {result['status']} ({result['system']}, {len(result['rows'])} строк, {result['seconds']} с)", file=sys.stderr)
+                results[futures[future]] = result
+    return [results[path] for path in files]
+
+def match_supplier(file_name, suppliers, suppliers_map=None):
+    """
+    Поставщик для акта: сначала явная карта {имя файла: поставщик},
+    иначе ближайшее название поставщика из настроек внутри имени файла.
+    """
+    if suppliers_map and file_name in suppliers_map:
+        return suppliers_map[file_name]
+    if not suppliers:
+        return None
+    names = list(suppliers)
+    stem = utils.default_process(os.path.splitext(file_name)[0])
+    choices = []
+    for name in names:
+        words = utils.default_process(clean_supplier_name(name)).split()
+        choices.append(" ".join(w for w in words if w not in LEGAL_FORMS))
+    match = process.extractOne(stem, choices, scorer=fuzz.partial_ratio, processor=None, score_cutoff=SUPPLIER_MATCH_THRESHOLD)
+    return names[match[2]] if match else None
+
+def write_json(path, payload):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=1, default=str)
+
+def run(args):
+    # gsheets тянет за собой Google API — импортируем только при запуске
+    from gsheets import find_file_in_folder, create_spreadsheet_in_folder, read_all_sheets_data_cached, upload_to_gsheet, update_supplier_sheet
+
+    settings = load_settings()
+    target_month = args.month or settings["target_month"]
+    suppliers = settings["suppliers"]
+    suppliers_map = None
+    if args.suppliers_map:
+        with open(args.suppliers_map, "r", encoding="utf-8") as f:
+            suppliers_map = json.load(f)
+
+    options = {
+        "income_keywords": split_keywords(settings["income_k"]),
+        "expense_keywords": split_keywords(settings["expense_k"]),
+        "extraction_mode": EXTRACTION_MODES[args.mode],
+    }
+    timings = {}
+    report = {"month": target_month, "input": args.input_dir, "files": [], "uploads": [], "saved": [], "errors": []}
+
+    # 1. Обработка файлов
+    start = time.perf_counter()
+    files = list_excel_files(args.input_dir)
+    processed = process_files(files, args.model, options, args.workers)
+    timings["process"] = time.perf_counter() - start
+
+    jobs = []
+    for result in processed:
+        entry = {k: result[k] for k in ("file", "status", "system", "error", "seconds")}
+        entry["rows"] = len(result["rows"])
+        if result["status"] == "enriched" and result["rows"]:
+            entry["supplier"] = match_supplier(result["file"], suppliers, suppliers_map)
+            if entry["supplier"]:
+                jobs.append({"key": result["file"], "supplier": entry["supplier"], "rows": result["rows"]})
+            else:
+                report["errors"].append(f"{result['file']}: поставщик не определен, акт пропущен")
+        elif result["status"] not in ("enriched", "enriched_system"):
+            report["errors"].append(f"{result['file']}: ошибка обработки {result['error'] or ''}".strip())
+        report["files"].append(entry)
+        write_json(os.path.join(args.out, "files", f"{result['file']}.json"), result)
+
+    # 2. Выгрузки систем — в таблицу месяца (как кнопка "Отправить в Системы")
+    sys_ss_id = None
+    if args.upload_systems:
+        start = time.perf_counter()
+        system_results = [r for r in processed if r["status"] == "enriched_system" and r["rows"]]
+        if system_results:
+            sys_ss_id = find_file_in_folder(SYSTEMS_FOLDER_ID, target_month)
+            if not sys_ss_id:
+                sys_ss_id = create_spreadsheet_in_folder(target_month, SYSTEMS_FOLDER_ID)
+            for result in system_results:
+                success, msg = upload_to_gsheet(sys_ss_id, result["system"], result["rows"], result["headers"])
+                report["uploads"].append({"file": result["file"], "system": result["system"], "success": success, "message": msg})
+        timings["upload_systems"] = time.perf_counter() - start
+
+    # 3. Сверка всех актов по одной загрузке данных систем
+    if jobs:
+        start = time.perf_counter()
+        sys_ss_id = sys_ss_id or find_file_in_folder(SYSTEMS_FOLDER_ID, target_month)
+        sys_data = read_all_sheets_data_cached(sys_ss_id, columns=RECON_COLUMNS) if sys_ss_id else None
+        timings["read_systems"] = time.perf_counter() - start
+        if not sys_data:
+            report["errors"].append(f"Не удалось прочитать данные систем за период {target_month}")
+        else:
+            start = time.perf_counter()
+            batch = reconcile_batch(jobs, sys_data, max_workers=args.workers)
+            write_batch_results(batch, os.path.join(args.out, "recon"))
+            timings["reconcile"] = time.perf_counter() - start
+            report["recon_totals"] = batch["summary"]["totals"]
+
+            # 4. Запись сверки в таблицы поставщиков
+            if args.save_recon:
+                start = time.perf_counter()
+                recon_sheet_name = f"Сверка {target_month}"
+                for job in jobs:
+                    result = batch["results"][job["key"]]
+                    supplier_id = suppliers.get(job["supplier"])
+                    if not supplier_id:
+                        report["errors"].append(f"{job['key']}: нет таблицы для поставщика {job['supplier']}")
+                        continue
+                    success, msg = update_supplier_sheet(supplier_id, recon_sheet_name, result["rows"], result["summary"])
+                    report["saved"].append({"file": job["key"], "supplier": job["supplier"], "success": success, "message": msg})
+                timings["save_recon"] = time.perf_counter() - start
+
+    report["timings"] = {k: round(v, 3) for k, v in timings.items()}
+    profiler = get_profiler()
+    report["profile"] = profiler.summary()
+    profiler.to_json(os.path.join(args.out, "profile.json"))
+    profiler.to_prometheus(os.path.join(args.out, "profile.prom"))
+    write_json(os.path.join(args.out, "run.json"), report)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="обработать папку, сверить акты, записать результаты")
+    run_parser.add_argument("input_dir")
+    run_parser.add_argument("--out", default="out")
+    run_parser.add_argument("--month", help="период, например 'Январь 26' (по умолчанию из settings.json)")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    run_parser.add_argument("--mode", choices=sorted(EXTRACTION_MODES), default="auto")
+    run_parser.add_argument("--model", default="yandexgpt")
+    run_parser.add_argument("--suppliers-map", help="JSON {имя файла акта: поставщик}")
+    run_parser.add_argument("--upload-systems", action="store_true", help="загрузить выгрузки систем в таблицу месяца")
+    run_parser.add_argument("--save-recon", action="store_true", help="записать сверку в таблицы поставщиков")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run(args)
+        print(json.dumps(report, ensure_ascii=False, default=str))
+        return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+class RowView:
+    """Строка ColumnTable с интерфейсом словаря {заголовок: значение} только для чтения."""
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def get(self, key, default=None):
+        column = self._table.columns.get(key)
+        return column[self._index] if column is not None else default
+
+    def __getitem__(self, key):
+        return self._table.columns[key][self._index]
+
+    def __contains__(self, key):
+        return key in self._table.columns
+
+    def keys(self):
+        return self._table.columns.keys()
+
+    def items(self):
+        return [(key, column[self._index]) for key, column in self._table.columns.items()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, RowView):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return f"RowView({self.to_dict()!r})"
+
+
+class ColumnTable:
+    """
+    Лист таблицы по колонкам: {заголовок: [значения]}, все колонки одной длины.
+    Вместо словаря на каждую строку держит по одному списку на колонку,
+    но остается последовательностью строк: len(), итерация и [i] отдают RowView.
+    """
+    def __init__(self, columns, length=None):
+        if length is None:
+            length = max((len(c) for c in columns.values()), default=0)
+        self.length = length
+        self.columns = {}
+        for header, values in columns.items():
+            values = list(values[:length])
+            if len(values) < length:
+                values.extend([""] * (length - len(values)))
+            self.columns[header] = values
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Из листа в виде строк: первая строка — заголовки, пустые заголовки пропускаются."""
+        if not rows:
+            return cls({})
+        headers = rows[0]
+        columns = {}
+        for i, header in enumerate(headers):
+            if header:
+                columns[header] = [row[i] if i < len(row) else "" for row in rows[1:]]
+        return cls(columns, len(rows) - 1)
+
+    @property
+    def headers(self):
+        return list(self.columns)
+
+    def column(self, header):
+        return self.columns.get(header) or [""] * self.length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return RowView(self, index)
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield RowView(self, i)
+
+    def to_records(self):
+        return [row.to_dict() for row in self]
+
+
+def column_values(records, header, default=""):
+    """Значения одной колонки из ColumnTable или из списка словарей."""
+    if isinstance(records, ColumnTable):
+        return records.columns.get(header) or [default] * len(records)
+    return [r.get(header, default) for r in records]
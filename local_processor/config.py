@@ -0,0 +1,47 @@
+import os
+import json
+
+# Константы Google Drive
+SYSTEMS_FOLDER_ID = "1ijv4no6aI3E_le5zAe12QGssehrUETkh"
+SUPPLIERS_FOLDER_ID = "1BroJAZivTEypJjFsAOU6uODMaeyw2K7n"
+SUPPLIER_TEMPLATE_ID = "1hXBDqliS5rYgL3ZUe2Cg5PUnLAs7aPCwDn8Icivn9qc"
+
+# Путь к файлу настроек
+SETTINGS_FILE = "settings.json"
+
+# Режимы извлечения номера документа (как в радио-кнопке app.py)
+EXTRACTION_MODES = {
+    "auto": "Авто (Приоритет С/Ф)",
+    "act": "Строго первый номер (Акт)",
+}
+
+def load_settings():
+    defaults = {
+        "income_k": "платежное, поступление, оплата, списание, перечислено, приход",
+        "expense_k": "реализация, упд, продажа, корректировка, акт",
+        "target_month": "Январь 26",
+        "suppliers": {} # { "Supplier Name": "Spreadsheet ID" }
+    }
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+                # Удаляем старые ключи папок и шаблона, если они были в JSON
+                for k in ["systems_folder_id", "suppliers_folder_id", "supplier_template_id"]:
+                    saved.pop(k, None)
+                return {**defaults, **saved}
+        except:
+            return defaults
+    return defaults
+
+def save_settings(income_k, expense_k, target_month, suppliers):
+    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
+        json.dump({
+            "income_k": income_k, 
+            "expense_k": expense_k,
+            "target_month": target_month,
+            "suppliers": suppliers
+        }, f, ensure_ascii=False)
+
+def split_keywords(value):
+    return [x.strip() for x in value.split(",") if x.strip()]
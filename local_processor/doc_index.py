@@ -0,0 +1,100 @@
+from bisect import bisect_left
+
+# Верхняя граница для поиска по префиксу: больше любого символа в ключе
+_MAX_CHAR = "\U0010ffff"
+
+
+class SortedKeys:
+    """
+    Отсортированный набор ключей документов.
+    Поиск и удаление по префиксу — бинарным поиском, без перебора всех ключей.
+    """
+    def __init__(self, keys=()):
+        self._keys = sorted(set(keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def prefix_range(self, prefix, lo_key=None):
+        """Диапазон [lo, hi) ключей, начинающихся с prefix (начиная с lo_key, если задан)."""
+        lo = bisect_left(self._keys, lo_key if lo_key is not None else prefix)
+        hi = bisect_left(self._keys, prefix + _MAX_CHAR, lo)
+        return lo, hi
+
+    def with_prefix(self, prefix):
+        lo, hi = self.prefix_range(prefix)
+        return self._keys[lo:hi]
+
+    def slice(self, lo, hi):
+        return self._keys[lo:hi]
+
+    def discard(self, key):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+            return True
+        return False
+
+    def discard_prefix(self, prefix):
+        """Удаляет ключи, которые начинаются с prefix и длиннее него. Возвращает удаленные."""
+        # Сам prefix (если есть) стоит первым в диапазоне — пропускаем его
+        lo, hi = self.prefix_range(prefix, lo_key=prefix + "\x00")
+        removed = self._keys[lo:hi]
+        del self._keys[lo:hi]
+        return removed
+
+
+class DocIndex:
+    """
+    Индекс документов системы {нормализованный номер: [записи]}.
+    find() отвечает на "точное совпадение, иначе ключ = target + буквенный суффикс"
+    (20 -> 20dp, но не 205) за O(log n) вместо перебора всего словаря.
+    """
+    def __init__(self, idx_map=None):
+        self.map = idx_map if idx_map is not None else {}
+        # При нескольких кандидатах побеждает первый добавленный, как при переборе dict
+        self._order = {key: i for i, key in enumerate(self.map)}
+        self._keys = SortedKeys(self.map)
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def __iter__(self):
+        return iter(self.map)
+
+    def get(self, key, default=None):
+        return self.map.get(key, default)
+
+    def items(self):
+        return self.map.items()
+
+    def keys(self):
+        return self.map.keys()
+
+    def find(self, target_doc):
+        if not target_doc:
+            return []
+        if target_doc in self.map:
+            return self.map[target_doc]
+
+        # Ключи вида target + цифра идут в сортировке раньше букв — сразу пропускаем их
+        lo, hi = self._keys.prefix_range(target_doc, lo_key=target_doc + ":")
+        best_key = None
+        best_order = None
+        size = len(target_doc)
+        for key in self._keys.slice(lo, hi):
+            if key[size].isalpha():
+                order = self._order[key]
+                if best_order is None or order < best_order:
+                    best_key, best_order = key, order
+        return self.map[best_key] if best_key is not None else []
@@ -1,22 +1,58 @@
 import gspread
 import streamlit as st
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+import requests
+from column_table import ColumnTable
+from profiling import get_profiler, profiled
+from snapshot_store import get_snapshot_store
+import difflib
+import hashlib
+import json
 import os
+import random
+import threading
+import time
 
 # Путь к файлу ключей сервисного аккаунта
 CREDENTIALS_FILE = "credentials.json"
 
-def get_creds():
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+# Квота диска меняется редко, а сайдбар спрашивает ее на каждом rerun
+QUOTA_TTL = 300
+
+# Загрузка больших листов: размер порции в ячейках (лимит запроса ~2 МБ),
+# повторы при 429/5xx и чекпоинты для продолжения прерванной загрузки
+UPLOAD_CHUNK_CELLS = 100000
+UPLOAD_RETRIES = 6
+UPLOAD_BACKOFF_BASE = 1.0
+UPLOAD_BACKOFF_MAX = 64.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+UPLOAD_CHECKPOINT_DIR = os.getenv("UPLOAD_CHECKPOINT_DIR", ".upload_checkpoints")
+
+# Пул клиентов на процесс: учетные данные, клиент gspread (одна HTTP-сессия
+# с keep-alive) и документ discovery для Drive создаются один раз.
+# Токен обновляется сам: google-auth перевыпускает его при истечении срока.
+_clients_lock = threading.Lock()
+_creds = None
+_gsheets_client = None
+_drive_document = None
+_drive_local = threading.local()
+_generation = 0
+_quota_cache = None
+
+def _load_creds():
     # 1. Пробуем взять из секретов Streamlit (для Облака)
     try:
         if "gcp_service_account" in st.secrets:
             return Credentials.from_service_account_info(
                 st.secrets["gcp_service_account"],
-                scopes=[
-                    "https://www.googleapis.com/auth/spreadsheets",
-                    "https://www.googleapis.com/auth/drive"
-                ]
+                scopes=SCOPES
             )
     except Exception:
         # Игнорируем ошибку отсутствия secrets.toml локально
@@ -26,35 +62,76 @@ def get_creds():
     if os.path.exists(CREDENTIALS_FILE):
         return Credentials.from_service_account_file(
             CREDENTIALS_FILE, 
-            scopes=[
-                "https://www.googleapis.com/auth/spreadsheets",
-                "https://www.googleapis.com/auth/drive"
-            ]
+            scopes=SCOPES
         )
     return None
 
+def get_creds():
+    global _creds
+    with _clients_lock:
+        if _creds is None:
+            _creds = _load_creds()
+        return _creds
+
 def get_gsheets_client():
+    global _gsheets_client
     creds = get_creds()
     if not creds:
         return None
-    return gspread.authorize(creds)
+    with _clients_lock:
+        if _gsheets_client is None:
+            _gsheets_client = gspread.authorize(creds)
+        return _gsheets_client
 
 def get_drive_service():
+    """
+    Сервис Drive на поток: httplib2 внутри googleapiclient не потокобезопасен,
+    но сам discovery-документ разбирается один раз на процесс.
+    """
+    global _drive_document
     creds = get_creds()
     if not creds:
         return None
-    return build('drive', 'v3', credentials=creds)
+    cached = getattr(_drive_local, "service", None)
+    if cached is not None and cached[0] == _generation:
+        return cached[1]
+    with _clients_lock:
+        if _drive_document is None:
+            _drive_document = get_static_doc("drive", "v3")
+        document = _drive_document
+    if document:
+        service = build_from_document(document, credentials=creds)
+    else:
+        service = build('drive', 'v3', credentials=creds)
+    _drive_local.service = (_generation, service)
+    return service
+
+def reset_clients():
+    """Сбрасывает пул, например после смены credentials.json."""
+    global _creds, _gsheets_client, _quota_cache, _generation
+    with _clients_lock:
+        _creds = None
+        _gsheets_client = None
+        _quota_cache = None
+        # Сервисы Drive в других потоках пересоздадутся при следующем обращении
+        _generation += 1
 
 def get_service_account_quota():
+    global _quota_cache
+    if _quota_cache and time.monotonic() - _quota_cache[0] < QUOTA_TTL:
+        return _quota_cache[1]
     try:
         service = get_drive_service()
         if not service:
             return None
         about = service.about().get(fields="storageQuota").execute()
-        return about.get('storageQuota', {})
+        quota = about.get('storageQuota', {})
+        _quota_cache = (time.monotonic(), quota)
+        return quota
     except Exception:
         return None
 
+@profiled("find_file_in_folder")
 def find_file_in_folder(folder_id, file_name):
     service = get_drive_service()
     if not service:
@@ -71,6 +148,7 @@ def find_file_in_folder(folder_id, file_name):
     files = results.get('files', [])
     return files[0]['id'] if files else None
 
+@profiled("create_spreadsheet_in_folder")
 def create_spreadsheet_in_folder(file_name, folder_id, template_id=None):
     service = get_drive_service()
     if not service:
@@ -120,46 +198,198 @@ def create_spreadsheet_in_folder(file_name, folder_id, template_id=None):
             
     return new_file_id
 
-def upload_to_gsheet(spreadsheet_id, sheet_name, rows, headers, clear_sheet=True):
+def _backoff_status(error):
+    if isinstance(error, gspread.exceptions.APIError):
+        response = getattr(error, "response", None)
+        return getattr(response, "status_code", None)
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return "network"
+    return None
+
+def with_backoff(func, *args, retries=None, **kwargs):
+    """
+    Повторяет вызов Google API при 429/5xx и сетевых сбоях
+    с экспоненциальной задержкой и случайной добавкой (jitter).
+    """
+    retries = UPLOAD_RETRIES if retries is None else retries
+    profiler = get_profiler()
+    for attempt in range(retries + 1):
+        try:
+            with profiler.span("gsheets_api_call"):
+                return func(*args, **kwargs)
+        except Exception as e:
+            status = _backoff_status(e)
+            if attempt >= retries or (status not in RETRY_STATUSES and status != "network"):
+                raise
+            delay = min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+            print(f"[UPLOAD] Ошибка API ({status}), повтор {attempt + 1}/{retries} через {delay:.1f} с")
+            profiler.count("gsheets_api_retries")
+            time.sleep(delay)
+
+def _upload_fingerprint(spreadsheet_id, sheet_name, rows, headers, clear_sheet):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([spreadsheet_id, sheet_name, headers, clear_sheet], ensure_ascii=False, default=str).encode("utf-8"))
+    for row in rows:
+        digest.update(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def _checkpoint_path(spreadsheet_id, sheet_name):
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in f"{spreadsheet_id}_{sheet_name}")
+    return os.path.join(UPLOAD_CHECKPOINT_DIR, f"{safe_name}.json")
+
+def _load_checkpoint(path, fingerprint):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        return checkpoint if checkpoint.get("fingerprint") == fingerprint else None
+    except (OSError, ValueError):
+        return None
+
+def _save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+@profiled("upload_to_gsheet")
+def upload_to_gsheet(spreadsheet_id, sheet_name, rows, headers, clear_sheet=True, chunk_cells=None, progress=None):
+    """
+    Загружает строки на лист порциями по ~chunk_cells ячеек.
+    Лист заранее растягивается под весь объем, каждая порция пишется в свой диапазон
+    с повторами при 429/5xx. После каждой порции прогресс сохраняется в чекпоинт:
+    если загрузка оборвалась, повторный вызов с теми же данными продолжит с места обрыва.
+    progress: необязательный callback(dict) со статистикой каждой порции.
+    """
     client = get_gsheets_client()
     if not client:
         return False, "Файл credentials.json не найден"
+
+    width = max(len(headers), max((len(r) for r in rows), default=0), 1)
+    chunk_rows = max(1, (chunk_cells or UPLOAD_CHUNK_CELLS) // width)
+    fingerprint = _upload_fingerprint(spreadsheet_id, sheet_name, rows, headers, clear_sheet)
+    checkpoint_path = _checkpoint_path(spreadsheet_id, sheet_name)
+    checkpoint = _load_checkpoint(checkpoint_path, fingerprint)
+    written = 0
     
     try:
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        
-        try:
-            worksheet = spreadsheet.worksheet(sheet_name)
-            if clear_sheet:
-                # Очищаем всё
-                worksheet.clear()
-                worksheet.append_row(headers)
-        except gspread.exceptions.WorksheetNotFound:
-            # Создаем новый лист, если его нет
-            worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=100, cols=len(headers))
-            worksheet.append_row(headers)
-        
-        # Добавляем данные
-        if rows:
-            worksheet.append_rows(rows)
+        spreadsheet = with_backoff(client.open_by_key, spreadsheet_id)
+        created = False
+
+        if checkpoint:
+            # Продолжаем прерванную загрузку: лист уже подготовлен, шапка записана
+            try:
+                worksheet = with_backoff(spreadsheet.worksheet, sheet_name)
+                start_row = checkpoint["start_row"]
+                written = checkpoint["rows_written"]
+                print(f"[UPLOAD] {sheet_name}: продолжаем с строки {written + 1} из {len(rows)}")
+            except gspread.exceptions.WorksheetNotFound:
+                # Лист удалили после обрыва — грузим заново
+                checkpoint = None
+
+        if not checkpoint:
+            try:
+                worksheet = with_backoff(spreadsheet.worksheet, sheet_name)
+                if clear_sheet:
+                    # Очищаем всё и сразу задаем размер под шапку и все строки
+                    with_backoff(worksheet.clear)
+                    with_backoff(worksheet.resize, rows=len(rows) + 1, cols=width)
+                    start_row = 1
+                else:
+                    # Дописываем после последней заполненной строки по всем колонкам:
+                    # get_all_values() отдает используемый диапазон листа, поэтому пустые
+                    # ячейки в колонке A не сдвигают позицию на уже занятые строки
+                    used_rows = len(with_backoff(worksheet.get_all_values))
+                    start_row = used_rows + 1
+                    # На пустом листе данные пойдут после шапки
+                    last_row = used_rows + len(rows) + (0 if used_rows else 1)
+                    if last_row > worksheet.row_count:
+                        with_backoff(worksheet.add_rows, last_row - worksheet.row_count)
+            except gspread.exceptions.WorksheetNotFound:
+                # Создаем новый лист сразу нужного размера
+                worksheet = with_backoff(spreadsheet.add_worksheet, title=sheet_name, rows=len(rows) + 1, cols=width)
+                start_row = 1
+                created = True
+
+            # Шапку пишем только на пустой лист: очищенный, новый или пустой при дозаписи
+            if start_row == 1:
+                with_backoff(worksheet.update, range_name="A1", values=[headers], value_input_option="RAW")
+                start_row = 2
+            _save_checkpoint(checkpoint_path, {"fingerprint": fingerprint, "start_row": start_row, "rows_written": 0})
+
+        # Добавляем данные порциями
+        total_start = time.perf_counter()
+        total_chunks = (len(rows) + chunk_rows - 1) // chunk_rows
+        while written < len(rows):
+            chunk = rows[written:written + chunk_rows]
+            first_row = start_row + written
+            chunk_start = time.perf_counter()
+            with_backoff(worksheet.update, range_name=f"A{first_row}", values=chunk, value_input_option="RAW")
+            elapsed = time.perf_counter() - chunk_start
+            written += len(chunk)
+            get_profiler().count("gsheets_rows_uploaded", len(chunk))
+            _save_checkpoint(checkpoint_path, {"fingerprint": fingerprint, "start_row": start_row, "rows_written": written})
+
+            stats = {
+                "sheet": sheet_name,
+                "chunk": (written - 1) // chunk_rows + 1,
+                "chunks": total_chunks,
+                "rows": len(chunk),
+                "rows_written": written,
+                "rows_total": len(rows),
+                "seconds": elapsed,
+                "rows_per_sec": len(chunk) / elapsed if elapsed else 0.0,
+                "cells_per_sec": len(chunk) * width / elapsed if elapsed else 0.0,
+            }
+            print(f"[UPLOAD] {sheet_name}: порция {stats['chunk']}/{total_chunks}, "
+                  f"строки {first_row}-{first_row + len(chunk) - 1}, "
+                  f"{stats['rows_per_sec']:.0f} строк/с ({stats['cells_per_sec']:.0f} ячеек/с)")
+            if progress:
+                progress(stats)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
             
         # Попытка удалить "Лист1/Sheet1", если он пустой и мы только что создали другой лист
-        try:
-            default_sheet = spreadsheet.sheet1
-            if default_sheet.title in ["Лист1", "Sheet1"] and default_sheet.title != sheet_name:
-                # Проверяем, пустой ли он (необязательно, но безопаснее)
-                if not default_sheet.get_all_values():
-                    spreadsheet.del_worksheet(default_sheet)
-        except:
-            pass
-        
-        return True, f"Данные успешно обновлены в '{sheet_name}'"
+        if created:
+            try:
+                default_sheet = spreadsheet.sheet1
+                if default_sheet.title in ["Лист1", "Sheet1"] and default_sheet.title != sheet_name:
+                    # Проверяем, пустой ли он (необязательно, но безопаснее)
+                    if not default_sheet.get_all_values():
+                        spreadsheet.del_worksheet(default_sheet)
+            except:
+                pass
+
+        total_elapsed = time.perf_counter() - total_start
+        rate = f", {len(rows) / total_elapsed:.0f} строк/с" if rows and total_elapsed else ""
+        return True, f"Данные успешно обновлены в '{sheet_name}' ({len(rows)} строк{rate})"
     except Exception as e:
+        if written:
+            return False, f"{e} (записано {written} из {len(rows)} строк, повторная загрузка продолжит с этого места)"
         return False, str(e)
 
-def read_all_sheets_data(spreadsheet_id):
+def _quote_sheet(title):
+    return "'" + title.replace("'", "''") + "'"
+
+def _column_letter(idx):
+    # 0 -> A, 25 -> Z, 26 -> AA
+    letters = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+@profiled("read_all_sheets_data")
+def read_all_sheets_data(spreadsheet_id, columns=None):
     """
-    Читает все листы из таблицы и возвращает словарь {sheet_name: list_of_dicts}
+    Читает все листы таблицы одним запросом values:batchGet (по колонкам)
+    и возвращает словарь {sheet_name: ColumnTable}.
+    ColumnTable ведет себя как список записей {заголовок: значение}.
+    columns: {sheet_name: [заголовки]} — читать только эти колонки этих листов
+    (одним лишним запросом за строкой заголовков). Число строк тогда считается
+    по прочитанным колонкам.
     """
     client = get_gsheets_client()
     if not client:
@@ -167,34 +397,222 @@ def read_all_sheets_data(spreadsheet_id):
     
     try:
         spreadsheet = client.open_by_key(spreadsheet_id)
-        worksheets = spreadsheet.worksheets()
-        
+        titles = [ws.title for ws in spreadsheet.worksheets()]
+        params = {"majorDimension": "COLUMNS"}
+
+        if columns is None:
+            ranges = {title: [_quote_sheet(title)] for title in titles}
+            header_map = None
+        else:
+            titles = [t for t in titles if t in columns]
+            header_resp = spreadsheet.values_batch_get(
+                [f"{_quote_sheet(t)}!1:1" for t in titles], params={"majorDimension": "ROWS"}
+            ) if titles else {"valueRanges": []}
+            ranges = {}
+            header_map = {}
+            for title, value_range in zip(titles, header_resp.get("valueRanges", [])):
+                header_row = (value_range.get("values") or [[]])[0]
+                wanted = set(columns[title])
+                # При дублях заголовка побеждает последняя колонка, как в записи dict
+                positions = {h: i for i, h in enumerate(header_row) if h and h in wanted}
+                header_map[title] = list(positions)
+                ranges[title] = [
+                    f"{_quote_sheet(title)}!{_column_letter(i)}:{_column_letter(i)}"
+                    for i in positions.values()
+                ]
+
+        flat_ranges = [r for title in titles for r in ranges[title]]
+        value_ranges = iter(
+            spreadsheet.values_batch_get(flat_ranges, params=params).get("valueRanges", [])
+            if flat_ranges else []
+        )
+
         result = {}
-        for ws in worksheets:
-            # get_all_records() возвращает список словарей, где ключи - заголовки
-            # Если заголовки пустые или дублируются, это может вызвать ошибку.
-            # Поэтому используем get_all_values() и обрабатываем сами.
-            rows = ws.get_all_values()
-            if not rows:
-                result[ws.title] = []
-                continue
-                
-            headers = rows[0]
-            data = []
-            for row in rows[1:]:
-                # Создаем словарь, пропуская пустые заголовки
-                record = {}
-                for i, cell in enumerate(row):
-                    if i < len(headers) and headers[i]:
-                        record[headers[i]] = cell
-                data.append(record)
-            result[ws.title] = data
+        for title in titles:
+            if header_map is None:
+                sheet_columns = next(value_ranges).get("values", [])
+                data = {}
+                length = max((len(c) for c in sheet_columns), default=1) - 1
+                for column in sheet_columns:
+                    # Пустые заголовки пропускаем
+                    if column and column[0]:
+                        data[column[0]] = column[1:]
+                result[title] = ColumnTable(data, max(length, 0))
+            else:
+                data = {}
+                for header in header_map[title]:
+                    column = (next(value_ranges).get("values") or [[]])[0]
+                    data[header] = column[1:]
+                result[title] = ColumnTable(data)
             
         return result
     except Exception as e:
         print(f"Error reading spreadsheet {spreadsheet_id}: {e}")
         return None
 
+@profiled("get_modified_time")
+def get_modified_time(file_id):
+    """modifiedTime файла в Drive (RFC 3339) или None, если узнать не удалось."""
+    try:
+        service = get_drive_service()
+        if not service:
+            return None
+        meta = service.files().get(fileId=file_id, fields="modifiedTime", supportsAllDrives=True).execute()
+        return meta.get("modifiedTime")
+    except Exception as e:
+        print(f"[SNAPSHOT] Не удалось получить modifiedTime {file_id}: {e}")
+        return None
+
+@profiled("read_all_sheets_data_cached")
+def read_all_sheets_data_cached(spreadsheet_id, columns=None, store=None, modified_time=None):
+    """
+    read_all_sheets_data через локальный снимок (Parquet).
+    Если в Drive ревизия таблицы не изменилась, данные читаются с диска;
+    при новой ревизии (или если ее не узнать) — из Google Sheets, и снимок обновляется.
+    modified_time — уже известная ревизия (get_modified_time), чтобы не спрашивать Drive повторно.
+    """
+    store = store or get_snapshot_store()
+    if not store.available:
+        modified_time = None
+    elif modified_time is None:
+        modified_time = get_modified_time(spreadsheet_id)
+    if modified_time:
+        data = store.load(spreadsheet_id, modified_time, columns)
+        if data is not None:
+            print(f"[SNAPSHOT] {spreadsheet_id}: данные с диска (ревизия {modified_time})")
+            get_profiler().count("gsheets_snapshot_hits")
+            return data
+
+    data = read_all_sheets_data(spreadsheet_id, columns=columns)
+    if data is not None and modified_time:
+        store.save(spreadsheet_id, modified_time, data, columns)
+    return data
+
+# Первая строка данных на листе сверки (1-2 — шапка шаблона)
+DATA_START_ROW = 3
+# Колонка F — номер документа поставщика: по нему строки листа сопоставляются с новыми
+DOC_COL_IDX = 5
+
+# Итоги сверки в колонках B и C первых строк листа: (подпись, ключ summary, текст для пустого значения)
+SUMMARY_LINES = [
+    ("Оборот IIKO", "iiko_total", None),
+    ("Оборот SAP", "sap_total", None),
+    ("Оборот FB", "fb_total", None),
+    ("Оборот Акт", "act_total", None),
+    ("Дельта (Акт - IIKO)", "delta_act_iiko", None),
+    ("Дельта (Акт - SAP)", "delta_act_sap", None),
+    ("Дельта (Акт - FB)", "delta_act_fb", None),
+    ("Кол-во док. Акт", "act_count", None),
+    ("Кол-во док. IIKO", "iiko_count", None),
+    ("Дельта кол-ва", "delta_count", None),
+    ("Дубли IIKO", "iiko_duplicates", "Нет"),
+    ("Лишние в IIKO", "iiko_missing", "Нет"),
+    ("Лишние в Акте", "act_missing", "Нет"),
+]
+
+def _cell_key(value):
+    # Сравнение ячеек: числа — по значению (100 == 100.0), пустое == None
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+def _doc_key(row, key_col=DOC_COL_IDX):
+    # Номер документа строки; 12345 (число из UNFORMATTED_VALUE) == "12345"
+    value = row[key_col] if key_col < len(row) else ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def align_sheet_rows(old_rows, new_rows, sheet_id, start_row, key_col=DOC_COL_IDX):
+    """
+    Сопоставляет строки листа с новыми по номеру документа (difflib по колонке key_col).
+    Возвращает (requests, aligned):
+      requests — insertDimension/deleteDimension для spreadsheet.batch_update: строки
+      исчезнувших документов удаляются, для новых вставляются пустые, так что
+      оставшиеся документы остаются на своих строках листа вместе со всем, что
+      пользователь держит в этих строках (форматирование, заметки, колонки правее AK);
+      aligned — строки листа после этих операций, по одной на каждую новую строку
+      ([] для вставленных), для сравнения значений в diff_sheet_rows().
+    Операции идут снизу вверх, поэтому индексы в каждой считаются по исходному листу.
+    """
+    matcher = difflib.SequenceMatcher(
+        None, [_doc_key(row, key_col) for row in old_rows], [_doc_key(row, key_col) for row in new_rows],
+        autojunk=False,
+    )
+    blocks = []
+    aligned = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            aligned.extend(old_rows[i1:i2])
+            continue
+        # Другие документы: старые строки удаляются, новые вставляются на их место,
+        # чтобы содержимое строки чужого документа не досталось новому
+        first = start_row - 1 + i1
+        ops = []
+        if i2 > i1:
+            ops.append({"deleteDimension": {"range": {
+                "sheetId": sheet_id, "dimension": "ROWS", "startIndex": first, "endIndex": start_row - 1 + i2,
+            }}})
+        if j2 > j1:
+            # Формат вставленных строк берется у соседней строки данных, а не у шапки
+            ops.append({"insertDimension": {"range": {
+                "sheetId": sheet_id, "dimension": "ROWS", "startIndex": first, "endIndex": first + j2 - j1,
+            }, "inheritFromBefore": first > start_row - 1}})
+        aligned.extend([] for _ in range(j2 - j1))
+        blocks.append(ops)
+    requests = [op for ops in reversed(blocks) for op in ops]
+    return requests, aligned
+
+def _rows_delta(requests):
+    # Насколько операции align_sheet_rows() меняют число строк листа
+    delta = 0
+    for request in requests:
+        for kind, sign in (("insertDimension", 1), ("deleteDimension", -1)):
+            if kind in request:
+                row_range = request[kind]["range"]
+                delta += sign * (row_range["endIndex"] - row_range["startIndex"])
+    return delta
+
+def diff_sheet_rows(old_rows, new_rows, start_row, max_col_idx):
+    """
+    Сравнивает строки листа с новыми и возвращает диапазоны для worksheet.batch_update:
+    подряд идущие изменившиеся строки объединяются в один диапазон A:AK.
+    Старые строки за концом новых данных затираются пустыми значениями.
+    Строки сравниваются по позиции: сначала выровняйте их через align_sheet_rows().
+    """
+    width = max_col_idx + 1
+    empty = [""] * width
+    last_col = _column_letter(max_col_idx)
+    updates = []
+    block_start = None
+    block = []
+    for i in range(max(len(old_rows), len(new_rows))):
+        new_row = new_rows[i] if i < len(new_rows) else empty
+        old_row = old_rows[i] if i < len(old_rows) else []
+        changed = any(
+            _cell_key(new_row[c]) != _cell_key(old_row[c] if c < len(old_row) else None)
+            for c in range(width)
+        )
+        if changed:
+            if block_start is None:
+                block_start = i
+            block.append(new_row)
+        elif block:
+            updates.append(_rows_range(block_start, block, start_row, last_col))
+            block_start, block = None, []
+    if block:
+        updates.append(_rows_range(block_start, block, start_row, last_col))
+    return updates
+
+def _rows_range(block_start, block, start_row, last_col):
+    first = start_row + block_start
+    return {"range": f"A{first}:{last_col}{first + len(block) - 1}", "values": block}
+
+@profiled("update_supplier_sheet")
 def update_supplier_sheet(spreadsheet_id, sheet_name, data, summary=None):
     """
     Обновляет данные на конкретном листе с сохранением комментариев пользователя.
@@ -289,37 +707,37 @@ def update_supplier_sheet(spreadsheet_id, sheet_name, data, summary=None):
                     print(f"[DEBUG] Не удалось скопировать. Создаем пустой.")
                     worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=100, cols=40)
 
-        # 2. Читаем старые комментарии (Col AD/29 и Col AK/36)
+        # 2. Читаем текущие строки данных (с 3-й строки): из них берем старые
+        # комментарии (Col AD/29 и Col AK/36) и с ними же сравниваем новые строки.
+        # UNFORMATTED_VALUE — числа приходят числами, а не в формате локали
+        old_rows = []
         old_comments = {} 
         try:
-            # Читаем только нужные колонки для скорости, но get_all_values проще
-            all_values = worksheet.get_all_values()
-            # Пропускаем заголовки (первые 2 строки)
-            if len(all_values) > 2:
-                for row in all_values[2:]:
-                    # Безопасное чтение индекса
-                    if len(row) > 5:
-                        doc_num = str(row[5]).strip() # Col F
-                        
-                        manager_comment = ""
-                        dxbx_comment = ""
-                        
-                        # DXBX Comment (Index 29 / AD)
-                        if len(row) > 29:
-                            dxbx_comment = str(row[29]).strip()
-                            
-                        # Manager Comment (Index 36 / AK)
-                        if len(row) > 36:
-                            manager_comment = str(row[36]).strip()
+            old_rows = worksheet.get_values(f"A{DATA_START_ROW}:AK", value_render_option="UNFORMATTED_VALUE")
+            for row in old_rows:
+                # Безопасное чтение индекса
+                if len(row) > 5:
+                    doc_num = _doc_key(row) # Col F
+                    
+                    manager_comment = ""
+                    dxbx_comment = ""
+                    
+                    # DXBX Comment (Index 29 / AD)
+                    if len(row) > 29:
+                        dxbx_comment = str(row[29]).strip()
                         
-                        if doc_num and (manager_comment or dxbx_comment):
-                            old_comments[doc_num] = {
-                                "manager": manager_comment,
-                                "dxbx": dxbx_comment
-                            }
+                    # Manager Comment (Index 36 / AK)
+                    if len(row) > 36:
+                        manager_comment = str(row[36]).strip()
+                    
+                    if doc_num and (manager_comment or dxbx_comment):
+                        old_comments[doc_num] = {
+                            "manager": manager_comment,
+                            "dxbx": dxbx_comment
+                        }
         except Exception as e:
             print(f"[DEBUG] Ошибка чтения комментариев: {e}")
-            pass
+            old_rows = None
             
         # 3. Формируем новые строки
         new_rows_data = []
@@ -344,101 +762,17 @@ def update_supplier_sheet(spreadsheet_id, sheet_name, data, summary=None):
                 if not row_list[29] and comments.get("dxbx"):
                     row_list[29] = comments["dxbx"]
             
-            # === ВСТАВКА ИТОГОВ (SUMMARY) В КОЛОНКИ B и C (Индексы 1 и 2) ===
-            # Вставляем только в первые 12 строк данных
-            if summary:
-                if i == 0:
-                    row_list[1] = "Оборот IIKO"
-                    row_list[2] = summary.get("iiko_total", 0)
-                elif i == 1:
-                    row_list[1] = "Оборот SAP"
-                    row_list[2] = summary.get("sap_total", 0)
-                elif i == 2:
-                    row_list[1] = "Оборот FB"
-                    row_list[2] = summary.get("fb_total", 0)
-                elif i == 3:
-                    row_list[1] = "Оборот Акт"
-                    row_list[2] = summary.get("act_total", 0)
-                elif i == 4:
-                    row_list[1] = "Дельта (Акт - IIKO)"
-                    row_list[2] = summary.get("delta_act_iiko", 0)
-                elif i == 5:
-                    row_list[1] = "Дельта (Акт - SAP)"
-                    row_list[2] = summary.get("delta_act_sap", 0)
-                elif i == 6:
-                    row_list[1] = "Дельта (Акт - FB)"
-                    row_list[2] = summary.get("delta_act_fb", 0)
-                elif i == 7:
-                    row_list[1] = "Кол-во док. Акт"
-                    row_list[2] = summary.get("act_count", 0)
-                elif i == 8:
-                    row_list[1] = "Кол-во док. IIKO"
-                    row_list[2] = summary.get("iiko_count", 0)
-                elif i == 9:
-                    row_list[1] = "Дельта кол-ва"
-                    row_list[2] = summary.get("delta_count", 0)
-                elif i == 10:
-                    row_list[1] = "Дубли IIKO"
-                    val = summary.get("iiko_duplicates", "")
-                    row_list[2] = val if val else "Нет"
-                elif i == 11:
-                    row_list[1] = "Лишние в IIKO"
-                    val = summary.get("iiko_missing", "")
-                    row_list[2] = val if val else "Нет"
-                elif i == 12:
-                    row_list[1] = "Лишние в Акте"
-                    val = summary.get("act_missing", "")
-                    row_list[2] = val if val else "Нет"
-            
             new_rows_data.append(row_list)
             
-        # Если строк данных меньше 13, нужно добить пустыми строками, чтобы вывести саммари
-        while summary and len(new_rows_data) < 13:
-            i = len(new_rows_data)
-            row_list = [""] * (MAX_COL_IDX + 1)
-            if i == 0:
-                row_list[1] = "Оборот IIKO"
-                row_list[2] = summary.get("iiko_total", 0)
-            elif i == 1:
-                row_list[1] = "Оборот SAP"
-                row_list[2] = summary.get("sap_total", 0)
-            elif i == 2:
-                row_list[1] = "Оборот FB"
-                row_list[2] = summary.get("fb_total", 0)
-            elif i == 3:
-                row_list[1] = "Оборот Акт"
-                row_list[2] = summary.get("act_total", 0)
-            elif i == 4:
-                row_list[1] = "Дельта (Акт - IIKO)"
-                row_list[2] = summary.get("delta_act_iiko", 0)
-            elif i == 5:
-                row_list[1] = "Дельта (Акт - SAP)"
-                row_list[2] = summary.get("delta_act_sap", 0)
-            elif i == 6:
-                row_list[1] = "Дельта (Акт - FB)"
-                row_list[2] = summary.get("delta_act_fb", 0)
-            elif i == 7:
-                row_list[1] = "Кол-во док. Акт"
-                row_list[2] = summary.get("act_count", 0)
-            elif i == 8:
-                row_list[1] = "Кол-во док. IIKO"
-                row_list[2] = summary.get("iiko_count", 0)
-            elif i == 9:
-                row_list[1] = "Дельта кол-ва"
-                row_list[2] = summary.get("delta_count", 0)
-            elif i == 10:
-                row_list[1] = "Дубли IIKO"
-                val = summary.get("iiko_duplicates", "")
-                row_list[2] = val if val else "Нет"
-            elif i == 11:
-                row_list[1] = "Лишние в IIKO"
-                val = summary.get("iiko_missing", "")
-                row_list[2] = val if val else "Нет"
-            elif i == 12:
-                row_list[1] = "Лишние в Акте"
-                val = summary.get("act_missing", "")
-                row_list[2] = val if val else "Нет"
-            new_rows_data.append(row_list)
+        # === ВСТАВКА ИТОГОВ (SUMMARY) В КОЛОНКИ B и C (Индексы 1 и 2) ===
+        # Если строк данных меньше, чем строк итогов, добиваем пустыми строками
+        if summary:
+            while len(new_rows_data) < len(SUMMARY_LINES):
+                new_rows_data.append([""] * (MAX_COL_IDX + 1))
+            for i, (label, key, empty_text) in enumerate(SUMMARY_LINES):
+                val = summary.get(key, empty_text if empty_text is not None else 0)
+                new_rows_data[i][1] = label
+                new_rows_data[i][2] = val if val or empty_text is None else empty_text
 
         # DEBUG PRINT: Выводим первые 5 строк (для отладки)
         print("\n--- DEBUG: DATA TO WRITE (First 5 rows) ---")
@@ -446,21 +780,45 @@ def update_supplier_sheet(spreadsheet_id, sheet_name, data, summary=None):
             print(f"Row {i+1}: {r}")
         print("-------------------------------------------\n")
             
-        # 4. Записываем
-        print(f"[DEBUG] Записываем {len(new_rows_data)} строк в {sheet_name} (start A3)")
-        
-        # Очистка диапазона данных (берем с запасом до 5000 строки)
-        # Важно не стереть заголовки (1-2 строки)
-        try:
-             worksheet.batch_clear([f"A3:AK5000"])
-        except Exception as e:
-             print(f"[DEBUG] Ошибка очистки: {e}")
+        # 4. Записываем только изменившиеся строки одним values:batchUpdate.
+        # Лишние старые строки ниже новых данных стираем в том же запросе.
+        if old_rows is None:
+            # Не смогли прочитать лист — переписываем все и чистим хвост до конца листа
+            updates = [_rows_range(0, new_rows_data, DATA_START_ROW, "AK")] if new_rows_data else []
+            try:
+                worksheet.batch_clear([f"A{DATA_START_ROW + len(new_rows_data)}:AK"])
+            except Exception as e:
+                print(f"[DEBUG] Ошибка очистки: {e}")
+            row_count = worksheet.row_count
+        else:
+            # Сначала вставляем/удаляем строки по номерам документов (один атомарный запрос),
+            # затем пишем только строки, значения которых отличаются
+            row_requests, aligned_rows = align_sheet_rows(old_rows, new_rows_data, worksheet.id, DATA_START_ROW)
+            if row_requests:
+                try:
+                    spreadsheet.batch_update({"requests": row_requests})
+                    old_rows = aligned_rows
+                except Exception as e:
+                    # Запрос атомарный: лист не изменился, сравниваем по позиции
+                    print(f"[DEBUG] Не удалось переставить строки по документам: {e}")
+                    row_requests = []
+            # worksheet.row_count не знает о вставках и удалениях выше
+            row_count = worksheet.row_count + _rows_delta(row_requests)
+            updates = diff_sheet_rows(old_rows, new_rows_data, DATA_START_ROW, MAX_COL_IDX)
+            if row_requests:
+                print(f"[DEBUG] {sheet_name}: строк вставлено/удалено по документам: {len(row_requests)} операций")
+        changed_rows = sum(len(u["values"]) for u in updates)
+        print(f"[DEBUG] {sheet_name}: строк {len(new_rows_data)}, изменилось {changed_rows} (диапазонов: {len(updates)})")
+
+        # Лист должен вмещать все строки — отдельного потолка в 5000 строк больше нет
+        needed_rows = DATA_START_ROW - 1 + len(new_rows_data)
+        if needed_rows > row_count:
+            worksheet.resize(rows=needed_rows)
 
-        range_start = "A3"
-        if new_rows_data:
-            worksheet.update(range_name=range_start, values=new_rows_data)
+        if updates:
+            worksheet.batch_update(updates, value_input_option="RAW")
                 
-        return True, f"Результаты сверки обновлены на листе '{sheet_name}' (комментарии сохранены, шаблон соблюден)"
+        return True, f"Результаты сверки обновлены на листе '{sheet_name}': изменено строк {changed_rows} (комментарии сохранены, шаблон соблюден)"
     except Exception as e:
         print(f"[ERROR] update_supplier_sheet: {e}")
         return False, str(e)
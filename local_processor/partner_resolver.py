@@ -0,0 +1,67 @@
+import numpy as np
+from rapidfuzz import process, fuzz, utils
+
+from column_table import column_values
+
+
+def clean_supplier_name(supplier_name):
+    # "Поставщик (ИНН ...)" -> "Поставщик"
+    return str(supplier_name).split("(")[0].strip()
+
+
+class PartnerResolver:
+    """
+    Сопоставление поставщиков из настроек с контрагентами в данных систем.
+    Словарь контрагентов каждой системы нормализуется один раз на таблицу систем,
+    все поставщики сравниваются одним вызовом rapidfuzz cdist,
+    результат кэшируется: {поставщик: {система: set(контрагентов)}}.
+    """
+    def __init__(self, system_data_map, partner_cols, threshold=85, limit=5):
+        self.threshold = threshold
+        self.limit = limit
+        self._cache = {}
+        self.vocab = {}
+        self._processed = {}
+        for sys_name, records in system_data_map.items():
+            col = partner_cols.get(sys_name)
+            if not col:
+                continue
+            unique_partners = set()
+            for p in column_values(records, col):
+                if p:
+                    unique_partners.add(str(p).strip())
+            partners = sorted(unique_partners)
+            self.vocab[sys_name] = partners
+            self._processed[sys_name] = [utils.default_process(p) for p in partners]
+            print(f"[RECON]   System {sys_name} has {len(partners)} unique partners.")
+
+    def resolve_many(self, supplier_names):
+        pending = [name for name in dict.fromkeys(supplier_names) if name not in self._cache]
+        if pending:
+            queries = [utils.default_process(clean_supplier_name(name)) for name in pending]
+            matched = {name: {} for name in pending}
+            for sys_name, partners in self.vocab.items():
+                if not partners:
+                    for name in pending:
+                        matched[name][sys_name] = set()
+                    continue
+                scores = process.cdist(
+                    queries,
+                    self._processed[sys_name],
+                    scorer=fuzz.partial_ratio,
+                    processor=None,
+                    score_cutoff=self.threshold,
+                    workers=-1,
+                )
+                for row_idx, name in enumerate(pending):
+                    row = scores[row_idx]
+                    # Как process.extract(limit=...) с отсечкой по порогу
+                    top = np.argsort(-row, kind="stable")[:self.limit]
+                    matched[name][sys_name] = {
+                        partners[i] for i in top if row[i] >= self.threshold
+                    }
+            self._cache.update(matched)
+        return {name: self._cache[name] for name in supplier_names}
+
+    def resolve(self, supplier_name):
+        return self.resolve_many([supplier_name])[supplier_name]
@@ -0,0 +1,220 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from processor import PROVIDER_LIMITS, ExcelSource, UniversalProcessor
+from profiling import get_profiler
+
+# Стадии файла в конвейере
+STAGE_PARSE = "parse"
+STAGE_LLM = "llm"
+STAGE_DONE = "done"
+STAGE_ERROR = "error"
+
+# Разбор Excel — в отдельных процессах (CPU), не больше этого числа
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+# Файлов на стадии LLM одновременно; запросы внутри файла дополнительно ограничены лимитером провайдера
+LLM_WORKERS = max(limits["max_in_flight"] for limits in PROVIDER_LIMITS.values())
+
+# Процессор один на рабочий процесс разбора
+_worker_processor = None
+
+# Пулы общие для всех сессий Streamlit (модуль импортируется один раз на сервер),
+# закрываются при выходе процесса
+_pools_lock = threading.Lock()
+_parse_pool = None
+_llm_pool = None
+
+
+def _init_parse_worker():
+    global _worker_processor
+    # Разбор не обращается к LLM, модель процессору не нужна
+    _worker_processor = UniversalProcessor(columnar=True)
+
+
+def _parse_job(source, file_name):
+    # Профиль разбора копится в рабочем процессе — отдаем его вместе с результатом
+    parsed = _worker_processor.parse_file(source, file_name=file_name)
+    return parsed, get_profiler().drain()
+
+
+def get_parse_pool():
+    global _parse_pool
+    with _pools_lock:
+        if _parse_pool is None:
+            # spawn: рабочие процессы не наследуют потоки сервера Streamlit
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_parse_worker,
+            )
+        return _parse_pool
+
+
+def get_llm_pool():
+    global _llm_pool
+    with _pools_lock:
+        if _llm_pool is None:
+            _llm_pool = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="pipeline-llm")
+        return _llm_pool
+
+
+def _reset_parse_pool(broken):
+    # Упавший рабочий процесс ломает пул целиком — следующий файл получит новый
+    global _parse_pool
+    with _pools_lock:
+        if _parse_pool is broken:
+            _parse_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools(wait=True):
+    global _parse_pool, _llm_pool
+    with _pools_lock:
+        pools = [pool for pool in (_parse_pool, _llm_pool) if pool is not None]
+        _parse_pool = _llm_pool = None
+    for pool in pools:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+atexit.register(shutdown_pools)
+
+
+class FilePipeline:
+    """
+    Фоновая обработка загруженных файлов в две стадии, файлы не ждут друг друга:
+    разбор Excel и заголовков (parse_file) идет в пуле процессов,
+    номера документов через LLM (finish_file) — в пуле потоков, пока другие файлы разбираются.
+    Пулы общие на процесс (get_parse_pool/get_llm_pool), сам FilePipeline хранит только
+    состояние своих файлов, поэтому его можно держать в сессии и просто выбрасывать.
+    Одновременные запросы к LLM все равно ограничены общим лимитером провайдера.
+
+    Состояние файлов читается через jobs()/collect() из потока Streamlit;
+    сами стадии идут в фоне и переживают перезапуски скрипта.
+    Файл, уже обработанный с теми же настройками (в том числе в прошлой сессии),
+    берется из кэша результатов сразу в submit, без разбора и LLM.
+    """
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # Ключи и чтение/запись кэша результатов (без LLM)
+        self._processor = UniversalProcessor(model_name=model_name)
+
+    def submit(self, key, file_name, source, options):
+        """
+        Ставит файл в очередь. source — путь или содержимое файла (bytes загрузки,
+        без записи на диск). options — income_keywords, expense_keywords, extraction_mode.
+        """
+        job = {
+            "key": key,
+            "filename": file_name,
+            "stage": STAGE_PARSE,
+            "numbers": 0,
+            "result": None,
+            "error": None,
+            "started": time.monotonic(),
+            "seconds": None,
+            "cached": False,
+        }
+        with self._lock:
+            self._jobs[key] = job
+        result_key = None
+        if self._processor.use_cache:
+            excel = ExcelSource(source, file_name)
+            source = excel.frame_source()
+            result_key = self._processor.result_cache_key(excel, **options)
+            cached = self._processor.get_cached_result(result_key)
+            if cached is not None:
+                self._update(key, cached=True)
+                self._finish(key, result=cached)
+                return
+        pool = get_parse_pool()
+        try:
+            future = pool.submit(_parse_job, source, file_name)
+        except BrokenProcessPool:
+            _reset_parse_pool(pool)
+            pool = get_parse_pool()
+            future = pool.submit(_parse_job, source, file_name)
+        future.add_done_callback(lambda f: self._on_parsed(key, f, options, result_key, pool))
+
+    def _on_parsed(self, key, future, options, result_key=None, pool=None):
+        try:
+            parsed, profile = future.result()
+            get_profiler().merge(profile)
+        except BrokenProcessPool as e:
+            _reset_parse_pool(pool)
+            self._finish(key, error=str(e))
+            return
+        except Exception as e:
+            self._finish(key, error=str(e))
+            return
+        if parsed[1] != "parsed":
+            if result_key:
+                self._processor.store_result(result_key, parsed)
+            self._finish(key, result=parsed)
+            return
+        self._update(key, stage=STAGE_LLM)
+        get_llm_pool().submit(self._enrich, key, parsed, options, result_key)
+
+    def _enrich(self, key, parsed, options, result_key=None):
+        try:
+            processor = UniversalProcessor(
+                model_name=self.model_name,
+                on_numbers=lambda numbers: self._add_numbers(key, len(numbers)),
+            )
+            result = processor.finish_file(parsed, **options)
+            if result_key:
+                processor.store_result(result_key, result)
+        except Exception as e:
+            self._finish(key, error=str(e))
+            return
+        self._finish(key, result=result)
+
+    def _add_numbers(self, key, count):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job:
+                job["numbers"] += count
+
+    def _update(self, key, **fields):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job:
+                job.update(fields)
+
+    def _finish(self, key, result=None, error=None):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job:
+                job.update(
+                    stage=STAGE_ERROR if error else STAGE_DONE,
+                    result=result,
+                    error=error,
+                    seconds=time.monotonic() - job["started"],
+                )
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._jobs
+
+    def jobs(self):
+        """Копия состояния всех файлов в очереди: {key: job}."""
+        with self._lock:
+            return {key: dict(job) for key, job in self._jobs.items()}
+
+    def pending(self):
+        with self._lock:
+            return any(job["stage"] in (STAGE_PARSE, STAGE_LLM) for job in self._jobs.values())
+
+    def collect(self):
+        """Забирает завершенные файлы (готовые и с ошибкой) из очереди."""
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job["stage"] in (STAGE_DONE, STAGE_ERROR)]
+            for job in finished:
+                del self._jobs[job["key"]]
+        return finished
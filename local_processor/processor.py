@@ -1,18 +1,45 @@
-import ollama
+import io
 import json
 import os
-import re
+import tempfile
 import time
+import threading
 import psutil
-import requests
 from datetime import datetime
 from dotenv import load_dotenv
 
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
 # Загружаем переменные окружения
 load_dotenv()
 
 from excel_preprocessor.cleaner import clean_excel
 
+# Общее ядро извлечения — пакет из корня репозитория (pip install -e .., см. README)
+from extraction_core import (
+    RULE_CONFIDENCE_THRESHOLD,
+    StreamingPairParser,
+    analyze_header_rows as analyze_header_rows_core,
+    best_system,
+    build_label_index,
+    classify_by_keywords,
+    extract_doc_number_rules,
+    get_chunk_planner,
+    get_llm_cache,
+    get_llm_client,
+    get_llm_metrics,
+    normalize_doc_number,
+    parse_llm_json,
+    prepare_keywords,
+    prompt_version,
+    yandex_completion,
+)
+from profiling import get_profiler, profiled
+from result_cache import config_version, file_digest, get_result_cache, make_result_key
+
 SYSTEM_CONFIG = {
     "IIKO": {
         "output_headers": [
@@ -110,141 +137,189 @@ SYSTEM_CONFIG = {
     },
 }
 
-def normalize_header(value):
-    if value is None:
-        return ""
-    text = str(value).strip().lower()
-    text = re.sub(r"[«»\"']", "", text)
-    text = re.sub(r"\s+", " ", text)
-    return text
+# Версия конфигурации систем для ключа кэша результатов
+SYSTEM_CONFIG_VERSION = config_version(SYSTEM_CONFIG)
 
-def find_header_row(rows, system_name, max_rows=100):
-    config = SYSTEM_CONFIG.get(system_name)
-    if not config:
+# Ограничения на провайдера LLM: сколько чанков в полёте одновременно
+# и сколько запросов в секунду допускаем (общий лимит на процесс)
+PROVIDER_LIMITS = {
+    "yandex": {"max_in_flight": 4, "rps": 5.0},
+    "ollama": {"max_in_flight": 1, "rps": 2.0},
+}
+
+# Общий бюджет (сек) на один вызов LLM вместе с повторами:
+# один зависший ответ не должен держать весь файл
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+# Ожидаемая длина ответа на одну строку {"id": "номер"} в токенах — стартовая оценка планировщика чанков
+DOC_NUMBER_OUTPUT_TOKENS = 12
+# Потоковые ответы LLM (LLM_STREAM=1): пары {id: номер} разбираются по мере генерации.
+# По умолчанию выключено — ответ приходит целиком, как раньше
+LLM_STREAM = os.getenv("LLM_STREAM", "0") == "1"
+
+class RateLimiter:
+    """
+    Простой потокобезопасный лимитер: выдерживает минимальный интервал
+    между стартами запросов (1 / rps).
+    """
+    def __init__(self, rps):
+        self.min_interval = 1.0 / rps if rps else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.min_interval:
+            return
+        with self._lock:
+            start = max(time.monotonic(), self._next_at)
+            self._next_at = start + self.min_interval
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider):
+    # Один лимитер на провайдера на весь процесс, т.к. app.py создает
+    # новый UniversalProcessor на каждый файл
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(provider)
+        if limiter is None:
+            rps = PROVIDER_LIMITS.get(provider, {}).get("rps")
+            limiter = RateLimiter(rps)
+            _rate_limiters[provider] = limiter
+        return limiter
+
+LABEL_INDEX = build_label_index(SYSTEM_CONFIG)
+
+@profiled("detect_headers")
+def analyze_header_rows(rows, max_rows=100):
+    """
+    Один проход по окну заголовков для всех систем SYSTEM_CONFIG.
+    Возвращает {system: {"header_idx": int, "score": int, "col_map": {key: col|None}}}.
+    """
+    return analyze_header_rows_core(rows, SYSTEM_CONFIG, LABEL_INDEX, max_rows)
+
+def find_header_row(rows, system_name, max_rows=100, analysis=None):
+    if system_name not in SYSTEM_CONFIG:
         return None
-    best_index = None
-    best_score = 0
-    for i, row in enumerate(rows[:max_rows]):
-        normalized = [normalize_header(cell) for cell in row]
-        if not any(normalized):
-            continue
-        score = 0
-        for field in config["fields"]:
-            for label in field["labels"]:
-                if normalize_header(label) in normalized:
-                    score += 1
-                    break
-        if score > best_score:
-            best_score = score
-            best_index = i
-    return best_index
+    if analysis is None:
+        analysis = analyze_header_rows(rows, max_rows)
+    info = analysis.get(system_name)
+    return info["header_idx"] if info else None
 
 def build_column_map(header_row, system_name):
     config = SYSTEM_CONFIG.get(system_name)
     if not config:
         return None
-    normalized = [normalize_header(cell) for cell in header_row]
-    col_map = {}
-    for field in config["fields"]:
-        col_idx = None
-        for label in field["labels"]:
-            norm_label = normalize_header(label)
-            if norm_label in normalized:
-                col_idx = normalized.index(norm_label)
-                break
-        col_map[field["key"]] = col_idx
-    return col_map
+    info = analyze_header_rows([header_row]).get(system_name)
+    if not info:
+        return {field["key"]: None for field in config["fields"]}
+    return info["col_map"]
 
 def get_header_match_score(header_row, system_name):
-    config = SYSTEM_CONFIG.get(system_name)
-    if not config:
+    if system_name not in SYSTEM_CONFIG:
         return 0
-    normalized = [normalize_header(cell) for cell in header_row]
-    score = 0
-    for field in config["fields"]:
-        for label in field["labels"]:
-            if normalize_header(label) in normalized:
-                score += 1
-                break
-    return score
-
-def detect_system_by_header(raw_rows):
-    if not raw_rows:
-        return None
-    best_system = None
-    best_score = 0
-    for system_name in SYSTEM_CONFIG.keys():
-        header_idx = find_header_row(raw_rows, system_name)
-        if header_idx is None:
-            continue
-        score = get_header_match_score(raw_rows[header_idx], system_name)
-        if score > best_score:
-            best_score = score
-            best_system = system_name
-    return best_system if best_score > 0 else None
-
-def chunk_rows(rows, chunk_size):
-    return [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
-
-def parse_llm_json(content):
-    if not content:
-        return None
-    content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
-    cleaned = content.strip()
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-zA-Z]*\n", "", cleaned).strip()
-        if cleaned.endswith("```"):
-            cleaned = cleaned[:-3].strip()
-    try:
-        return json.loads(cleaned)
-    except Exception:
-        pass
-    start_candidates = [cleaned.find("["), cleaned.find("{")]
-    start_candidates = [idx for idx in start_candidates if idx != -1]
-    if not start_candidates:
-        return None
-    start = min(start_candidates)
-    end = max(cleaned.rfind("]"), cleaned.rfind("}"))
-    if end == -1 or end <= start:
-        return None
-    snippet = cleaned[start:end + 1]
-    try:
-        return json.loads(snippet)
-    except Exception:
-        return None
+    info = analyze_header_rows([header_row]).get(system_name)
+    return info["score"] if info else 0
 
-def extract_rows_from_parsed(parsed):
-    if isinstance(parsed, list):
-        return parsed
-    if isinstance(parsed, dict):
-        if "numbers" in parsed and isinstance(parsed["numbers"], list):
-            return parsed["numbers"]
-        for value in parsed.values():
-            if isinstance(value, list):
-                return value
-        keys = list(parsed.keys())
-        if all(k.isdigit() for k in keys):
-            sorted_keys = sorted(keys, key=lambda x: int(x))
-            return [parsed[k] for k in sorted_keys]
-        if any(k in parsed for k in ("date", "text", "amount", "doc_number", "number")):
-            return [parsed]
-    return None
-
-def normalize_doc_number(val):
-    if val is None:
-        return None
-    if isinstance(val, dict):
-        return str(list(val.values())[0]) if val.values() else None
-    s_val = str(val).strip()
-    if s_val.lower() in ("null", "none", "", "skip"):
+def detect_system_by_header(raw_rows, analysis=None):
+    if not raw_rows:
         return None
-    # Убираем лишние слова, если ИИ их добавил
-    s_val = re.sub(r"^(номер|№|док|id)\s*", "", s_val, flags=re.IGNORECASE).strip()
-    return s_val
+    if analysis is None:
+        analysis = analyze_header_rows(raw_rows)
+    # Порядок SYSTEM_CONFIG важен при равенстве очков
+    return best_system(analysis, SYSTEM_CONFIG.keys())
+
+@profiled("load_sheet_frame")
+def load_sheet_frame(file_path):
+    """
+    Читает первый лист Excel в Polars (движок calamine/fastexcel).
+    Все ячейки читаются строками, без заголовка — как raw-строки clean_excel.
+    file_path — путь или содержимое файла (bytes).
+    """
+    if pl is None:
+        raise ImportError("polars is not installed")
+    return pl.read_excel(file_path, engine="calamine", has_header=False, infer_schema_length=0)
+
+class ExcelSource:
+    """
+    Файл Excel для одной обработки: путь, bytes или буфер (загрузка Streamlit).
+    Содержимое буфера читается в память один раз, без временного файла;
+    raw- и очищенные строки clean_excel считаются не больше одного раза каждые.
+    Если clean_excel не принимает буфер, файл один раз сбрасывается во временный.
+    """
+    def __init__(self, source, file_name=None):
+        self.path = None
+        self.data = None
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.fspath(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self.data = bytes(source)
+        elif hasattr(source, "getvalue"):
+            self.data = source.getvalue()
+        else:
+            self.data = source.read()
+        self.file_name = file_name or (os.path.basename(self.path) if self.path else "upload.xlsx")
+        self._views = {}
+        self._spilled = None
+        self._digest = None
+
+    def digest(self):
+        """SHA-256 содержимого файла (для кэша результатов), считается один раз."""
+        if self._digest is None:
+            self._digest = file_digest(path=self.path, data=self.data)
+        return self._digest
+
+    def frame_source(self):
+        """Что передать в load_sheet_frame: путь или bytes."""
+        return self.path if self.path is not None else self.data
+
+    def rows(self, raw=False):
+        if raw not in self._views:
+            with get_profiler().span("clean_excel_raw" if raw else "clean_excel"):
+                self._views[raw] = self._clean(raw)
+        return self._views[raw]
+
+    def _clean(self, raw):
+        if self.path is not None:
+            return clean_excel(self.path, raw=raw)
+        if self._spilled is None:
+            try:
+                rows = clean_excel(io.BytesIO(self.data), raw=raw)
+                # Ошибку clean_excel возвращает строкой — повторяем с файла на случай, если дело в буфере
+                if not isinstance(rows, str):
+                    return rows
+            except (TypeError, AttributeError, OSError, ValueError):
+                pass
+            suffix = os.path.splitext(self.file_name)[1] or ".xlsx"
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                tmp.write(self.data)
+                self._spilled = tmp.name
+        return clean_excel(self._spilled, raw=raw)
+
+    def close(self):
+        if self._spilled and os.path.exists(self._spilled):
+            os.remove(self._spilled)
+        self._spilled = None
 
 class UniversalProcessor:
-    def __init__(self, model_name="llama3.2:3b"):
+    def __init__(self, model_name="llama3.2:3b", max_in_flight=None, use_cache=True, cache_path=None, columnar=False,
+                 stream=None, on_numbers=None, result_cache_path=None):
         self.model_name = model_name
+        self.stream = LLM_STREAM if stream is None else stream
+        # on_numbers({текст: номер}) вызывается по мере получения номеров (например, для прогресса
+        # в интерфейсе): в потоковом режиме — до завершения запроса, иначе — по ответу чанка
+        self.on_numbers = on_numbers
+        # Колоночный режим (Polars) для больших выгрузок систем
+        self.columnar = columnar and pl is not None
+        # use_cache включает и кэш ответов LLM, и кэш готовых результатов файлов
+        self.use_cache = use_cache
+        self.cache_path = cache_path
+        self.result_cache_path = result_cache_path
+        # Строки акта, оставшиеся без ответа LLM в последнем enrich_with_doc_numbers:
+        # такой результат не кладем в кэш результатов, чтобы повторить при следующей загрузке
+        self.unanswered_rows = 0
         
         # Сначала пробуем взять из секретов Streamlit (для Облака)
         try:
@@ -262,53 +337,48 @@ class UniversalProcessor:
             self.yandex_folder_id = os.getenv("YANDEX_FOLDER_ID")
             
         self.is_yandex = "yandex" in model_name.lower()
+        self.provider = "yandex" if self.is_yandex else "ollama"
+        # Имя модели у провайдера: лимиты токенов и планировщик чанков привязаны к нему
+        self.llm_model = "yandexgpt-lite" if self.is_yandex else model_name
+        if max_in_flight is None:
+            max_in_flight = PROVIDER_LIMITS[self.provider]["max_in_flight"]
+        self.max_in_flight = max(1, int(max_in_flight))
 
     def log(self, message):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
 
-    def call_yandex_gpt(self, system_prompt, user_prompt):
+    def call_yandex_gpt(self, system_prompt, user_prompt, max_tokens=2000, details=False, on_delta=None):
         if not self.yandex_api_key or not self.yandex_folder_id:
             raise ValueError("Yandex API Key or Folder ID not found in .env")
 
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Api-Key {self.yandex_api_key}",
-            "x-folder-id": self.yandex_folder_id
-        }
-        
-        payload = {
-            "modelUri": f"gpt://{self.yandex_folder_id}/yandexgpt-lite",
-            "completionOptions": {
-                "stream": False,
-                "temperature": 0,
-                "maxTokens": "2000"
-            },
-            "messages": [
-                {"role": "system", "text": system_prompt},
-                {"role": "user", "text": user_prompt}
-            ]
-        }
-
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        return result["result"]["alternatives"][0]["message"]["text"]
-
-    def extract_system_rows(self, raw_rows, system_name):
+        return yandex_completion(
+            self.yandex_api_key,
+            self.yandex_folder_id,
+            self.llm_model,
+            system_prompt,
+            user_prompt,
+            max_tokens=max_tokens,
+            deadline=LLM_DEADLINE,
+            details=details,
+            on_delta=on_delta,
+        )
+
+    @profiled("extract_system_rows")
+    def extract_system_rows(self, raw_rows, system_name, analysis=None):
         config = SYSTEM_CONFIG.get(system_name)
         if not config:
             return [], None
 
-        header_idx = find_header_row(raw_rows, system_name)
+        if analysis is None:
+            analysis = analyze_header_rows(raw_rows)
+        header_idx = find_header_row(raw_rows, system_name, analysis=analysis)
         if header_idx is None:
             self.log(f"!! Не найдена строка заголовков для системы {system_name}. Первые 5 строк:")
             for i, r in enumerate(raw_rows[:5]):
                 self.log(f"  Row {i}: {r}")
             return [], None
 
-        header_row = raw_rows[header_idx]
-        col_map = build_column_map(header_row, system_name)
+        col_map = analysis[system_name]["col_map"]
         if not col_map:
             return [], None
 
@@ -329,8 +399,49 @@ class UniversalProcessor:
 
         return results, output_headers
 
-    def enrich_with_doc_numbers(self, rows, max_rows_per_chunk=50, max_chunks=None, 
-                               income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)"):
+    @profiled("extract_system_rows_columnar")
+    def extract_system_rows_columnar(self, frame, system_name, analysis=None):
+        """
+        То же, что extract_system_rows, но над Polars DataFrame:
+        выбор и переименование колонок и отсев пустых строк — векторно.
+        Результат совпадает с extract_system_rows(frame.rows(), ...).
+        """
+        config = SYSTEM_CONFIG.get(system_name)
+        if not config:
+            return [], None
+
+        if analysis is None:
+            analysis = analyze_header_rows(frame.head(100).rows())
+        info = analysis.get(system_name)
+        if info is None:
+            self.log(f"!! Не найдена строка заголовков для системы {system_name}. Первые 5 строк:")
+            for i, r in enumerate(frame.head(5).rows()):
+                self.log(f"  Row {i}: {list(r)}")
+            return [], None
+
+        header_idx = info["header_idx"]
+        col_map = info["col_map"]
+        columns = frame.columns
+        exprs = []
+        keys = []
+        for field in config["fields"]:
+            key = field["key"]
+            col_idx = col_map.get(key)
+            if col_idx is not None and col_idx < len(columns):
+                exprs.append(pl.col(columns[col_idx]).cast(pl.Utf8).fill_null("").alias(key))
+            else:
+                exprs.append(pl.lit("").alias(key))
+            keys.append(key)
+
+        data = frame.slice(header_idx + 1).select(exprs)
+        data = data.filter(pl.any_horizontal([pl.col(key) != "" for key in keys]))
+        return [list(row) for row in data.rows()], config["output_headers"]
+
+    @profiled("enrich_doc_numbers")
+    def enrich_with_doc_numbers(self, rows, max_rows_per_chunk=None, max_chunks=None, 
+                               income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)",
+                               max_in_flight=None, rule_threshold=RULE_CONFIDENCE_THRESHOLD):
+        self.unanswered_rows = 0
         if not rows:
             return []
 
@@ -340,22 +451,22 @@ class UniversalProcessor:
         if expense_keywords is None:
             expense_keywords = ["реализация", "упд", "продажа", "корректировка", "акт"]
         
-        filtered_rows = []
-        for row in rows:
-            text_lc = row[1].lower()
-            # Если это явно доход (платежка), пропускаем
-            if any(k.strip().lower() in text_lc for k in income_keywords) and \
-               not any(k.strip().lower() in text_lc for k in expense_keywords):
-                continue
-            filtered_rows.append(row)
+        income_keywords = prepare_keywords(income_keywords)
+        expense_keywords = prepare_keywords(expense_keywords)
+        # Если это явно доход (платежка), пропускаем
+        filtered_rows = [
+            row for row in rows
+            if classify_by_keywords(row[1], income_keywords, expense_keywords) is not False
+        ]
 
         if not filtered_rows:
             return []
 
-        results = []
-        chunks = chunk_rows(filtered_rows, max_rows_per_chunk)
+        # Размер чанков подбирает планировщик по бюджету токенов модели,
+        # max_rows_per_chunk только ограничивает его сверху
+        planner = get_chunk_planner(self.llm_model, "doc_numbers", DOC_NUMBER_OUTPUT_TOKENS)
         if max_chunks is not None:
-            chunks = chunks[:max_chunks]
+            filtered_rows = filtered_rows[:max_chunks * (max_rows_per_chunk or planner.max_items)]
 
         # Улучшенный промт для работы со словарем
         if "Авто" in extraction_mode:
@@ -377,82 +488,288 @@ class UniversalProcessor:
                 "Не пиши ничего, кроме JSON."
             )
 
-        for idx, chunk in enumerate(chunks, start=1):
-            mem = psutil.virtual_memory()
-            self.log(f"LLM: чанк {idx}/{len(chunks)} (строк: {len(chunk)}) | RAM: {mem.percent}%")
-            
-            # Отправляем словарь {id: text} для защиты от смещения
-            payload_dict = {str(i): row[1] for i, row in enumerate(chunk)}
-            user_prompt = json.dumps(payload_dict, ensure_ascii=False)
-            
-            try:
-                start_time = time.time()
-                
-                if self.is_yandex:
-                    self.log(f"-> Отправка {len(chunk)} строк в YandexGPT ({len(user_prompt)} симв.)")
-                    content = self.call_yandex_gpt(system_prompt, f"Тексты:\n{user_prompt}")
+        # 2. ПРАВИЛА: уверенно распознанные регулярками номера не отправляем в LLM
+        doc_numbers = [None] * len(filtered_rows)
+        pending = list(range(len(filtered_rows)))
+        if rule_threshold is not None:
+            pending = []
+            for i, row in enumerate(filtered_rows):
+                number, confidence = extract_doc_number_rules(row[1], extraction_mode)
+                if number and confidence >= rule_threshold:
+                    doc_numbers[i] = normalize_doc_number(number)
                 else:
-                    self.log(f"-> Отправка {len(chunk)} строк в {self.model_name}")
-                    response = ollama.chat(
-                        model=self.model_name,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt},
-                        ],
-                        format="json",
-                        options={"temperature": 0}
-                    )
-                    content = response["message"]["content"]
-                
-                elapsed = time.time() - start_time
-                self.log(f"<- Ответ получен за {elapsed:.1f}с.")
-                
-                # Логируем ответ для отладки (без обратных слешей)
-                debug_info = content[:150].replace("\n", " ")
-                self.log(f"RAW DEBUG: {debug_info}...")
-                
-                parsed = parse_llm_json(content)
-                
-                if not isinstance(parsed, dict):
-                    self.log(f"!! НЕ УДАЛОСЬ РАСПАРСИТЬ JSON. Полный ответ: {content[:200]}")
-                    parsed = {}
-
-                for i, original_row in enumerate(chunk):
-                    # Извлекаем по ключу, чтобы не было смещения
-                    val = parsed.get(str(i))
-                    doc_num = normalize_doc_number(val)
-                    results.append(original_row + [doc_num])
-                    
+                    pending.append(i)
+            self.log(f"Правила: распознано {len(filtered_rows) - len(pending)} из {len(filtered_rows)} строк")
+            get_profiler().count("doc_rows_rules", len(filtered_rows) - len(pending))
+
+        # 3. КЭШ: строки, которые уже встречались с тем же режимом/моделью/промтом,
+        # не отправляются в LLM повторно
+        cache = self.get_cache() if pending else None
+        version = prompt_version(system_prompt)
+        if cache is not None:
+            try:
+                cached = cache.get_many([filtered_rows[i][1] for i in pending], extraction_mode, self.model_name, version)
             except Exception as e:
-                self.log(f"!! ОШИБКА ЧАНКА {idx}: {str(e)}")
-                for original_row in chunk:
-                    results.append(original_row + [None])
-            
-            if not self.is_yandex:
-                time.sleep(0.5)
+                self.log(f"!! Ошибка чтения кэша LLM: {e}")
+                cached = {}
+            still_pending = []
+            for i in pending:
+                text = filtered_rows[i][1]
+                if text in cached:
+                    doc_numbers[i] = normalize_doc_number(cached[text])
+                else:
+                    still_pending.append(i)
+            self.log(f"Кэш LLM: попаданий {len(pending) - len(still_pending)}, промахов {len(still_pending)} | {cache.stats()}")
+            get_profiler().count("doc_rows_llm_cache", len(pending) - len(still_pending))
+            pending = still_pending
+
+        if pending:
+            texts = [filtered_rows[i][1] for i in pending]
+            get_profiler().count("doc_rows_llm", len(texts))
+            plan = planner.plan(texts, system_prompt, max_items=max_rows_per_chunk)
+
+            # 4. Чанки отправляются параллельно (не более max_in_flight одновременно),
+            # ответы собираются обратно в исходном порядке; строки, на которые обрезанный
+            # ответ не успел ответить, планировщик отправляет заново
+            if max_in_flight is None:
+                max_in_flight = self.max_in_flight
+            workers = max(1, min(int(max_in_flight), len(plan)))
+            self.log(f"LLM: {len(plan)} чанков (до {planner.max_items} строк), параллельно до {workers}")
+
+            def request(chunk):
+                label = f"{chunk[0] + 1}-{chunk[-1] + 1}/{len(texts)}"
+                return self._process_chunk(label, [filtered_rows[pending[j]] for j in chunk], system_prompt, planner.max_tokens)
+
+            def unanswered(chunk, value):
+                return [j for j, ok in zip(chunk, value[1]) if not ok]
+
+            chunk_results = planner.run(texts, plan, request, fixed_text=system_prompt, max_workers=workers, pending=unanswered)
+
+            to_cache = {}
+            answered = {}
+            # Строки без ответа в обрезанном чанке идут раньше своего повтора и перезаписываются им
+            for chunk, (numbers, flags) in chunk_results:
+                for j, doc_num, ok in zip(chunk, numbers, flags):
+                    i = pending[j]
+                    row = filtered_rows[i]
+                    doc_numbers[i] = doc_num
+                    answered[i] = ok
+                    # Ошибочные чанки не кэшируем, чтобы повторить их в следующий раз
+                    if ok:
+                        to_cache[row[1]] = doc_num
+            self.unanswered_rows = sum(1 for ok in answered.values() if not ok)
+            if cache is not None and to_cache:
+                try:
+                    cache.set_many(to_cache, extraction_mode, self.model_name, version)
+                except Exception as e:
+                    self.log(f"!! Ошибка записи кэша LLM: {e}")
+            self.log(f"LLM метрики: {get_llm_metrics().summary()}")
+
+        return [row + [doc_num] for row, doc_num in zip(filtered_rows, doc_numbers)]
+
+    def get_cache(self):
+        if not self.use_cache:
+            return None
+        try:
+            return get_llm_cache(self.cache_path)
+        except Exception as e:
+            self.log(f"!! Кэш LLM недоступен: {e}")
+            return None
+
+    def get_result_cache(self):
+        if not self.use_cache:
+            return None
+        try:
+            return get_result_cache(self.result_cache_path)
+        except Exception as e:
+            self.log(f"!! Кэш результатов недоступен: {e}")
+            return None
+
+    def result_cache_key(self, source, income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)"):
+        """
+        Ключ кэша результатов для ExcelSource: содержимое файла плюс все, от чего зависит результат.
+        От имени файла берется только система, которую по нему определяет resolve_system_name.
+        """
+        settings = {
+            "config": SYSTEM_CONFIG_VERSION,
+            "system": self.resolve_system_name(source.file_name),
+            "model": self.model_name,
+            "mode": extraction_mode,
+            "income": None if income_keywords is None else prepare_keywords(income_keywords).pattern,
+            "expense": None if expense_keywords is None else prepare_keywords(expense_keywords).pattern,
+        }
+        return make_result_key(source.digest(), settings)
 
-        return results
+    def get_cached_result(self, key):
+        cache = self.get_result_cache()
+        if cache is None:
+            return None
+        try:
+            result = cache.get(key)
+        except Exception as e:
+            self.log(f"!! Ошибка чтения кэша результатов: {e}")
+            return None
+        get_profiler().count("result_cache_misses" if result is None else "result_cache_hits")
+        return result
+
+    def store_result(self, key, result):
+        """Кладет результат в кэш, если он успешный и LLM ответила на все строки акта."""
+        cache = self.get_result_cache()
+        if cache is None:
+            return False
+        if result[1] == "enriched" and self.unanswered_rows:
+            self.log(f"Кэш результатов: не сохраняем, без ответа LLM {self.unanswered_rows} строк")
+            return False
+        try:
+            return cache.set(key, result)
+        except Exception as e:
+            self.log(f"!! Ошибка записи кэша результатов: {e}")
+            return False
+
+    def _request_llm(self, system_prompt, user_prompt, max_tokens=2000, on_delta=None):
+        """Ответ модели в виде complete_details(): текст, признак обрезки, токены."""
+        get_rate_limiter(self.provider).wait()
+        if self.is_yandex:
+            return self.call_yandex_gpt(system_prompt, f"Тексты:\n{user_prompt}", max_tokens=max_tokens, details=True, on_delta=on_delta)
+        # Локальную модель по длине ответа не ограничиваем: обрезку покажет done_reason
+        client = get_llm_client("ollama", self.model_name)
+        return client.complete_details(
+            system_prompt, user_prompt, max_tokens=None, json_format=True, deadline=LLM_DEADLINE, on_delta=on_delta
+        )
+
+    def _process_chunk(self, idx, chunk, system_prompt, max_tokens=2000):
+        """
+        ((номера, [ответ получен]), details) для чанка строк; idx — метка для логов.
+        В потоковом режиме пары {id: номер} разбираются по мере прихода, и из обрезанного
+        ответа остаются все пришедшие целиком.
+        """
+        mem = psutil.virtual_memory()
+        self.log(f"LLM: строки {idx} (строк: {len(chunk)}) | RAM: {mem.percent}%")
+        
+        # Отправляем словарь {id: text} для защиты от смещения
+        payload_dict = {str(i): row[1] for i, row in enumerate(chunk)}
+        user_prompt = json.dumps(payload_dict, ensure_ascii=False)
+        
+        parser = StreamingPairParser() if self.stream else None
+        on_delta = None
+        if parser is not None:
+            def on_delta(delta):
+                new_pairs = parser.feed(delta)
+                if new_pairs and self.on_numbers:
+                    self.on_numbers({
+                        chunk[int(key)][1]: normalize_doc_number(value)
+                        for key, value in new_pairs if int(key) < len(chunk)
+                    })
+
+        try:
+            start_time = time.time()
+            
+            if self.is_yandex:
+                self.log(f"-> [{idx}] Отправка {len(chunk)} строк в YandexGPT ({len(user_prompt)} симв.)")
+            else:
+                self.log(f"-> [{idx}] Отправка {len(chunk)} строк в {self.model_name}")
+            profiler = get_profiler()
+            profiler.count("llm_chunks")
+            with profiler.span("llm_call"):
+                details = self._request_llm(system_prompt, user_prompt, max_tokens, on_delta)
+            content = details["text"]
+            
+            elapsed = time.time() - start_time
+            self.log(f"<- [{idx}] Ответ получен за {elapsed:.1f}с.")
+            
+            # Логируем ответ для отладки (без обратных слешей)
+            debug_info = content[:150].replace("\n", " ")
+            self.log(f"RAW DEBUG [{idx}]: {debug_info}...")
+            
+            with profiler.span("llm_parse_json"):
+                parsed = parser.finish() if parser is not None else None
+                if not parsed:
+                    # Ответ не в виде пар {id: номер} (список, вложенный объект) — разбираем целиком
+                    parsed = parse_llm_json(content)
+            
+            if not isinstance(parsed, dict):
+                self.log(f"!! НЕ УДАЛОСЬ РАСПАРСИТЬ JSON. Полный ответ: {content[:200]}")
+                parsed = {}
+
+            # Извлекаем по ключу, чтобы не было смещения
+            numbers = [normalize_doc_number(parsed.get(str(i))) for i in range(len(chunk))]
+            # Ответом считаются только id, которые модель вернула (в том числе с null):
+            # пропущенные не кэшируются как "номера нет" и будут запрошены снова
+            flags = [str(i) in parsed for i in range(len(chunk))]
+            if details["truncated"]:
+                # Недостающие номера в обрезанном ответе не успели прийти — планировщик отправит их заново
+                self.log(f"!! [{idx}] Ответ обрезан, получено {sum(flags)} из {len(chunk)}")
+                profiler.count("llm_truncated")
+            elif not all(flags):
+                self.log(f"!! [{idx}] В ответе нет {len(chunk) - sum(flags)} из {len(chunk)} id")
+            if parser is None and self.on_numbers:
+                # Без потока прогресс сообщаем по готовому ответу чанка
+                self.on_numbers({row[1]: number for row, number, ok in zip(chunk, numbers, flags) if ok})
+            return (numbers, flags), details
+                
+        except Exception as e:
+            self.log(f"!! ОШИБКА ЧАНКА {idx}: {str(e)}")
+            get_profiler().count("llm_chunk_errors")
+            return ([None] * len(chunk), [False] * len(chunk)), None
+
+    @profiled("process_file")
+    def process_file(self, file_path, income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)", file_name=None):
+        """
+        file_path — путь к файлу, его содержимое (bytes) или буфер с ним.
+        Для bytes и буфера имя файла (по нему определяется система) передается в file_name.
+        Результат для того же содержимого и тех же настроек берется из кэша результатов.
+        """
+        options = {"income_keywords": income_keywords, "expense_keywords": expense_keywords, "extraction_mode": extraction_mode}
+        source = ExcelSource(file_path, file_name)
+        try:
+            key = self.result_cache_key(source, **options) if self.use_cache else None
+            cached = self.get_cached_result(key) if key else None
+            if cached is not None:
+                self.log(f"Кэш результатов: {source.file_name} уже обработан, {len(cached[0])} строк")
+                return cached
+            parsed = self._parse_source(source)
+        finally:
+            source.close()
+        result = self.finish_file(parsed, **options)
+        if key:
+            self.store_result(key, result)
+        return result
+
+    def parse_file(self, file_path, file_name=None):
+        """
+        Первая стадия process_file (чтение Excel и заголовков, без LLM).
+        Выгрузку системы возвращает готовой: (строки, "enriched_system", система, заголовки).
+        Для акта возвращает (строки clean_excel, "parsed", "OTHER", []) — номера документов
+        к ним добавляет finish_file.
+        """
+        source = ExcelSource(file_path, file_name)
+        try:
+            return self._parse_source(source)
+        finally:
+            source.close()
 
-    def process_file(self, file_path, income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)"):
-        file_name = os.path.basename(file_path)
+    @profiled("parse_file")
+    def _parse_source(self, source):
+        file_name = source.file_name
         self.log(f"Файл: {file_name}")
         system_name = self.resolve_system_name(file_name)
 
         raw_rows = None
+        analysis = None
         # Если система не определена по имени (OTHER), пробуем по заголовкам
         # НО! Если по заголовкам определится что-то невнятное, всё равно будем считать это Актом
         if system_name == "OTHER":
-            raw_rows = clean_excel(file_path, raw=True)
+            raw_rows = source.rows(raw=True)
             if isinstance(raw_rows, str):
                 return [], "error", system_name, []
             
-            # Пытаемся определить систему по структуре колонок
-            detected = detect_system_by_header(raw_rows)
+            # Пытаемся определить систему по структуре колонок (один проход по заголовкам)
+            analysis = analyze_header_rows(raw_rows)
+            detected = detect_system_by_header(raw_rows, analysis=analysis)
             if detected:
                 # Дополнительная проверка: действительно ли это системный файл?
                 # Если совпадение слабое (мало колонок), лучше считать это Актом
-                header_idx = find_header_row(raw_rows, detected)
-                score = get_header_match_score(raw_rows[header_idx], detected) if header_idx is not None else 0
+                score = analysis[detected]["score"]
                 
                 # Порог уверенности: например, должно совпасть хотя бы 3 ключевых колонки
                 if score >= 3:
@@ -462,19 +779,37 @@ class UniversalProcessor:
                     self.log(f"Похоже на {detected} (score: {score}), но недостаточно уверенно. Считаем Актом.")
 
 
+        if system_name != "OTHER" and raw_rows is None and self.columnar:
+            try:
+                frame = load_sheet_frame(source.frame_source())
+                system_rows, headers = self.extract_system_rows_columnar(frame, system_name)
+                if headers:
+                    self.log(f"Колоночный режим: {len(system_rows)} строк")
+                    return system_rows, "enriched_system", system_name, headers
+            except Exception as e:
+                self.log(f"!! Колоночный режим недоступен ({e}), читаем построчно")
+
         if system_name != "OTHER":
             if raw_rows is None:
-                raw_rows = clean_excel(file_path, raw=True)
+                raw_rows = source.rows(raw=True)
             if isinstance(raw_rows, str):
                 return [], "error", system_name, []
-            system_rows, headers = self.extract_system_rows(raw_rows, system_name)
+            system_rows, headers = self.extract_system_rows(raw_rows, system_name, analysis=analysis)
             if not headers:
                 return [], "error", system_name, []
             return system_rows, "enriched_system", system_name, headers
 
-        rows = clean_excel(file_path)
+        rows = source.rows()
         if isinstance(rows, str):
             return [], "error", "OTHER", []
+        return rows, "parsed", "OTHER", []
+
+    @profiled("finish_file")
+    def finish_file(self, parsed, income_keywords=None, expense_keywords=None, extraction_mode="Авто (Приоритет С/Ф)"):
+        """Вторая стадия process_file: номера документов акта через LLM. Остальное возвращает как есть."""
+        rows, status, system_name, headers = parsed
+        if status != "parsed":
+            return parsed
 
         enriched = self.enrich_with_doc_numbers(rows, income_keywords=income_keywords, expense_keywords=expense_keywords, extraction_mode=extraction_mode)
         # Приводим к формату для актов: [Дата, Текст, Номер, Сумма]
@@ -0,0 +1,254 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import psutil
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Профиль обработки: время по этапам (спаны), счетчики и пики памяти (RSS) процесса.
+# Один профилировщик на процесс; рабочие процессы (cli, конвейер, сверка пачкой)
+# отдают свой профиль через drain(), родитель вливает его через merge().
+# Выгрузка: to_json() и to_prometheus() (текстовый формат для textfile-коллектора node_exporter).
+
+PROMETHEUS_PREFIX = "local_processor"
+
+
+def _rss():
+    return psutil.Process().memory_info().rss
+
+
+def _max_rss():
+    """Пик RSS процесса за все время (ru_maxrss): на macOS в байтах, на Linux в килобайтах."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Span:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.peak_rss = _rss()
+        self.stage = None
+
+
+class Profiler:
+    """
+    Потокобезопасный профилировщик этапов.
+
+    span(name) — этап целиком (контекстный менеджер или @profiled(name)): число вызовов,
+    ошибки, суммарное/минимальное/максимальное время и пик RSS за время этапа.
+    stage(name) — последовательные шаги внутри открытого спана без лишней вложенности кода:
+    шаг "name" идет до следующего stage() или до конца спана и пишется как "<спан>.<name>".
+    Пик RSS замеряется на границах спанов и в sample_memory(), то есть по выборкам, а не непрерывно.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._spans = {}
+        self._counters = {}
+        self._peak_rss = 0
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, seconds, peak_rss, error=False):
+        with self._lock:
+            item = self._spans.get(name)
+            if item is None:
+                item = self._spans[name] = {
+                    "calls": 0, "errors": 0, "seconds": 0.0, "min_seconds": None,
+                    "max_seconds": 0.0, "peak_rss_bytes": 0,
+                }
+            item["calls"] += 1
+            item["errors"] += 1 if error else 0
+            item["seconds"] += seconds
+            item["min_seconds"] = seconds if item["min_seconds"] is None else min(item["min_seconds"], seconds)
+            item["max_seconds"] = max(item["max_seconds"], seconds)
+            item["peak_rss_bytes"] = max(item["peak_rss_bytes"], peak_rss)
+            self._peak_rss = max(self._peak_rss, peak_rss)
+
+    def _close(self, span, error=False):
+        rss = _rss()
+        for open_span in self._stack():
+            open_span.peak_rss = max(open_span.peak_rss, rss)
+        span.peak_rss = max(span.peak_rss, rss)
+        self._record(span.name, time.perf_counter() - span.start, span.peak_rss, error)
+
+    def span(self, name):
+        return _SpanContext(self, name)
+
+    def stage(self, name):
+        """Начинает шаг name внутри текущего спана этого потока, закрывая предыдущий шаг."""
+        stack = self._stack()
+        if not stack:
+            return
+        parent = stack[-1]
+        if parent.stage is not None:
+            self._close(parent.stage)
+        parent.stage = _Span(f"{parent.name}.{name}")
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def sample_memory(self):
+        """Замер RSS посреди этапа (например, после загрузки большого листа) — уточняет пики."""
+        rss = _rss()
+        for open_span in self._stack():
+            open_span.peak_rss = max(open_span.peak_rss, rss)
+        with self._lock:
+            self._peak_rss = max(self._peak_rss, rss)
+        return rss
+
+    def summary(self):
+        """{"spans": {этап: итоги}, "counters": {...}, "memory": {...}} — JSON-совместимый снимок."""
+        with self._lock:
+            spans = {}
+            for name, item in self._spans.items():
+                item = dict(item)
+                item["avg_seconds"] = round(item["seconds"] / item["calls"], 4) if item["calls"] else 0.0
+                item["seconds"] = round(item["seconds"], 4)
+                item["min_seconds"] = round(item["min_seconds"] or 0.0, 4)
+                item["max_seconds"] = round(item["max_seconds"], 4)
+                spans[name] = item
+            return {
+                "spans": spans,
+                "counters": dict(self._counters),
+                "memory": {"peak_rss_bytes": max(self._peak_rss, _max_rss())},
+            }
+
+    def merge(self, summary):
+        """Вливает снимок summary() другого процесса: время и счетчики складываются, пики берутся максимальные."""
+        if not summary:
+            return
+        with self._lock:
+            for name, other in summary.get("spans", {}).items():
+                item = self._spans.get(name)
+                if item is None:
+                    self._spans[name] = {key: other[key] for key in (
+                        "calls", "errors", "seconds", "min_seconds", "max_seconds", "peak_rss_bytes")}
+                    continue
+                item["calls"] += other["calls"]
+                item["errors"] += other["errors"]
+                item["seconds"] += other["seconds"]
+                item["min_seconds"] = other["min_seconds"] if item["min_seconds"] is None else min(item["min_seconds"], other["min_seconds"])
+                item["max_seconds"] = max(item["max_seconds"], other["max_seconds"])
+                item["peak_rss_bytes"] = max(item["peak_rss_bytes"], other["peak_rss_bytes"])
+            for name, value in summary.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            self._peak_rss = max(self._peak_rss, summary.get("memory", {}).get("peak_rss_bytes", 0))
+
+    def drain(self):
+        """summary() и сброс: так рабочий процесс отдает накопленное родителю по каждому заданию."""
+        summary = self.summary()
+        self.reset()
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self._peak_rss = 0
+
+    def to_json(self, path=None):
+        text = json.dumps(self.summary(), ensure_ascii=False, indent=2)
+        if path:
+            _write_text(path, text)
+        return text
+
+    def to_prometheus(self, path=None, prefix=PROMETHEUS_PREFIX):
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}")
+
+        spans = sorted(summary["spans"].items())
+        metric("stage_calls_total", "counter", "Stage calls.",
+               [({"stage": name}, item["calls"]) for name, item in spans])
+        metric("stage_errors_total", "counter", "Stage calls that raised.",
+               [({"stage": name}, item["errors"]) for name, item in spans])
+        metric("stage_seconds_total", "counter", "Total time spent in stage.",
+               [({"stage": name}, item["seconds"]) for name, item in spans])
+        metric("stage_max_seconds", "gauge", "Longest single stage call.",
+               [({"stage": name}, item["max_seconds"]) for name, item in spans])
+        metric("stage_peak_rss_bytes", "gauge", "Peak sampled RSS during stage.",
+               [({"stage": name}, item["peak_rss_bytes"]) for name, item in spans])
+        metric("events_total", "counter", "Processing counters.",
+               [({"name": name}, value) for name, value in sorted(summary["counters"].items())])
+        lines.append(f"# HELP {prefix}_peak_rss_bytes Peak process RSS.")
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes {summary['memory']['peak_rss_bytes']}")
+        text = "\n".join(lines) + "\n"
+        if path:
+            _write_text(path, text)
+        return text
+
+
+class _SpanContext:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.span = _Span(self.name)
+        self.profiler._stack().append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        stack = self.profiler._stack()
+        stack.pop()
+        error = exc_type is not None
+        if self.span.stage is not None:
+            self.profiler._close(self.span.stage, error)
+        self.profiler._close(self.span, error)
+        return False
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_text(path, text):
+    # Через временный файл: коллектор Prometheus не должен прочитать файл наполовину
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def profiled(name):
+    """Декоратор: каждый вызов функции — спан name общего профилировщика."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _profiler.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,516 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+
+import pandas as pd
+
+from column_table import column_values
+from doc_index import DocIndex, SortedKeys
+from partner_resolver import PartnerResolver
+from profiling import get_profiler, profiled
+from tu_resolver import TUResolver
+
+# Путь к файлу справочника ТУ
+TU_MAPPING_FILE = "/Users/aleksandrprokudin/Documents/check/searchTU/Распределение РУ, ТУ и ТШП по точкам.xlsx"
+
+
+@lru_cache(maxsize=4)
+def load_tu_mapping(file_path):
+    """
+    Загружает справочник ТУ из Excel.
+    Возвращает два словаря:
+    syrye_map: { "ADDRESS_PART": "FIO" } - для "Сырье /"
+    regular_map: { "FULL_NAME": "FIO" } - для остальных
+    """
+    if not os.path.exists(file_path):
+        return {}, {}
+    
+    try:
+        # Лист "Точка-ТУ СП" (для Сырья)
+        # Ищем в col index 3 (D), берем col index 18 (S)
+        df_sp = pd.read_excel(file_path, sheet_name="Точка-ТУ СП", header=None)
+        syrye_map = {}
+        # Пропускаем первые строки (шапку), берем данные
+        for idx, row in df_sp.iterrows():
+            if idx < 2: continue # Skip header rows
+            key = str(row[3]).strip()
+            val = str(row[18]).strip()
+            if key and key.lower() != "nan" and val and val.lower() != "nan":
+                syrye_map[key] = val
+                
+        # Лист "Точка-ТУ" (для остальных)
+        # Ищем в col index 2 (C), берем col index 12 (M)
+        df_reg = pd.read_excel(file_path, sheet_name="Точка-ТУ", header=None)
+        regular_map = {}
+        for idx, row in df_reg.iterrows():
+            if idx < 2: continue
+            key = str(row[2]).strip()
+            val = str(row[12]).strip()
+            if key and key.lower() != "nan" and val and val.lower() != "nan":
+                regular_map[key] = val
+                
+        return syrye_map, regular_map
+    except Exception as e:
+        print(f"[ERROR] Loading TU Mapping: {e}")
+        return {}, {}
+
+@lru_cache(maxsize=4)
+def load_tu_resolver(file_path):
+    """
+    Резолвер ТУ по справочнику. Живет весь процесс (Streamlit или воркер),
+    поэтому найденные склады/покупатели не ищутся повторно.
+    """
+    syrye_map, regular_map = load_tu_mapping(file_path)
+    return TUResolver(syrye_map, regular_map)
+
+def normalize_doc_num_for_search(val):
+    if not val:
+        return ""
+    # Оставляем только цифры и буквы, убираем нули в начале
+    s = str(val).strip().lower()
+    s = "".join(c for c in s if c.isalnum())
+    s = s.lstrip("0")
+    return s
+
+def find_doc_in_index(target_doc, idx_map):
+    """
+    Пытается найти документ в индексе:
+    1. Точное совпадение
+    2. Если точного нет - ключ, который начинается с номера и продолжается буквой
+       (Акт "20" -> Система "20dp", но не "205")
+    """
+    if not target_doc:
+        return []
+    if not isinstance(idx_map, DocIndex):
+        idx_map = DocIndex(idx_map)
+    return idx_map.find(target_doc)
+
+def is_correction(text, amount=None):
+    """
+    Определяет, является ли запись корректировкой/возвратом.
+    1. По тексту (содержит "корректировка", "возврат")
+    2. По сумме (отрицательная)
+    """
+    t = str(text).lower()
+    if "корректировка" in t or "возврат" in t:
+        return True
+    if amount is not None:
+        try:
+            if float(amount) < 0:
+                return True
+        except:
+            pass
+    return False
+
+# Config for system columns
+SYSTEM_COLS = {
+    "IIKO": {"partner": "Поставщик/Покупатель", "doc": "Входящий номер", "sum": "Сумма, р.", "comment": "Комментарий"},
+    "DOCSINBOX": {"partner": "Поставщик", "doc": "Номер накладной поставщика", "sum": "Сумма"},
+    "SBIS": {"partner": "Контрагент", "doc": "Номер", "sum": "Сумма"},
+    "SAP": {"partner": "Наименование контрагента", "doc": "Ссылка", "sum": "Сумма в ВВ", "docType": "Вид документа"},
+    "FB": {"partner": "Поставщик", "doc": "Номер", "sum": "Сумма", "linked": "Привязан к поставке", "point": "Точка"}
+}
+
+# Колонки листов систем, которые читает сверка (для read_all_sheets_data(columns=...))
+RECON_COLUMNS = {
+    "IIKO": ["Дата", "Входящий номер", "Поставщик/Покупатель", "Склад", "Сумма, р.", "Комментарий"],
+    "DOCSINBOX": ["Поставщик", "Номер накладной поставщика", "Сумма", "Покупатель", "Статус приемки"],
+    "SBIS": ["Контрагент", "Номер", "Сумма", "Статус"],
+    "SAP": ["Наименование контрагента", "Ссылка", "Сумма в ВВ", "Вид документа"],
+    "FB": ["Поставщик", "Номер", "Сумма", "Тип", "Привязан к поставке", "Точка", "Дата документа", "Статус", "Статус поставки"],
+}
+
+def build_partner_resolver(system_data_map):
+    return PartnerResolver(system_data_map, {k: v["partner"] for k, v in SYSTEM_COLS.items()})
+
+class SystemSnapshot:
+    """
+    Данные таблицы систем за период, подготовленные один раз для сверки многих поставщиков:
+    резолвер контрагентов построен, позиции записей сгруппированы по контрагенту.
+    """
+    def __init__(self, system_data_map, partner_resolver=None):
+        self.data = system_data_map
+        self.partner_resolver = partner_resolver or build_partner_resolver(system_data_map)
+        self.partner_rows = {}
+        for sys_name, records in system_data_map.items():
+            cols = SYSTEM_COLS.get(sys_name)
+            if not cols:
+                continue
+            groups = {}
+            for i, partner in enumerate(column_values(records, cols["partner"])):
+                groups.setdefault(str(partner), []).append(i)
+            self.partner_rows[sys_name] = groups
+
+    def records_for(self, sys_name, partners):
+        """Записи системы по найденным контрагентам — в исходном порядке строк."""
+        groups = self.partner_rows.get(sys_name, {})
+        positions = sorted(chain.from_iterable(groups.get(p, ()) for p in partners))
+        records = self.data[sys_name]
+        return [records[i] for i in positions]
+
+@profiled("perform_reconciliation")
+def perform_reconciliation(act_data, system_data_map, supplier_name, partner_resolver=None, tu_resolver=None):
+    profiler = get_profiler()
+    # Load TU Mapping
+    profiler.stage("load_tu")
+    if tu_resolver is None:
+        tu_resolver = load_tu_resolver(TU_MAPPING_FILE)
+    
+    # act_data headers: ["Дата", "Текст", "Номер", "Сумма"]
+    # system_data_map: { "IIKO": [records...], "SBIS": [records...], ... } или готовый SystemSnapshot
+    
+    # 1. Prepare fast lookups for systems
+    # Filter each system by supplier name (fuzzy) and index by doc number
+    system_cols = SYSTEM_COLS
+    profiler.stage("resolve_partners")
+    if isinstance(system_data_map, SystemSnapshot):
+        snapshot = system_data_map
+    else:
+        snapshot = SystemSnapshot(system_data_map, partner_resolver)
+    partner_resolver = snapshot.partner_resolver
+    supplier_partners = partner_resolver.resolve(supplier_name)
+    
+    # Pre-process system data: filter by supplier and index by normalized doc number
+    profiler.stage("index_systems")
+    system_indices = {} 
+    
+    # Counters for system docs (excluding corrections)
+    system_stats = {
+        "IIKO": {"total_sum": 0.0, "count": 0},
+        "SAP": {"total_sum": 0.0, "count": 0},
+        "FB": {"total_sum": 0.0, "count": 0}
+    }
+    
+    for sys_name in snapshot.data:
+        if sys_name not in system_cols:
+            continue
+            
+        cols = system_cols[sys_name]
+        
+        # Fuzzy match supplier name (partial_ratio, best for substrings) — precomputed by resolver
+        matched_partners = supplier_partners.get(sys_name, set())
+        
+        if matched_partners:
+            print(f"[RECON]   ACCEPTED matches in {sys_name}: {list(matched_partners)}")
+        else:
+            print(f"[RECON]   NO matches accepted in {sys_name} (threshold {partner_resolver.threshold})")
+        
+        # Index records and calculate stats (only rows of matched partners)
+        idx_map = {}
+        for r in snapshot.records_for(sys_name, matched_partners):
+            doc = r.get(cols["doc"])
+            norm_doc = normalize_doc_num_for_search(doc)
+            
+            amount_str = r.get(cols["sum"], "0")
+            try:
+                amount_float = float(str(amount_str).replace(",", ".").replace("\xa0", "").strip() or 0)
+            except:
+                amount_float = 0.0
+            
+            # Check for correction (to exclude from stats)
+            # Check negative amount
+            # For SAP, normal amounts are negative. Don't use negative sign as correction indicator.
+            check_amount = amount_float if sys_name != "SAP" else None
+            is_corr = is_correction("", check_amount)
+            
+            # Check specific fields text
+            if not is_corr and sys_name == "IIKO":
+                comment = str(r.get("Комментарий", "")).lower()
+                if "корректировка" in comment or "возврат" in comment:
+                    is_corr = True
+            
+            # Add to stats if NOT correction
+            if not is_corr and sys_name in system_stats:
+                system_stats[sys_name]["total_sum"] += amount_float
+                system_stats[sys_name]["count"] += 1
+                
+            # Store record for matching (we keep corrections in index to match against act corrections)
+            if norm_doc not in idx_map:
+                idx_map[norm_doc] = []
+            idx_map[norm_doc].append({"amount": amount_float, "raw": r})
+            
+        system_indices[sys_name] = DocIndex(idx_map)
+
+        # Check for duplicates in IIKO
+        if sys_name == "IIKO":
+            # 1. Duplicates
+            dups = []
+            for k, v in idx_map.items():
+                if len(v) > 1:
+                    # Collect original doc numbers
+                    orig_doc = v[0]["raw"].get(cols["doc"], k)
+                    dups.append(str(orig_doc))
+            if dups:
+                system_stats["IIKO"]["duplicates"] = ", ".join(dups)
+            
+            # 2. Missing in Act (present in IIKO but not in Act)
+            # Initially, all docs are unmatched
+            system_indices["IIKO_unmatched"] = SortedKeys(idx_map.keys())
+
+    # 3. Build Result Table & Act Stats
+    profiler.stage("match_act")
+    results = []
+    
+    tu_pending = [] # (res_row, iiko warehouse, dxbx buyer) — ТУ ищем пачкой после цикла
+    
+    act_stats = {"total_sum": 0.0, "count": 0}
+    act_missing_in_iiko = [] # Documents in Act but not in IIKO
+    
+    print(f"\n[RECON] Starting reconciliation for supplier: '{supplier_name}'")
+    for sys_name, idx_map in system_indices.items():
+        print(f"[RECON] System {sys_name}: {len(idx_map)} docs indexed for this supplier.")
+    
+    for row in act_data:
+        # row: [Date, Text, DocNum, Amount]
+        date = row[0]
+        text = row[1] 
+        doc_num = row[2]
+        amount_act_raw = row[3]
+        
+        try:
+            amount_act = float(str(amount_act_raw).replace(",", ".").replace("\xa0", "").strip() or 0)
+        except:
+            amount_act = 0.0
+            
+        # Check correction for Act stats
+        if not is_correction(text):
+            act_stats["total_sum"] += amount_act
+            act_stats["count"] += 1
+        
+        # Основной блок (Поставщик)
+        res_row = {
+            "supplier_date": date,
+            "supplier_doc": text, 
+            "supplier_sum": amount_act
+        }
+        
+        norm_doc = normalize_doc_num_for_search(doc_num)
+        
+        # IIKO
+        iiko_idx = system_indices.get("IIKO") or DocIndex()
+        iiko_wh_found = "" # To store warehouse for TU lookup
+        
+        matches = find_doc_in_index(norm_doc, iiko_idx)
+        if matches:
+            m = matches[0]
+            raw = m["raw"]
+            res_row["iiko_date"] = raw.get("Дата", "")
+            res_row["iiko_doc"] = raw.get("Входящий номер", "")
+            res_row["iiko_partner"] = raw.get("Поставщик/Покупатель", "")
+            
+            wh = raw.get("Склад", "")
+            res_row["iiko_warehouse"] = wh
+            iiko_wh_found = wh
+            
+            res_row["iiko_sum"] = m["amount"]
+            res_row["iiko_comment"] = raw.get("Комментарий", "")
+            res_row["iiko_delta"] = amount_act - m["amount"]
+            
+            # Mark as found (remove from unmatched set)
+            if "IIKO_unmatched" in system_indices:
+                if not system_indices["IIKO_unmatched"].discard(norm_doc):
+                    # Try to find by prefix if it was a fuzzy match
+                    system_indices["IIKO_unmatched"].discard_prefix(norm_doc)
+        else:
+            res_row["iiko_delta"] = amount_act 
+            # Добавляем в список "Лишние в Акте"
+            # Только если есть номер документа
+            if doc_num and str(doc_num).strip():
+                act_missing_in_iiko.append(str(doc_num).strip())
+        
+        # FB (New System)
+        fb_idx = system_indices.get("FB") or DocIndex()
+        matches = find_doc_in_index(norm_doc, fb_idx)
+        if matches:
+            m = matches[0]
+            raw = m["raw"]
+            res_row["fb_doc"] = raw.get("Номер", "")
+            res_row["fb_type"] = raw.get("Тип", "")
+            res_row["fb_linked"] = raw.get("Привязан к поставке", "")
+            res_row["fb_partner"] = raw.get("Поставщик", "")
+            res_row["fb_point"] = raw.get("Точка", "")
+            res_row["fb_date"] = raw.get("Дата документа", "")
+            res_row["fb_status"] = raw.get("Статус", "")
+            res_row["fb_del_status"] = raw.get("Статус поставки", "")
+            res_row["fb_sum"] = m["amount"]
+            res_row["fb_delta"] = amount_act - m["amount"]
+        else:
+             res_row["fb_delta"] = amount_act
+            
+        # DOCSINBOX
+        dxbx_idx = system_indices.get("DOCSINBOX") or DocIndex()
+        matches = find_doc_in_index(norm_doc, dxbx_idx)
+        if matches:
+            m = matches[0]
+            raw = m["raw"]
+            res_row["dxbx_buyer"] = raw.get("Покупатель", "")
+            res_row["dxbx_status"] = raw.get("Статус приемки", "")
+            
+            # Lookup TU based on IIKO warehouse (FALLBACK: via DXBX Buyer) — after the loop
+            res_row["dxbx_tu"] = ""
+            tu_pending.append((res_row, iiko_wh_found, res_row["dxbx_buyer"]))
+        
+        # SBIS
+        sbis_idx = system_indices.get("SBIS") or DocIndex()
+        matches = find_doc_in_index(norm_doc, sbis_idx)
+        if matches:
+            m = matches[0]
+            raw = m["raw"]
+            res_row["sbis_status"] = raw.get("Статус", "")
+            res_row["sbis_delta"] = amount_act - m["amount"]
+        else:
+            res_row["sbis_delta"] = amount_act
+            
+        # SAP
+        sap_idx = system_indices.get("SAP") or DocIndex()
+        matches = find_doc_in_index(norm_doc, sap_idx)
+        if matches:
+            m = matches[0]
+            raw = m["raw"]
+            res_row["sap_doc_type"] = raw.get("Вид документа", "")
+            # SAP amounts are negative. Delta = Act + SAP (e.g. 100 + (-100) = 0)
+            res_row["sap_delta"] = amount_act + m["amount"]
+        else:
+            res_row["sap_delta"] = amount_act
+            
+        # Пользовательский комментарий
+        res_row["manager_comment"] = ""
+                
+        results.append(res_row)
+        
+    # Bulk TU lookup: one cdist per dictionary for all distinct warehouses/buyers
+    profiler.stage("resolve_tu")
+    if tu_pending:
+        wh_tu = tu_resolver.resolve_many([wh for _, wh, _ in tu_pending if wh])
+        for res_row, wh, _ in tu_pending:
+            if wh:
+                res_row["dxbx_tu"] = wh_tu[wh]
+        buyer_tu = tu_resolver.resolve_buyers([b for r, _, b in tu_pending if not r.get("dxbx_tu") and b])
+        for res_row, _, buyer in tu_pending:
+            if not res_row.get("dxbx_tu") and buyer and buyer_tu.get(buyer):
+                res_row["dxbx_tu"] = buyer_tu[buyer]
+        
+    # Collect unmatched IIKO docs names
+    profiler.stage("summary")
+    iiko_missing_in_act = []
+    if "IIKO_unmatched" in system_indices and "IIKO" in system_indices:
+        for k in system_indices["IIKO_unmatched"]:
+            # Get original doc name from the first record in the list
+            records = system_indices["IIKO"].get(k, [])
+            if records:
+                orig = records[0]["raw"].get("Входящий номер", k)
+                iiko_missing_in_act.append(str(orig))
+                
+    summary = {
+        "iiko_total": system_stats["IIKO"]["total_sum"],
+        "sap_total": system_stats["SAP"]["total_sum"],
+        "fb_total": system_stats["FB"]["total_sum"],
+        "act_total": act_stats["total_sum"],
+        
+        "delta_act_iiko": act_stats["total_sum"] - system_stats["IIKO"]["total_sum"],
+        # SAP amounts are negative. Sum them up to get delta.
+        "delta_act_sap": act_stats["total_sum"] + system_stats["SAP"]["total_sum"],
+        "delta_act_fb": act_stats["total_sum"] - system_stats["FB"]["total_sum"],
+        
+        "act_count": act_stats["count"],
+        "iiko_count": system_stats["IIKO"]["count"],
+        "delta_count": act_stats["count"] - system_stats["IIKO"]["count"],
+        
+        "iiko_duplicates": system_stats["IIKO"].get("duplicates", ""),
+        "iiko_missing": ", ".join(iiko_missing_in_act),
+        "act_missing": ", ".join(act_missing_in_iiko)
+    }
+        
+    return {"rows": results, "summary": summary}
+
+_worker_snapshot = None
+_worker_tu_resolver = None
+
+def _init_worker(snapshot, tu_resolver=None):
+    global _worker_snapshot, _worker_tu_resolver
+    _worker_snapshot = snapshot
+    _worker_tu_resolver = tu_resolver
+
+def _reconcile_job(job):
+    result = perform_reconciliation(job["rows"], _worker_snapshot, job["supplier"], tu_resolver=_worker_tu_resolver)
+    return job["key"], result
+
+def _reconcile_pool_job(job):
+    # Профиль сверки копится в рабочем процессе — отдаем его вместе с результатом
+    key, result = _reconcile_job(job)
+    return key, result, get_profiler().drain()
+
+@profiled("reconcile_batch")
+def reconcile_batch(jobs, system_data_map, max_workers=None):
+    """
+    Сверка многих актов по одной выгрузке систем.
+    jobs: [{"key": id акта, "supplier": поставщик, "rows": строки акта}]
+    system_data_map: { "IIKO": [records...], ... } или готовый SystemSnapshot (из сессии Streamlit) —
+    тогда он используется как есть, и до контрагентов ищутся только новые поставщики.
+    Таблица систем, резолвер контрагентов и группировка записей готовятся один раз,
+    сами сверки идут параллельно в процессах; резолвер ТУ процесса уходит в них вместе со снимком.
+    Возвращает {"results": {key: {"rows", "summary"}}, "summary": сводка по всем}.
+    """
+    if not jobs:
+        return {"results": {}, "summary": build_batch_summary(jobs, {})}
+
+    profiler = get_profiler()
+    profiler.stage("prepare")
+    if isinstance(system_data_map, SystemSnapshot):
+        snapshot = system_data_map
+        snapshot.partner_resolver.resolve_many([job["supplier"] for job in jobs])
+    else:
+        resolver = build_partner_resolver(system_data_map)
+        resolver.resolve_many([job["supplier"] for job in jobs])
+        snapshot = SystemSnapshot(system_data_map, resolver)
+    tu_resolver = load_tu_resolver(TU_MAPPING_FILE)
+
+    if max_workers is None:
+        max_workers = min(len(jobs), os.cpu_count() or 1)
+    profiler.stage("reconcile")
+    if max_workers <= 1 or len(jobs) == 1:
+        _init_worker(snapshot, tu_resolver)
+        results = dict(_reconcile_job(job) for job in jobs)
+    else:
+        results = {}
+        # spawn, как у конвейера файлов: fork из многопоточного сервера Streamlit небезопасен
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(snapshot, tu_resolver),
+        ) as executor:
+            for key, result, profile in executor.map(_reconcile_pool_job, jobs):
+                results[key] = result
+                profiler.merge(profile)
+
+    return {"results": results, "summary": build_batch_summary(jobs, results)}
+
+def build_batch_summary(jobs, results):
+    per_job = []
+    totals = {"act_total": 0.0, "iiko_total": 0.0, "sap_total": 0.0, "fb_total": 0.0, "act_count": 0, "iiko_count": 0}
+    for job in jobs:
+        result = results.get(job["key"])
+        if not result:
+            continue
+        summary = result["summary"]
+        per_job.append({"key": job["key"], "supplier": job["supplier"], "rows": len(result["rows"]), **summary})
+        for k in totals:
+            totals[k] += summary.get(k, 0)
+    totals["delta_act_iiko"] = totals["act_total"] - totals["iiko_total"]
+    totals["delta_act_sap"] = totals["act_total"] + totals["sap_total"]
+    totals["delta_act_fb"] = totals["act_total"] - totals["fb_total"]
+    return {"jobs": per_job, "totals": totals}
+
+def write_batch_results(batch, out_dir):
+    """Пишет <out_dir>/<key>.json по каждому акту и общий summary.json."""
+    os.makedirs(out_dir, exist_ok=True)
+    for key, result in batch["results"].items():
+        safe_key = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(key))
+        with open(os.path.join(out_dir, f"{safe_key}.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1, default=str)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(batch["summary"], f, ensure_ascii=False, indent=1, default=str)
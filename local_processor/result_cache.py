@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+from extraction_core import SQLiteLRUStore, get_shared
+
+# Кэш готовых результатов process_file между сессиями и перезапусками.
+# Ключ: SHA-256 содержимого файла + конфигурация обработки (версия SYSTEM_CONFIG,
+# система по имени файла, модель, ключевые слова, режим извлечения).
+# Значение: (строки, статус, система, заголовки) в JSON.
+
+DEFAULT_RESULT_CACHE_PATH = "result_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 2000
+# Поднимать при изменении логики обработки, которое не видно по SYSTEM_CONFIG и промтам
+RESULT_CACHE_VERSION = 1
+# Кэшируются только успешные результаты: ошибки разбора повторяем при следующей загрузке
+CACHEABLE_STATUSES = ("enriched", "enriched_system")
+
+READ_BLOCK = 1024 * 1024
+
+
+def file_digest(path=None, data=None):
+    """SHA-256 содержимого файла: по пути (читается блоками) или по bytes."""
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(READ_BLOCK), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def config_version(config):
+    """Короткий хэш конфигурации: любая правка SYSTEM_CONFIG инвалидирует кэш."""
+    raw = json.dumps(config, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def make_result_key(digest, settings):
+    raw = json.dumps({"file": digest, "settings": settings, "version": RESULT_CACHE_VERSION}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _encode_result(result):
+    rows, status, system_name, headers = result
+    return json.dumps(
+        {"rows": rows, "status": status, "system": system_name, "headers": headers},
+        ensure_ascii=False,
+        allow_nan=False,
+    )
+
+
+def _decode_result(value):
+    value = json.loads(value)
+    return value["rows"], value["status"], value["system"], value["headers"]
+
+
+class ResultCache:
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.getenv("RESULT_CACHE_PATH", DEFAULT_RESULT_CACHE_PATH)
+        if max_entries is None:
+            max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.max_entries = max_entries
+        self.store = SQLiteLRUStore(self.path, "result_cache", max_entries, encode=_encode_result, decode=_decode_result)
+
+    def get(self, key):
+        """(строки, статус, система, заголовки) или None, если результата нет."""
+        return self.store.get_many([key]).get(key)
+
+    def set(self, key, result):
+        """
+        Сохраняет результат process_file. Неуспешные результаты и строки
+        со значениями, которые не переживут JSON без потерь, не сохраняются.
+        """
+        if result[1] not in CACHEABLE_STATUSES:
+            return False
+        try:
+            self.store.set_many({key: result})
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def stats(self):
+        return self.store.stats()
+
+    def clear(self):
+        self.store.clear()
+
+
+def get_result_cache(path=None):
+    """Один экземпляр кэша на путь на весь процесс."""
+    return get_shared(ResultCache, path or os.getenv("RESULT_CACHE_PATH", DEFAULT_RESULT_CACHE_PATH))
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from column_table import ColumnTable
+
+# Локальные снимки таблицы систем: <root>/<spreadsheet_id>/<modifiedTime>_<колонки>/<лист>.parquet
+# Снимок действителен, пока Drive не сообщит более новый modifiedTime таблицы.
+
+DEFAULT_SNAPSHOT_DIR = ".snapshots"
+MANIFEST_FILE = "manifest.json"
+
+
+def _safe_name(value):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(value))
+
+
+def columns_signature(columns):
+    """Короткий ключ набора колонок: снимок всего листа и выборки колонок хранятся раздельно."""
+    if columns is None:
+        return "all"
+    normalized = {sheet: sorted(headers) for sheet, headers in columns.items()}
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+class SnapshotStore:
+    def __init__(self, root=None):
+        self.root = root or os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+
+    @property
+    def available(self):
+        return pq is not None
+
+    def _spreadsheet_dir(self, spreadsheet_id):
+        return os.path.join(self.root, _safe_name(spreadsheet_id))
+
+    def _snapshot_dir(self, spreadsheet_id, modified_time, columns):
+        name = f"{_safe_name(modified_time)}_{columns_signature(columns)}"
+        return os.path.join(self._spreadsheet_dir(spreadsheet_id), name)
+
+    def load(self, spreadsheet_id, modified_time, columns=None):
+        """{лист: ColumnTable} из снимка этой ревизии или None, если снимка нет."""
+        if not self.available or not modified_time:
+            return None
+        directory = self._snapshot_dir(spreadsheet_id, modified_time, columns)
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            result = {}
+            for sheet in manifest["sheets"]:
+                table = pq.read_table(os.path.join(directory, sheet["file"]))
+                result[sheet["title"]] = ColumnTable(table.to_pydict(), sheet["rows"])
+            return result
+        except (OSError, ValueError, KeyError, pa.ArrowException) as e:
+            if os.path.isdir(directory):
+                print(f"[SNAPSHOT] Снимок {directory} не читается ({e}), читаем таблицу заново")
+            return None
+
+    def save(self, spreadsheet_id, modified_time, data, columns=None):
+        """
+        Пишет снимок ревизии modified_time и удаляет снимки более старых ревизий.
+        Снимок собирается во временной папке и подменяется целиком.
+        """
+        if not self.available or not modified_time or data is None:
+            return False
+        parent = self._spreadsheet_dir(spreadsheet_id)
+        os.makedirs(parent, exist_ok=True)
+        directory = self._snapshot_dir(spreadsheet_id, modified_time, columns)
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp_")
+        try:
+            sheets = []
+            for i, (title, records) in enumerate(data.items()):
+                if not isinstance(records, ColumnTable):
+                    records = ColumnTable({k: [r.get(k, "") for r in records] for k in (records[0].keys() if records else [])}, len(records))
+                file_name = f"{i:02d}_{_safe_name(title)}.parquet"
+                table = pa.table({
+                    header: pa.array([str(v) if v is not None else "" for v in values], type=pa.string())
+                    for header, values in records.columns.items()
+                })
+                pq.write_table(table, os.path.join(tmp_dir, file_name))
+                sheets.append({"title": title, "file": file_name, "rows": len(records)})
+            manifest = {"spreadsheet_id": spreadsheet_id, "modified_time": modified_time, "columns": columns, "sheets": sheets}
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.replace(tmp_dir, directory)
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            print(f"[SNAPSHOT] Не удалось сохранить снимок {spreadsheet_id}: {e}")
+            return False
+        self.prune(spreadsheet_id, modified_time)
+        return True
+
+    def prune(self, spreadsheet_id, keep_modified_time):
+        """Удаляет снимки других ревизий таблицы."""
+        parent = self._spreadsheet_dir(spreadsheet_id)
+        prefix = f"{_safe_name(keep_modified_time)}_"
+        for name in os.listdir(parent):
+            if not name.startswith(prefix) and not name.startswith(".tmp_"):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+    def clear(self, spreadsheet_id=None):
+        target = self._spreadsheet_dir(spreadsheet_id) if spreadsheet_id else self.root
+        shutil.rmtree(target, ignore_errors=True)
+
+
+_default_store = None
+
+
+def get_snapshot_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = SnapshotStore()
+    return _default_store
@@ -0,0 +1,99 @@
+import numpy as np
+from rapidfuzz import process, fuzz
+
+
+class TUResolver:
+    """
+    Поиск ТУ по складу IIKO и по покупателю DXBX.
+    Ключи справочника (load_tu_mapping) подготавливаются один раз,
+    результаты запоминаются по строке склада/покупателя,
+    resolve_many() сопоставляет все новые значения одним вызовом cdist на справочник.
+    """
+    def __init__(self, syrye_map, regular_map, threshold=85, buyer_threshold=60):
+        self.syrye_map = syrye_map
+        self.regular_map = regular_map
+        self.threshold = threshold
+        self.buyer_threshold = buyer_threshold
+        self._syrye_keys = [str(k).strip() for k in syrye_map]
+        self._syrye_values = list(syrye_map.values())
+        self._regular_keys = [str(k).strip() for k in regular_map]
+        self._regular_values = list(regular_map.values())
+        self._warehouse_cache = {}
+        self._buyer_cache = {}
+
+    def _best_matches(self, queries, keys, cutoff):
+        """Для каждого запроса: (индекс ключа, score) лучшего совпадения или None."""
+        if not queries or not keys:
+            return [None] * len(queries)
+        scores = process.cdist(queries, keys, scorer=fuzz.token_set_ratio, workers=-1)
+        best = np.argmax(scores, axis=1)
+        result = []
+        for row_idx, key_idx in enumerate(best):
+            score = scores[row_idx, key_idx]
+            result.append((int(key_idx), float(score)) if score >= cutoff else None)
+        return result
+
+    def resolve_many(self, warehouses):
+        """
+        Сырье: "Сырье / КРД Красная ул., 176" ищется по адресу в листе "Точка-ТУ СП".
+        Остальное (или если для сырья не нашлось) — полное название в "Точка-ТУ".
+        """
+        pending = []
+        for warehouse in warehouses:
+            w_name = str(warehouse).strip() if warehouse else ""
+            if w_name and w_name not in self._warehouse_cache and w_name not in pending:
+                pending.append(w_name)
+
+        if pending:
+            syrye_targets = []
+            for w_name in pending:
+                if w_name.lower().startswith("сырье"):
+                    parts = w_name.split("/", 1)
+                    if len(parts) > 1:
+                        syrye_targets.append((w_name, parts[1].strip()))
+
+            resolved = {}
+            syrye_matches = self._best_matches([t for _, t in syrye_targets], self._syrye_keys, self.threshold)
+            for (w_name, _), match in zip(syrye_targets, syrye_matches):
+                if match:
+                    resolved[w_name] = self._syrye_values[match[0]]
+
+            regular = [w_name for w_name in pending if w_name not in resolved]
+            regular_matches = self._best_matches(regular, self._regular_keys, self.threshold)
+            for w_name, match in zip(regular, regular_matches):
+                resolved[w_name] = self._regular_values[match[0]] if match else ""
+
+            self._warehouse_cache.update(resolved)
+
+        return {
+            warehouse: self._warehouse_cache.get(str(warehouse).strip(), "") if warehouse else ""
+            for warehouse in warehouses
+        }
+
+    def resolve(self, warehouse):
+        return self.resolve_many([warehouse])[warehouse]
+
+    def resolve_buyers(self, buyers):
+        """
+        Fallback по покупателю DXBX: текст до скобок ищется среди адресов "Точка-ТУ"
+        с пониженным порогом (token_set_ratio устойчив к перестановке слов).
+        """
+        pending = []
+        for buyer in buyers:
+            buyer_clean = str(buyer).split("(")[0].strip() if buyer else ""
+            if buyer_clean and buyer_clean not in self._buyer_cache and buyer_clean not in pending:
+                pending.append(buyer_clean)
+
+        matches = self._best_matches(pending, self._regular_keys, self.buyer_threshold)
+        for buyer_clean, match in zip(pending, matches):
+            if match:
+                key_idx, score = match
+                print(f"[RECON] TU Fallback: '{buyer_clean}' -> '{self._regular_keys[key_idx]}' ({score:.0f}%)")
+                self._buyer_cache[buyer_clean] = self._regular_values[key_idx]
+            else:
+                self._buyer_cache[buyer_clean] = ""
+
+        return {
+            buyer: self._buyer_cache.get(str(buyer).split("(")[0].strip(), "") if buyer else ""
+            for buyer in buyers
+        }
@@ -8,6 +8,7 @@ const PARTNER_CONFIG = {
   USE_SEMANTIC_FILTER: true,
   SEMANTIC_PROVIDER: "yandex",
   SEMANTIC_BATCH_SIZE: 250,
+  SEMANTIC_CONCURRENCY: 4,
   SEMANTIC_FAST_EXCLUDE: true,
   SEMANTIC_SEND_REASON: false,
   NUMBER_MODE: "regex_first",
@@ -92,6 +92,10 @@ function callPartnerFunction(functionUrl, file, fileName) {
     fileBase64: Utilities.base64Encode(file.getBlob().getBytes()),
     options: {
       semantic: PARTNER_CONFIG.USE_SEMANTIC_FILTER,
+      semanticBatch: PARTNER_CONFIG.SEMANTIC_BATCH_SIZE,
+      semanticConcurrency: PARTNER_CONFIG.SEMANTIC_CONCURRENCY,
+      semanticPrefilter: PARTNER_CONFIG.SEMANTIC_FAST_EXCLUDE,
+      semanticExcludeKeywords: PARTNER_CONFIG.SEMANTIC_EXCLUDE_PATTERNS,
       numberMode: PARTNER_CONFIG.NUMBER_MODE || "regex_first",
       llmExtract: PARTNER_CONFIG.LLM_EXTRACT,
       llmMaxChars: PARTNER_CONFIG.LLM_MAX_CHARS,
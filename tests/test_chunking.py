@@ -0,0 +1,111 @@
+import random
+import threading
+
+from extraction_core import ChunkPlanner, estimate_tokens
+
+
+# Эталон: нарезка из processor.py до планировщика — фиксированное число строк на запрос
+
+def baseline_chunk_rows(rows, chunk_size):
+    return [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+
+def random_texts(rnd, count):
+    words = ["Реализация", "№20", "(сф 20/DP)", "Акт", "от", "12.01.2026", "поставка", "ООО Ромашка"]
+    return [" ".join(rnd.choice(words) for _ in range(rnd.randint(1, 12))) for _ in range(count)]
+
+
+def test_plan_with_room_matches_fixed_chunks():
+    rnd = random.Random(15)
+    planner = ChunkPlanner("yandexgpt-lite/latest", output_per_item=5)
+    for count in (0, 1, 7, 50, 333):
+        texts = random_texts(rnd, count)
+        for size in (1, 10, 50):
+            assert planner.plan(texts, max_items=size) == baseline_chunk_rows(list(range(count)), size)
+
+
+def test_plan_keeps_order_and_budget():
+    rnd = random.Random(16)
+    planner = ChunkPlanner("yandexgpt-lite/latest", output_per_item=5)
+    texts = random_texts(rnd, 300) + ["x" * 200000] + random_texts(rnd, 300)
+    fixed = "системный промт " * 50
+    chunks = planner.plan(texts, fixed)
+    assert [i for chunk in chunks for i in chunk] == list(range(len(texts)))
+    budget = planner.context * 0.9 - planner.max_output - estimate_tokens(fixed)
+    for chunk in chunks:
+        # Строка, которая одна не влезает в бюджет, уходит отдельным чанком
+        assert len(chunk) == 1 or planner.estimate([texts[i] for i in chunk]) <= budget
+    assert [300] in chunks
+
+
+def truncating_request(limit, calls):
+    """Ответ обрезается на чанках длиннее limit: приходят ответы только на первые limit строк."""
+    lock = threading.Lock()
+
+    def request(chunk):
+        assert chunk
+        with lock:
+            calls.append(list(chunk))
+        answered = chunk[:limit]
+        return {j: f"n{j}" for j in answered}, {"truncated": len(chunk) > limit, "output_tokens": 10 * len(answered)}
+    return request
+
+
+def merged(results):
+    # Как в processor.py: повтор идет после обрезанного чанка и перезаписывает его строки
+    answers = {}
+    for _, value in results:
+        answers.update(value)
+    return answers
+
+
+def test_truncated_chunks_are_split_until_answered():
+    rnd = random.Random(17)
+    for workers in (1, 4):
+        for limit in (1, 3, 7):
+            texts = random_texts(rnd, 60)
+            planner = ChunkPlanner("yandexgpt-lite/latest", output_per_item=5)
+            plan = baseline_chunk_rows(list(range(len(texts))), 20)
+            calls = []
+            results = planner.run(texts, plan, truncating_request(limit, calls), max_workers=workers)
+            # Без pending обрезанный ответ отбрасывается целиком, остаются полные ответы
+            # на половинки — каждая строка ровно один раз и в исходном порядке
+            assert [i for chunk, _ in results for i in chunk] == list(range(len(texts)))
+            assert all(value == {j: f"n{j}" for j in chunk} for chunk, value in results)
+            assert planner.max_items <= 10
+
+
+def test_truncated_chunks_resend_only_pending_rows():
+    rnd = random.Random(18)
+    for workers in (1, 4):
+        for limit in (1, 3, 7):
+            texts = random_texts(rnd, 60)
+            plan = baseline_chunk_rows(list(range(len(texts))), 20)
+            calls = []
+            results = ChunkPlanner("yandexgpt-lite/latest", output_per_item=5).run(
+                texts, plan, truncating_request(limit, calls), max_workers=workers,
+                pending=lambda chunk, value: [j for j in chunk if j not in value],
+            )
+            assert merged(results) == {j: f"n{j}" for j in range(len(texts))}
+            # Отвеченная строка заново не отправляется
+            sent = [j for chunk in calls for j in chunk]
+            answered = [j for chunk in calls for j in chunk[:limit]]
+            assert sorted(answered) == list(range(len(texts)))
+            full_calls = []
+            ChunkPlanner("yandexgpt-lite/latest", output_per_item=5).run(
+                texts, plan, truncating_request(limit, full_calls), max_workers=workers)
+            assert len(sent) < sum(len(chunk) for chunk in full_calls)
+            # Результаты чанков плана — в порядке плана
+            firsts = [chunk for chunk, _ in results if chunk in plan]
+            assert firsts == plan
+
+
+def test_complete_answers_pass_through():
+    texts = random_texts(random.Random(19), 45)
+    plan = baseline_chunk_rows(list(range(len(texts))), 10)
+    for workers in (1, 3):
+        calls = []
+        results = ChunkPlanner("yandexgpt-lite/latest", output_per_item=5).run(
+            texts, plan, truncating_request(100, calls), max_workers=workers)
+        assert results == [(chunk, {j: f"n{j}" for j in chunk}) for chunk in plan]
+        assert sorted(calls) == plan
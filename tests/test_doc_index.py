@@ -0,0 +1,92 @@
+import random
+
+from doc_index import DocIndex, SortedKeys
+from reconciliation import find_doc_in_index, normalize_doc_num_for_search
+
+
+# Эталон: линейный перебор из app.py до сортированного индекса
+
+def baseline_find_doc_in_index(target_doc, idx_map):
+    if not target_doc:
+        return []
+    if target_doc in idx_map:
+        return idx_map[target_doc]
+    for key in idx_map:
+        if key.startswith(target_doc) and len(key) > len(target_doc):
+            suffix = key[len(target_doc):]
+            if suffix[0].isalpha():
+                return idx_map[key]
+    return []
+
+
+def baseline_discard_prefix(unmatched, norm_doc):
+    to_remove = [k for k in unmatched if k.startswith(norm_doc) and len(k) > len(norm_doc)]
+    for k in to_remove:
+        unmatched.discard(k)
+    return to_remove
+
+
+# Ключи как после normalize_doc_num_for_search: цифры, латиница и кириллица в нижнем регистре
+# (включая юникодные цифры: isalnum, но не isalpha, и в сортировке после ASCII-цифр)
+SUFFIXES = ["", "", "", "dp", "k", "0", "1", "а", "бв", "ё", "9x", "²", "٣"]
+
+
+def random_index(rnd, size):
+    idx_map = {}
+    while len(idx_map) < size:
+        key = str(rnd.randint(1, size * 3)) + rnd.choice(SUFFIXES)
+        idx_map.setdefault(key, []).append({"amount": float(rnd.randint(1, 100)), "raw": {"key": key}})
+    return idx_map
+
+
+def random_targets(rnd, idx_map, count):
+    keys = list(idx_map)
+    targets = ["", "0"]
+    for _ in range(count):
+        key = rnd.choice(keys)
+        targets.append(rnd.choice([key, key[:-1], key[:1], key.rstrip("dpkабвёx"), key + "1", str(rnd.randint(1, 9999))]))
+    return targets
+
+
+def test_find_matches_linear_scan():
+    rnd = random.Random(5)
+    for size in (1, 5, 50, 500):
+        idx_map = random_index(rnd, size)
+        index = DocIndex(idx_map)
+        for target in random_targets(rnd, idx_map, 300):
+            expected = baseline_find_doc_in_index(target, idx_map)
+            assert index.find(target) == expected, target
+            assert find_doc_in_index(target, idx_map) == expected, target
+
+
+def test_first_inserted_candidate_wins():
+    # Несколько ключей "20" + буквы: как при переборе dict, побеждает первый добавленный
+    idx_map = {"20k": ["k"], "205": ["digit"], "20dp": ["dp"], "20а": ["cyr"]}
+    assert DocIndex(idx_map).find("20") == ["k"]
+    assert DocIndex({"20dp": ["dp"], "20k": ["k"]}).find("20") == ["dp"]
+    assert DocIndex({"205": ["digit"]}).find("20") == []
+    assert DocIndex({"20²": ["superscript"], "20dp": ["dp"]}).find("20") == ["dp"]
+
+
+def test_discard_prefix_matches_set_scan():
+    rnd = random.Random(6)
+    idx_map = random_index(rnd, 400)
+    keys = SortedKeys(idx_map)
+    unmatched = set(idx_map)
+    for target in random_targets(rnd, idx_map, 400):
+        if not target:
+            continue
+        expected = baseline_discard_prefix(unmatched, target)
+        assert sorted(keys.discard_prefix(target)) == sorted(expected), target
+        assert sorted(keys) == sorted(unmatched)
+        if target in unmatched:
+            unmatched.discard(target)
+            assert keys.discard(target)
+        assert target not in keys
+
+
+def test_normalize_doc_num_for_search():
+    assert normalize_doc_num_for_search("  00012/DP ") == "12dp"
+    assert normalize_doc_num_for_search("А-778/К") == "а778к"
+    assert normalize_doc_num_for_search(None) == ""
+    assert normalize_doc_num_for_search(20) == "20"
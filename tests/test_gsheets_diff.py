@@ -0,0 +1,228 @@
+import random
+import re
+
+import pytest
+
+pytest.importorskip("gspread")
+pytest.importorskip("streamlit")
+pytest.importorskip("googleapiclient")
+pytest.importorskip("google.oauth2")
+
+import gsheets
+from gsheets import DATA_START_ROW, align_sheet_rows, diff_sheet_rows
+
+WIDTH = 37  # A:AK
+SHEET_WIDTH = 40  # колонки правее AK — пользовательские
+
+
+def column_index(letters):
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + ord(ch) - 64
+    return idx - 1
+
+
+def trimmed(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+class FakeWorksheet:
+    """Лист в памяти: строки полной ширины, операции как у gspread и Sheets API."""
+    def __init__(self, rows, row_count=None):
+        self.id = 7
+        self.rows = [list(r) + [""] * (SHEET_WIDTH - len(r)) for r in rows]
+        self.row_count = row_count or len(self.rows)
+        self.value_writes = 0
+
+    def _ensure(self, count):
+        while len(self.rows) < count:
+            self.rows.append([""] * SHEET_WIDTH)
+
+    def acell(self, label):
+        return type("Cell", (), {"value": self.rows[0][column_index(label[0])]})()
+
+    def get_values(self, range_name, value_render_option=None):
+        first = int(re.match(r"A(\d+)", range_name).group(1))
+        values = [trimmed(r[:WIDTH]) for r in self.rows[first - 1:self.row_count]]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_update(self, updates, value_input_option=None):
+        for update in updates:
+            start, end = update["range"].split(":")
+            first = int(start[1:])
+            last_col = column_index(re.match(r"[A-Z]+", end).group(0))
+            assert len(update["values"]) == int(end[len(re.match(r"[A-Z]+", end).group(0)):]) - first + 1
+            assert first + len(update["values"]) - 1 <= self.row_count, "запись за пределы листа"
+            self._ensure(first + len(update["values"]) - 1)
+            for k, values in enumerate(update["values"]):
+                row = self.rows[first - 1 + k]
+                row[:last_col + 1] = list(values) + [""] * (last_col + 1 - len(values))
+                self.value_writes += 1
+
+    def batch_clear(self, ranges):
+        for range_name in ranges:
+            first = int(re.match(r"A(\d+)", range_name).group(1))
+            for row in self.rows[first - 1:]:
+                row[:WIDTH] = [""] * WIDTH
+
+    def resize(self, rows=None, cols=None):
+        self.row_count = rows
+        self._ensure(rows)
+        del self.rows[rows:]
+
+    def apply_requests(self, requests):
+        self._ensure(self.row_count)
+        for request in requests:
+            (kind, body), = request.items()
+            row_range = body["range"]
+            assert row_range["sheetId"] == self.id
+            lo, hi = row_range["startIndex"], row_range["endIndex"]
+            assert lo >= DATA_START_ROW - 1, "шапку трогать нельзя"
+            if kind == "deleteDimension":
+                del self.rows[lo:hi]
+                self.row_count -= hi - lo
+            else:
+                self.rows[lo:lo] = [[""] * SHEET_WIDTH for _ in range(hi - lo)]
+                self.row_count += hi - lo
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet, fail_requests=False):
+        self.ws = worksheet
+        self.fail_requests = fail_requests
+        self.structural_calls = 0
+
+    def worksheet(self, title):
+        return self.ws
+
+    def batch_update(self, body):
+        self.structural_calls += 1
+        if self.fail_requests:
+            raise RuntimeError("quota")
+        self.ws.apply_requests(body["requests"])
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+def data_row(doc, amount, comment="", extra=""):
+    row = [""] * SHEET_WIDTH
+    row[5] = doc
+    row[6] = amount
+    row[36] = comment
+    row[38] = extra
+    return row
+
+
+def apply_diff(sheet_rows, new_rows, requests=()):
+    """Состояние колонок A:AK после операций со строками и записи изменившихся диапазонов."""
+    ws = FakeWorksheet([["h"], ["h"]] + [list(r) for r in sheet_rows], row_count=2 + len(sheet_rows) + 5)
+    ws.apply_requests(requests)
+    if ws.row_count < 2 + len(new_rows):
+        ws.resize(rows=2 + len(new_rows))
+    ws.batch_update(diff_sheet_rows(ws.get_values("A3:AK"), new_rows, DATA_START_ROW, WIDTH - 1))
+    return ws
+
+
+def test_diff_reproduces_full_rewrite():
+    # Итог как у прежней записи: очистка A3:AK и запись всех строк подряд
+    rnd = random.Random(11)
+    for _ in range(300):
+        old = [data_row(f"D{rnd.randint(0, 30)}", rnd.randint(0, 3)) for _ in range(rnd.randint(0, 25))]
+        new = [data_row(f"D{rnd.randint(0, 30)}", rnd.randint(0, 3))[:WIDTH] for _ in range(rnd.randint(0, 25))]
+        ws = apply_diff(old, new)
+        assert [r[:WIDTH] for r in ws.rows[2:2 + len(new)]] == new
+        assert all(not any(r[:WIDTH]) for r in ws.rows[2 + len(new):])
+
+
+def test_aligned_diff_reproduces_full_rewrite_and_keeps_rows_with_documents():
+    rnd = random.Random(12)
+    for _ in range(300):
+        docs = [f"D{i}" for i in range(rnd.randint(0, 25))]
+        old = [data_row(doc, rnd.randint(0, 2), extra=f"note {doc}") for doc in docs]
+        new_docs = [doc for doc in docs if rnd.random() > 0.25]
+        for _ in range(rnd.randint(0, 5)):
+            new_docs.insert(rnd.randint(0, len(new_docs)), f"N{rnd.randint(0, 10 ** 6)}")
+        new = [data_row(doc, rnd.randint(0, 2))[:WIDTH] for doc in new_docs]
+
+        sheet_old = FakeWorksheet([["h"], ["h"]] + old).get_values("A3:AK")
+        requests, aligned = align_sheet_rows(sheet_old, new, 7, DATA_START_ROW)
+        assert len(aligned) == len(new)
+        ws = apply_diff(old, new, requests)
+        assert [r[:WIDTH] for r in ws.rows[2:2 + len(new)]] == new
+        assert all(not any(r[:WIDTH]) for r in ws.rows[2 + len(new):])
+        # Пользовательская колонка правее AK осталась у своего документа
+        # (новому документу чужая строка не достается)
+        for row in ws.rows[2:2 + len(new)]:
+            assert row[38] == (f"note {row[5]}" if row[5] in docs else "")
+
+
+def test_inserted_document_writes_one_row():
+    old = [data_row(f"D{i}", i) for i in range(100)]
+    new = [data_row("X", 0)[:WIDTH]] + [r[:WIDTH] for r in old]
+    requests, aligned = align_sheet_rows([trimmed(r[:WIDTH]) for r in old], new, 7, DATA_START_ROW)
+    assert len(requests) == 1 and "insertDimension" in requests[0]
+    # Строка над первой строкой данных — шапка, ее формат не наследуется
+    assert requests[0]["insertDimension"]["inheritFromBefore"] is False
+    middle, _ = align_sheet_rows(new[1:], new[1:51] + new[:1] + new[51:], 7, DATA_START_ROW)
+    assert middle[0]["insertDimension"]["inheritFromBefore"] is True
+    assert sum(len(u["values"]) for u in diff_sheet_rows(aligned, new, DATA_START_ROW, WIDTH - 1)) == 1
+    assert sum(len(u["values"]) for u in diff_sheet_rows(old, new, DATA_START_ROW, WIDTH - 1)) == 101
+
+
+def test_numbers_compare_by_value():
+    old = [[""] * 5 + [12345, 100, True]]
+    new = [[""] * 5 + ["12345", 100.0, True]]
+    requests, aligned = align_sheet_rows(old, new, 7, DATA_START_ROW)
+    assert requests == []
+    assert diff_sheet_rows(aligned, [new[0] + [""] * (WIDTH - 8)], DATA_START_ROW, WIDTH - 1) == [
+        {"range": "A3:AK3", "values": [new[0] + [""] * (WIDTH - 8)]}
+    ]
+    assert diff_sheet_rows([[""] * 6 + [100]], [[""] * 6 + [100.0] + [""] * (WIDTH - 7)], DATA_START_ROW, WIDTH - 1) == []
+
+
+def supplier_sheet(docs):
+    header = [""] * SHEET_WIDTH
+    header[4] = "ПОСТАВЩИК"
+    rows = [header, [""] * SHEET_WIDTH]
+    for doc, comment in docs:
+        rows.append(data_row(doc, 100, comment=comment, extra=f"note {doc}"))
+    return rows
+
+
+@pytest.mark.parametrize("fail_requests", [False, True])
+def test_update_supplier_sheet_keeps_comments_and_rows(monkeypatch, fail_requests):
+    ws = FakeWorksheet(supplier_sheet([("Акт 1", "ок"), ("Акт 2", ""), ("Акт 3", "спорный"), ("Акт 4", "")]))
+    spreadsheet = FakeSpreadsheet(ws, fail_requests=fail_requests)
+    monkeypatch.setattr(gsheets, "get_gsheets_client", lambda: FakeClient(spreadsheet))
+    data = [
+        {"supplier_doc": "Акт 0", "supplier_sum": 50},
+        {"supplier_doc": "Акт 1", "supplier_sum": 100},
+        {"supplier_doc": "Акт 3", "supplier_sum": 120},
+        {"supplier_doc": "Акт 4", "supplier_sum": 100},
+    ]
+    ok, _ = gsheets.update_supplier_sheet("id", "Сверка Январь 26", data, summary={"act_total": 370})
+
+    assert ok
+    assert spreadsheet.structural_calls == 1
+    body = ws.rows[2:ws.row_count]
+    # A:AK — ровно новые строки, как при полной перезаписи; комментарии по номеру документа
+    assert [row[5] for row in body[:4]] == ["Акт 0", "Акт 1", "Акт 3", "Акт 4"]
+    assert [row[6] for row in body[:4]] == [50, 100, 120, 100]
+    assert [row[36] for row in body[:4]] == ["", "ок", "спорный", ""]
+    assert [row[1] for row in body[:4]] == ["Оборот IIKO", "Оборот SAP", "Оборот FB", "Оборот Акт"]
+    assert body[3][2] == 370
+    assert not any(row[5] for row in body[4:])
+    if not fail_requests:
+        # Строки остались у своих документов вместе с колонками правее AK
+        assert [row[38] for row in body[:4]] == ["", "note Акт 1", "note Акт 3", "note Акт 4"]
@@ -0,0 +1,179 @@
+import random
+import re
+
+from extraction_core import analyze_header_rows, best_system, build_label_index, normalize_header
+
+# Поля систем как в SYSTEM_CONFIG processor.py: метки пересекаются между системами
+SYSTEM_CONFIG = {
+    "IIKO": {"fields": [
+        {"key": "date", "labels": ["Дата", "Дата документа", "Дата операции"]},
+        {"key": "docNumber", "labels": ["Входящий номер", "Номер документа", "Вх. номер", "Входящий №"]},
+        {"key": "partner", "labels": ["Поставщик/Покупатель", "Поставщик", "Покупатель", "Контрагент"]},
+        {"key": "warehouse", "labels": ["Склад"]},
+        {"key": "sum", "labels": ["Сумма, р.", "Сумма", "Итого"]},
+        {"key": "comment", "labels": ["Комментарий"]},
+    ]},
+    "DOCSINBOX": {"fields": [
+        {"key": "date", "labels": ["Дата", "Дата документа", "Дата операции"]},
+        {"key": "docNumber", "labels": ["Номер накладной поставщика", "Номер накладной", "Номер ТТН", "Номер", "Номер документа"]},
+        {"key": "supplier", "labels": ["Поставщик"]},
+        {"key": "buyer", "labels": ["Покупатель"]},
+        {"key": "sum", "labels": ["Сумма"]},
+        {"key": "status", "labels": ["Статус приемки", "Статус"]},
+    ]},
+    "SBIS": {"fields": [
+        {"key": "eventDate", "labels": ["Дата события", "Дата"]},
+        {"key": "docNumber", "labels": ["Номер"]},
+        {"key": "counterparty", "labels": ["Контрагент"]},
+        {"key": "sum", "labels": ["Сумма"]},
+        {"key": "status", "labels": ["Статус"]},
+    ]},
+    "SAP": {"fields": [
+        {"key": "docDate", "labels": ["Дата документа"]},
+        {"key": "paymentDate", "labels": ["Дата платежа"]},
+        {"key": "reference", "labels": ["Ссылка"]},
+        {"key": "counterparty", "labels": ["Наименование контрагента"]},
+        {"key": "sum", "labels": ["Сумма в ВВ", "Сумма"]},
+        {"key": "docType", "labels": ["Вид документа"]},
+    ]},
+    "FB": {"fields": [
+        {"key": "docNumber", "labels": ["Номер"]},
+        {"key": "type", "labels": ["Тип"]},
+        {"key": "linked", "labels": ["Привязан к поставке"]},
+        {"key": "partner", "labels": ["Поставщик"]},
+        {"key": "point", "labels": ["Точка"]},
+        {"key": "date", "labels": ["Дата документа"]},
+        {"key": "status", "labels": ["Статус"]},
+        {"key": "deliveryStatus", "labels": ["Статус поставки"]},
+        {"key": "sum", "labels": ["Сумма"]},
+    ]},
+}
+
+
+# Эталон: поиск заголовков до однопроходного анализа (по системе за проход)
+
+def baseline_normalize_header(value):
+    if value is None:
+        return ""
+    text = str(value).strip().lower()
+    text = re.sub(r"[«»\"']", "", text)
+    text = re.sub(r"\s+", " ", text)
+    return text
+
+
+def baseline_cloud_normalize_header(value):
+    if value is None:
+        return ""
+    return re.sub(r"\s+", " ", str(value)).strip().lower().replace("«", "").replace("»", "").replace('"', "").replace("'", "")
+
+
+def baseline_match_score(header_row, system_name):
+    normalized = [baseline_normalize_header(cell) for cell in header_row]
+    score = 0
+    for field in SYSTEM_CONFIG[system_name]["fields"]:
+        for label in field["labels"]:
+            if baseline_normalize_header(label) in normalized:
+                score += 1
+                break
+    return score
+
+
+def baseline_find_header_row(rows, system_name, max_rows=100):
+    best_index = None
+    best_score = 0
+    for i, row in enumerate(rows[:max_rows]):
+        if not any(baseline_normalize_header(cell) for cell in row):
+            continue
+        score = baseline_match_score(row, system_name)
+        if score > best_score:
+            best_score = score
+            best_index = i
+    return best_index
+
+
+def baseline_build_column_map(header_row, system_name):
+    normalized = [baseline_normalize_header(cell) for cell in header_row]
+    col_map = {}
+    for field in SYSTEM_CONFIG[system_name]["fields"]:
+        col_idx = None
+        for label in field["labels"]:
+            norm_label = baseline_normalize_header(label)
+            if norm_label in normalized:
+                col_idx = normalized.index(norm_label)
+                break
+        col_map[field["key"]] = col_idx
+    return col_map
+
+
+def baseline_detect_system(rows):
+    best = None
+    best_score = 0
+    for system_name in SYSTEM_CONFIG:
+        header_idx = baseline_find_header_row(rows, system_name)
+        if header_idx is None:
+            continue
+        score = baseline_match_score(rows[header_idx], system_name)
+        if score > best_score:
+            best_score = score
+            best = system_name
+    return best if best_score > 0 else None
+
+
+LABELS = sorted({label for config in SYSTEM_CONFIG.values() for field in config["fields"] for label in field["labels"]})
+NOISE = ["", None, "Итого по складу", "12.01.2026", 1500.5, "ООО Ромашка", "Реализация №20", "№ п/п"]
+
+
+def label_variant(rnd, label):
+    # Варианты записи заголовка, которые встречаются в выгрузках
+    variant = rnd.choice([label, label.upper(), label.lower(), f"  {label} ", f"«{label}»", f'"{label}"'])
+    return variant.replace(" ", "  ") if rnd.random() < 0.2 else variant
+
+
+def random_sheet(rnd):
+    rows = []
+    for _ in range(rnd.randint(0, 12)):
+        width = rnd.randint(0, 10)
+        rows.append([
+            label_variant(rnd, rnd.choice(LABELS)) if rnd.random() < 0.4 else rnd.choice(NOISE)
+            for _ in range(width)
+        ])
+    return rows
+
+
+def test_normalize_header_matches_baselines_up_to_spaces():
+    # Новая нормализация = прежние (локальная и облачная) плюс схлопывание пробелов по краям
+    rnd = random.Random(3)
+    alphabet = ["а", "Б", "x", " ", "  ", "\t", "«", "»", '"', "'", "/", ",", "№", "\xa0"]
+    values = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 10))) for _ in range(3000)]
+    for value in values + LABELS + [None, 12, 1.5]:
+        assert normalize_header(value) == " ".join(baseline_normalize_header(value).split()), value
+        assert normalize_header(value) == " ".join(baseline_cloud_normalize_header(value).split()), value
+    for label in LABELS:
+        assert normalize_header(label) == baseline_normalize_header(label)
+
+
+def test_single_pass_analysis_matches_per_system_search():
+    rnd = random.Random(4)
+    label_index = build_label_index(SYSTEM_CONFIG)
+    for _ in range(500):
+        rows = random_sheet(rnd)
+        analysis = analyze_header_rows(rows, SYSTEM_CONFIG, label_index)
+        for system_name in SYSTEM_CONFIG:
+            header_idx = baseline_find_header_row(rows, system_name)
+            info = analysis.get(system_name)
+            if header_idx is None:
+                assert info is None
+                continue
+            assert info["header_idx"] == header_idx
+            assert info["score"] == baseline_match_score(rows[header_idx], system_name)
+            assert info["col_map"] == baseline_build_column_map(rows[header_idx], system_name)
+        assert best_system(analysis, SYSTEM_CONFIG) == baseline_detect_system(rows)
+
+
+def test_header_window_is_limited():
+    header = ["Дата", "Входящий номер", "Поставщик/Покупатель", "Склад", "Сумма, р."]
+    rows = [["шапка отчета"]] * 5 + [header]
+    assert analyze_header_rows(rows, SYSTEM_CONFIG, max_rows=5) == {}
+    analysis = analyze_header_rows(rows, SYSTEM_CONFIG, max_rows=6)
+    assert analysis["IIKO"]["header_idx"] == 5
+    assert best_system(analysis, SYSTEM_CONFIG) == "IIKO"
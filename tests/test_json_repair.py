@@ -0,0 +1,128 @@
+import json
+import random
+import re
+
+from extraction_core import StreamingPairParser, normalize_doc_number, parse_llm_json
+
+
+# Эталон: parse_llm_json из processor.py до потокового разбора
+
+def baseline_parse_llm_json(content):
+    if not content:
+        return None
+    content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
+    cleaned = content.strip()
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r"^```[a-zA-Z]*\n", "", cleaned).strip()
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3].strip()
+    try:
+        return json.loads(cleaned)
+    except Exception:
+        pass
+    start_candidates = [cleaned.find("["), cleaned.find("{")]
+    start_candidates = [idx for idx in start_candidates if idx != -1]
+    if not start_candidates:
+        return None
+    start = min(start_candidates)
+    end = max(cleaned.rfind("]"), cleaned.rfind("}"))
+    if end == -1 or end <= start:
+        return None
+    snippet = cleaned[start:end + 1]
+    try:
+        return json.loads(snippet)
+    except Exception:
+        return None
+
+
+def normalized(parsed):
+    return {key: normalize_doc_number(value) for key, value in parsed.items()}
+
+
+# Значения, которые модель кладет в {id: номер}: строки (с кавычками, скобками, запятыми
+# и экранированием внутри), целые числа и null
+VALUES = ["20", "20/DP", "А-778/К", "№ 15", 'Акт "5"', "12, 13", "{1}", "a\\b", "сф\n7", "", "null", 20, 0, -3, None]
+
+
+def random_answer(rnd):
+    pairs = {str(i): rnd.choice(VALUES) for i in rnd.sample(range(40), rnd.randint(1, 12))}
+    body = json.dumps(pairs, ensure_ascii=rnd.random() < 0.5, indent=rnd.choice([None, 2]))
+    prefix, suffix = "", ""
+    if rnd.random() < 0.3:
+        prefix += '<think>Нужно вернуть {"0": "1"}, без лишнего текста.</think>\n'
+    if rnd.random() < 0.3:
+        prefix, suffix = prefix + "```json\n", "\n```"
+    elif rnd.random() < 0.3:
+        prefix, suffix = prefix + "Ответ: ", " Готово."
+    return pairs, body, prefix + body + suffix
+
+
+def feed_in_pieces(rnd, text):
+    parser = StreamingPairParser()
+    fed = []
+    pos = 0
+    while pos < len(text):
+        step = rnd.randint(1, 12)
+        fed.extend(parser.feed(text[pos:pos + step]))
+        pos += step
+    return parser, fed
+
+
+def test_finish_matches_full_parse():
+    rnd = random.Random(13)
+    for _ in range(500):
+        pairs, _, answer = random_answer(rnd)
+        expected = normalized(baseline_parse_llm_json(answer))
+        assert expected == normalized(pairs)
+        assert normalized(parse_llm_json(answer)) == expected, answer
+        parser, fed = feed_in_pieces(rnd, answer)
+        result = parser.finish()
+        assert normalized(result) == expected, answer
+        # Каждая пара отдается feed() один раз, и finish() ее не меняет
+        assert len({key for key, _ in fed}) == len(fed)
+        assert all(result[key] == value for key, value in fed)
+
+
+def test_truncated_answer_keeps_complete_pairs():
+    rnd = random.Random(14)
+    for _ in range(150):
+        pairs, body, answer = random_answer(rnd)
+        offset = answer.index(body)
+        full = normalized(pairs)
+        # Конец текста каждой пары в ответе и числовое ли значение
+        ends = {}
+        for key, value in pairs.items():
+            pair_text = json.dumps({key: value}, ensure_ascii=False)[1:-1]
+            start = body.find(pair_text)
+            if start < 0:
+                pair_text = json.dumps({key: value})[1:-1]
+                start = body.find(pair_text)
+            ends[key] = (offset + start + len(pair_text), isinstance(value, (int, float)))
+        previous = set()
+        for cut in range(len(answer) + 1):
+            parser = StreamingPairParser()
+            parser.feed(answer[:cut])
+            result = normalized(parser.finish())
+            # Только пары полного ответа и с теми же значениями; пришедшие не пропадают
+            assert all(full[key] == value for key, value in result.items()), (cut, answer)
+            assert previous <= set(result), (cut, answer)
+            previous = set(result)
+            # Строка или null, пришедшие целиком, уже готовы; число — только когда за ним
+            # виден следующий символ (иначе оно могло оборваться)
+            for key, (end, numeric) in ends.items():
+                tail = answer[end:cut]
+                if cut >= end and (not numeric or tail.strip()):
+                    assert key in result, (key, cut, answer)
+                if numeric and cut >= end and not tail.strip() and cut < len(answer):
+                    assert key not in result, (key, cut, answer)
+
+
+def test_think_and_fence_split_across_pieces():
+    answer = '<think>{"0": "9"}</think>```json\n{"0": "20", "1": null, "2": 15}\n```'
+    for size in range(1, len(answer) + 1):
+        parser = StreamingPairParser()
+        fed = []
+        for pos in range(0, len(answer), size):
+            fed.extend(parser.feed(answer[pos:pos + size]))
+        assert parser.finish() == {"0": "20", "1": None, "2": "15"}
+        assert ("0", "9") not in fed
@@ -0,0 +1,60 @@
+import random
+
+from extraction_core import classify_by_keywords, prepare_keywords
+
+# Списки по умолчанию: SEMANTIC_*_KEYWORDS облачной функции и фильтр платежей processor.py
+EXCLUDE = ["платежное", "поступление", "оплата", "списание", "перечислено", "приход"]
+INCLUDE = ["реализация", "упд", "продажа", "корректировка", "акт"]
+
+
+# Эталон: поиск подстрокой до prepare_keywords
+
+def baseline_classify(text, exclude, include):
+    text_lc = str(text).lower()
+    has_exclude = any(k.strip().lower() in text_lc for k in exclude if k.strip())
+    has_include = any(k.strip().lower() in text_lc for k in include if k.strip())
+    if has_exclude and not has_include:
+        return False
+    if has_include and not has_exclude:
+        return True
+    return None
+
+
+# Слова, в которых нет ключевых слов подстрокой: на таких строках поиск слов целиком
+# и поиск подстрокой должны совпадать
+NEUTRAL = ["товаров", "№20", "от", "12.01.2026", "(сф 20/DP)", "ООО Ромашка", "по счету", "накладная", "5"]
+SEPARATORS = [" ", "  ", ", ", " (", ") ", "\t", " №", "-"]
+
+
+def random_text(rnd):
+    words = [rnd.choice([rnd.choice(EXCLUDE + INCLUDE), rnd.choice(NEUTRAL)]) for _ in range(rnd.randint(0, 6))]
+    words = [word.upper() if rnd.random() < 0.3 else word.capitalize() for word in words]
+    return "".join(word + rnd.choice(SEPARATORS) for word in words)
+
+
+def test_whole_words_match_substring_search():
+    rnd = random.Random(20)
+    exclude, include = prepare_keywords(EXCLUDE), prepare_keywords(INCLUDE)
+    for _ in range(3000):
+        text = random_text(rnd)
+        assert classify_by_keywords(text, exclude, include) == baseline_classify(text, EXCLUDE, INCLUDE), text
+
+
+def test_keyword_inside_other_word_is_not_found():
+    exclude, include = prepare_keywords(EXCLUDE), prepare_keywords(INCLUDE)
+    # "акт" в "фактура", "приход" в "приходная": решение остается за LLM
+    assert classify_by_keywords("Приходная накладная 5", exclude, include) is None
+    assert classify_by_keywords("Счет-фактура 12", exclude, include) is None
+    assert classify_by_keywords("Контракт 7", exclude, include) is None
+    assert classify_by_keywords("Приход денег", exclude, include) is False
+    assert classify_by_keywords("Акт №5 (счет-фактура 5)", exclude, include) is True
+    assert classify_by_keywords("Реализация/акт", exclude, include) is True
+
+
+def test_keywords_are_normalized():
+    exclude = prepare_keywords([" Платежное  поручение ", "", "  ", None])
+    include = prepare_keywords([])
+    assert classify_by_keywords("платежное\tПОРУЧЕНИЕ №3", exclude, include) is False
+    assert classify_by_keywords("платежное", exclude, include) is None
+    assert classify_by_keywords("Акт", prepare_keywords([]), prepare_keywords([])) is None
+    assert prepare_keywords(["б", "А"]).pattern == prepare_keywords(["а", "Б", "а"]).pattern
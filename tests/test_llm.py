@@ -0,0 +1,58 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from extraction_core import LLMClient, LLMMetrics
+
+
+class OllamaHandler(BaseHTTPRequestHandler):
+    """Ответы в формате /api/chat Ollama: эхо текста пользователя, целиком или потоком."""
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = payload["messages"][1]["content"].upper()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        if payload["stream"]:
+            for ch in text:
+                self.wfile.write(json.dumps({"message": {"content": ch}}).encode() + b"\n")
+            last = {"message": {"content": ""}, "done": True, "done_reason": "stop", "eval_count": len(text)}
+            self.wfile.write(json.dumps(last).encode() + b"\n")
+        else:
+            self.wfile.write(json.dumps({
+                "message": {"content": text}, "done_reason": "stop", "prompt_eval_count": 3, "eval_count": len(text),
+            }).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OllamaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    llm = LLMClient("ollama", "qwen", base_url=f"http://127.0.0.1:{server.server_port}/api/chat",
+                    timeout=10, metrics=LLMMetrics())
+    yield llm
+    llm.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_acomplete_matches_complete(client):
+    async def main():
+        return await asyncio.gather(*(client.acomplete("sys", f"акт {i}") for i in range(8)))
+
+    assert asyncio.run(main()) == [client.complete("sys", f"акт {i}") for i in range(8)]
+    assert client.metrics.summary()["ollama:qwen"]["calls"] == 16
+
+
+def test_acomplete_details_streams(client):
+    deltas = []
+    details = asyncio.run(client.acomplete_details("sys", "акт 5", on_delta=deltas.append))
+    assert details["text"] == "АКТ 5" == "".join(deltas)
+    assert details["truncated"] is False and details["output_tokens"] == 5
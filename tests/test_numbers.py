@@ -0,0 +1,107 @@
+import random
+import re
+
+import pytest
+
+from extraction_core import (
+    RULE_CONFIDENCE_THRESHOLD,
+    extract_doc_number_rules,
+    extract_number_regex,
+    normalize_doc_number,
+)
+
+AUTO = "Авто (Приоритет С/Ф)"
+ACT = "Строго первый номер (Акт)"
+
+
+# Эталоны: реализации до выноса в extraction_core
+# (normalize_doc_number из processor.py, extract_number_regex из облачной функции)
+
+def baseline_normalize_doc_number(val):
+    if val is None:
+        return None
+    if isinstance(val, dict):
+        return str(list(val.values())[0]) if val.values() else None
+    s_val = str(val).strip()
+    if s_val.lower() in ("null", "none", "", "skip"):
+        return None
+    s_val = re.sub(r"^(номер|№|док|id)\s*", "", s_val, flags=re.IGNORECASE).strip()
+    return s_val
+
+
+def baseline_extract_number_regex(text):
+    if not text:
+        return ""
+    m = re.search(r"№\s*([A-Za-zА-Яа-я0-9/-]+)", text)
+    if m:
+        return m.group(1)
+    m = re.search(r"\b\d{2,}\b", text)
+    if m:
+        return m.group(0)
+    m = re.search(r"[A-Za-zА-Яа-я0-9/-]{3,}", text)
+    return m.group(0) if m else ""
+
+
+PIECES = [
+    "Реализация", "УПД", "сф", "с/ф", "сч-ф", "№", "№ ", "номер ", "Док", "ID", "от", "(", ")",
+    "20", "00012", "5123", "А-778/К", "20/DP", "12.01.2026", "null", "skip", " ", "  ", ",", "Оплата",
+]
+
+
+def random_texts(count, seed):
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 8))) for _ in range(count)]
+
+
+def test_normalize_doc_number_matches_baseline():
+    values = random_texts(2000, seed=1) + [None, 0, 12, 12.5, {}, {"n": 20}, {"n": None}, "None", "SKIP"]
+    for value in values:
+        assert normalize_doc_number(value) == baseline_normalize_doc_number(value), value
+
+
+def test_extract_number_regex_matches_baseline():
+    for text in random_texts(2000, seed=2) + ["", None]:
+        assert extract_number_regex(text) == baseline_extract_number_regex(text), text
+
+
+@pytest.mark.parametrize("text, mode, expected", [
+    # Авто: номер С/Ф важнее номера реализации
+    ("Продажа №20 от 12.01.2026 (сф 20/DP от 12.01.2026)", AUTO, ("20/DP", 0.95)),
+    ("Корректировка реализации 00012 (с/ф 12/DP)", AUTO, ("12/DP", 0.95)),
+    ("Продажа 77 от 01.01.2026 сч-ф 77/К", AUTO, ("77/К", 0.95)),
+    ("Реализация товаров 4512 от 01.02.2026 (20/DP)", AUTO, ("20/DP", 0.9)),
+    # Строго первый номер: номер акта вне скобок, даты не считаются номерами
+    ("Продажа №20 от 12.01.2026 (сф 20/DP от 12.01.2026)", ACT, ("20", 0.9)),
+    ("УПД № А-778/К от 01.01.2026", ACT, ("А-778/К", 0.9)),
+    ("Реализация №10 №11", ACT, ("10", 0.9)),
+    ("Реализация N 15 от 2024-01-10", ACT, ("15", 0.9)),
+    ("Реализация N15", AUTO, ("15", 0.9)),
+    # Даты в любом формате и количества с единицами номерами не считаются
+    ("Реализация товаров 2024-01-10", AUTO, (None, 0.0)),
+    ("Реализация товаров 2024.01.10", ACT, (None, 0.0)),
+    ("Реализация товаров 2 шт", AUTO, (None, 0.0)),
+    ("Реализация №5 на 1 500,00 руб.", ACT, ("5", 0.9)),
+    ("Продажа 3шт №7", ACT, ("7", 0.9)),
+    ("Акт сверки взаимных расчетов", ACT, (None, 0.0)),
+    ("", AUTO, (None, 0.0)),
+    (None, AUTO, (None, 0.0)),
+])
+def test_extract_doc_number_rules(text, mode, expected):
+    assert extract_doc_number_rules(text, mode) == expected
+
+
+@pytest.mark.parametrize("text, mode", [
+    # Неоднозначные строки должны уходить в LLM, как до правил
+    ("Оплата от покупателя, платежное поручение 889 от 10.01.26", AUTO),
+    ("Реализация №10 №11", AUTO),
+    ("Продажа 77 от 01.01.2026 сч-ф 77/К", ACT),
+    ("Реализация 15 (по договору 7)", AUTO),
+    # Число без знака № / N решает LLM
+    ("Корректировка реализации 00012 (с/ф 12/DP)", ACT),
+    ("Реализация (акт, накладная) 5123 от 03.02.26", ACT),
+    ("Реализация товаров 2 кг 7", AUTO),
+    ("Nestle реализация 15", ACT),
+])
+def test_ambiguous_rows_fall_back_to_llm(text, mode):
+    _, confidence = extract_doc_number_rules(text, mode)
+    assert confidence < RULE_CONFIDENCE_THRESHOLD
@@ -0,0 +1,72 @@
+import random
+
+from rapidfuzz import fuzz, process, utils
+
+from column_table import ColumnTable
+from partner_resolver import PartnerResolver
+
+PARTNER_COLS = {"IIKO": "Поставщик/Покупатель", "SBIS": "Контрагент", "FB": "Поставщик"}
+
+
+# Эталон: подбор контрагентов в perform_reconciliation до PartnerResolver.
+# Прежде контрагенты шли в process.extract множеством, и при равных очках на границе
+# limit выбор зависел от порядка обхода set; здесь (как и в резолвере) — по алфавиту.
+
+def baseline_matched_partners(records, partner_col, supplier_name, threshold=85, limit=5):
+    clean_supplier_name = supplier_name.split("(")[0].strip()
+    unique_partners = set()
+    for r in records:
+        p = r.get(partner_col, "")
+        if p:
+            unique_partners.add(str(p).strip())
+    matches = process.extract(
+        clean_supplier_name,
+        sorted(unique_partners),
+        scorer=fuzz.partial_ratio,
+        limit=limit,
+        processor=utils.default_process,
+    )
+    return {m[0] for m in matches if m[1] >= threshold}
+
+
+NAMES = ["Ромашка", "Молоко", "Вкусвилл", "Хлебозавод №1", "Лента", "Мираторг", "Агроторг", "Сыроварня"]
+FORMS = ["ООО", "АО", "ИП", "ООО ТД", ""]
+
+
+def random_partner(rnd):
+    name = rnd.choice(NAMES)
+    form = rnd.choice(FORMS)
+    text = rnd.choice([f"{form} {name}", f'{form} "{name}"', f"{name} {form}", f"{form} {name}-Юг", name.upper()])
+    return rnd.choice([text, f" {text} ", text + " (филиал)"])
+
+
+def random_system(rnd, col, size):
+    return [{col: rnd.choice([random_partner(rnd), random_partner(rnd), "", None]), "Сумма": i} for i in range(size)]
+
+
+def test_resolve_many_matches_per_supplier_extract():
+    rnd = random.Random(8)
+    system_data_map = {name: random_system(rnd, col, 300) for name, col in PARTNER_COLS.items()}
+    system_data_map["SAP"] = random_system(rnd, "Наименование контрагента", 10)
+    suppliers = [
+        "Ромашка (ИНН 7701000000)", "ООО Молоко", "Вкусвилл", "Хлебозавод", "Неизвестный поставщик",
+        "Лента (СПб)", "мираторг", "", "Сыроварня Юг",
+    ]
+    resolver = PartnerResolver(system_data_map, PARTNER_COLS)
+    resolved = resolver.resolve_many(suppliers)
+    for supplier in suppliers:
+        # Система без колонки контрагента в partner_cols не участвует
+        assert set(resolved[supplier]) == set(PARTNER_COLS)
+        for sys_name, col in PARTNER_COLS.items():
+            expected = baseline_matched_partners(system_data_map[sys_name], col, supplier)
+            assert resolved[supplier][sys_name] == expected, (supplier, sys_name)
+
+
+def test_resolve_is_cached_and_reads_column_tables():
+    rows = [{"Контрагент": "ООО Ромашка"}, {"Контрагент": "АО Молоко"}, {"Контрагент": ""}]
+    table = ColumnTable({"Контрагент": [r["Контрагент"] for r in rows]})
+    resolver = PartnerResolver({"SBIS": table, "IIKO": []}, {"SBIS": "Контрагент", "IIKO": "Поставщик/Покупатель"})
+    first = resolver.resolve("Ромашка (ИНН 1)")
+    assert first == {"SBIS": {"ООО Ромашка"}, "IIKO": set()}
+    assert first["SBIS"] == baseline_matched_partners(rows, "Контрагент", "Ромашка (ИНН 1)")
+    assert resolver.resolve("Ромашка (ИНН 1)") is first
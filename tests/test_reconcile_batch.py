@@ -0,0 +1,40 @@
+import reconciliation
+from reconciliation import SystemSnapshot, build_partner_resolver, reconcile_batch
+
+SUPPLIERS = ["ООО Ромашка", "АО Молоко", "ИП Иванов"]
+
+
+def system_data():
+    iiko, sap = [], []
+    for s, supplier in enumerate(SUPPLIERS):
+        for i in range(1, 6):
+            iiko.append({
+                "Входящий номер": f"{s}{i}", "Поставщик/Покупатель": supplier, "Склад": "Склад центральный",
+                "Сумма, р.": str(100 * i), "Комментарий": "",
+            })
+            sap.append({"Ссылка": f"{s}{i}", "Наименование контрагента": supplier, "Сумма в ВВ": str(-100 * i)})
+    return {"IIKO": iiko, "SAP": sap}
+
+
+def jobs():
+    return [
+        {"key": f"act{s}", "supplier": supplier,
+         "rows": [["01.01.2026", f"Реализация №{s}{i}", f"{s}{i}", str(100 * i)] for i in range(1, 5)]}
+        for s, supplier in enumerate(SUPPLIERS)
+    ]
+
+
+def test_batch_with_session_snapshot_matches_and_reuses_it(monkeypatch):
+    data = system_data()
+    expected = reconcile_batch(jobs(), data, max_workers=1)
+    assert expected["summary"]["totals"]["act_total"] == 3 * 1000
+
+    # Снимок из сессии: поставщики из настроек уже сопоставлены
+    snapshot = SystemSnapshot(data, build_partner_resolver(data))
+    snapshot.partner_resolver.resolve_many(SUPPLIERS[:2])
+    built = []
+    monkeypatch.setattr(reconciliation, "build_partner_resolver", lambda *args: built.append(args))
+    for workers in (1, 2):
+        assert reconcile_batch(jobs(), snapshot, max_workers=workers) == expected
+    assert built == []
+    assert set(SUPPLIERS) <= set(snapshot.partner_resolver._cache)
@@ -0,0 +1,101 @@
+import random
+
+from rapidfuzz import fuzz, process
+
+from tu_resolver import TUResolver
+
+
+# Эталон: поиск ТУ из app.py до TUResolver (по одному складу/покупателю за вызов)
+
+def baseline_find_tu_for_warehouse(warehouse_name, syrye_map, regular_map):
+    if not warehouse_name:
+        return ""
+    w_name = str(warehouse_name).strip()
+    if w_name.lower().startswith("сырье"):
+        parts = w_name.split("/", 1)
+        if len(parts) > 1:
+            target = parts[1].strip()
+            match = process.extractOne(target, syrye_map.keys(), scorer=fuzz.token_set_ratio)
+            if match and match[1] >= 85:
+                return syrye_map[match[0]]
+    match = process.extractOne(w_name, regular_map.keys(), scorer=fuzz.token_set_ratio)
+    if match and match[1] >= 85:
+        return regular_map[match[0]]
+    return ""
+
+
+def baseline_find_tu_for_buyer(buyer_raw, regular_map):
+    buyer_clean = buyer_raw.split("(")[0].strip()
+    match = process.extractOne(buyer_clean, regular_map.keys(), scorer=fuzz.token_set_ratio)
+    if match and match[1] >= 60:
+        return regular_map[match[0]]
+    return ""
+
+
+# Справочник как после load_tu_mapping: ключи и значения уже без пробелов по краям
+CITIES = ["КРД", "МСК", "СПБ", "РНД"]
+STREETS = ["Красная ул., 176", "Тверская ул., 1", "Невский пр., 28", "Садовая ул., 5", "Ленина ул., 10"]
+SYRYE_MAP = {f"{city} {street}": f"ТУ сырье {i}" for i, (city, street) in enumerate(
+    (city, street) for city in CITIES for street in STREETS)}
+REGULAR_MAP = {f"Кафе {city} {street}": f"ТУ {i}" for i, (city, street) in enumerate(
+    (city, street) for city in CITIES for street in STREETS[:3])}
+REGULAR_MAP.update({"Склад центральный": "ТУ центр", "Склад центральный 2": "ТУ центр 2"})
+
+
+def random_warehouse(rnd):
+    city = rnd.choice(CITIES)
+    street = rnd.choice(STREETS)
+    return rnd.choice([
+        f"Сырье / {city} {street}",
+        f"сырье/{street} {city}",
+        f"Сырье {city}",
+        f"Кафе {city} {street}",
+        f"  {street} {city} кафе ",
+        "Склад центральный",
+        "центральный склад",
+        # Сырье, которого нет в "Точка-ТУ СП": ищется полным названием среди обычных
+        "Сырье / Склад центральный",
+        "Сырье склад центральный",
+        f"Бар {rnd.randint(1, 9)}",
+        "",
+        None,
+    ])
+
+
+def random_buyer(rnd):
+    city = rnd.choice(CITIES)
+    street = rnd.choice(STREETS)
+    return rnd.choice([
+        f"ООО Кафе {city} ({street})",
+        f"{street} {city}",
+        f"Кафе {city}",
+        "Склад (центральный)",
+        "ИП Иванов",
+    ])
+
+
+def test_resolve_many_matches_per_warehouse_lookup():
+    rnd = random.Random(9)
+    resolver = TUResolver(SYRYE_MAP, REGULAR_MAP)
+    warehouses = [random_warehouse(rnd) for _ in range(400)]
+    # Двумя партиями: вторая частично отвечается из кэша
+    for batch in (warehouses[:150], warehouses):
+        resolved = resolver.resolve_many(batch)
+        for warehouse in batch:
+            assert resolved[warehouse] == baseline_find_tu_for_warehouse(warehouse, SYRYE_MAP, REGULAR_MAP), warehouse
+    assert resolver.resolve("Склад центральный") == "ТУ центр"
+
+
+def test_resolve_buyers_matches_fallback_lookup():
+    rnd = random.Random(10)
+    resolver = TUResolver(SYRYE_MAP, REGULAR_MAP)
+    buyers = [random_buyer(rnd) for _ in range(200)]
+    resolved = resolver.resolve_buyers(buyers)
+    for buyer in buyers:
+        assert resolved[buyer] == baseline_find_tu_for_buyer(buyer, REGULAR_MAP), buyer
+
+
+def test_empty_reference():
+    resolver = TUResolver({}, {})
+    assert resolver.resolve_many(["Сырье / КРД Красная ул., 176", ""]) == {"Сырье / КРД Красная ул., 176": "", "": ""}
+    assert resolver.resolve_buyers(["Кафе КРД"]) == {"Кафе КРД": ""}